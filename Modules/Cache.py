@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Number of tag version counters. Tags share counters by hash, so memory stays
+# fixed however many tags are used; invalidating one tag only makes concurrent
+# loads of the tags sharing its counter skip caching once.
+VERSION_SLOTS = 1024
+
+
+class LRUCache:
+    """
+    A thread-safe in-process LRU cache with optional time-to-live.
+
+    Entries can be tagged (e.g. with a story ID) so that every entry derived
+    from the same source can be invalidated at once. Each tag carries a
+    version that is bumped on invalidation; passing the version read before a
+    load to set() stops a slow reader from caching a value that a concurrent
+    write has already made stale. Versions are kept in VERSION_SLOTS shared
+    counters rather than per tag, so tags leave nothing behind once their
+    entries are gone.
+    """
+
+    def __init__(self, maxsize=256, ttl=None):
+        """
+        Args:
+            maxsize (int, optional): Maximum number of entries kept. Defaults to 256.
+            ttl (float, optional): Seconds an entry stays valid. None keeps entries until evicted.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (value, expires_at, tag)
+        self._tags = {}                 # tag -> set of keys
+        self._versions = [0] * VERSION_SLOTS   # invalidation counts, indexed by tag hash
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default on a miss or expired entry."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at, tag = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key, tag)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tag=None, version=None):
+        """
+        Stores a value, evicting the least recently used entry when full.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+            tag (optional): Groups the entry for invalidate_tag().
+            version (int, optional): The tag version read before the value was
+                loaded. If the tag has been invalidated since, the value is dropped.
+
+        Returns:
+            bool: Whether the value was stored.
+        """
+        with self._lock:
+            if version is not None and self._versions[self._slot(tag)] != version:
+                return False
+            if key in self._entries:
+                self._remove(key, self._entries[key][2])
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._entries[key] = (value, expires_at, tag)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                old_key, (_, _, old_tag) = next(iter(self._entries.items()))
+                self._remove(old_key, old_tag)
+                self.evictions += 1
+            return True
+
+    def version(self, tag):
+        """Returns the current version of a tag, to be passed to set()."""
+        with self._lock:
+            return self._versions[self._slot(tag)]
+
+    def invalidate(self, key):
+        """Removes a single entry."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, self._entries[key][2])
+                self.invalidations += 1
+
+    def invalidate_tag(self, tag):
+        """Removes every entry stored under a tag and bumps its version."""
+        with self._lock:
+            self._versions[self._slot(tag)] += 1
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key, tag)
+                self.invalidations += 1
+
+    def clear(self):
+        """Removes all entries. Counters are kept."""
+        with self._lock:
+            # Bump every counter, so loads started before the clear are not stored.
+            self._versions = [count + 1 for count in self._versions]
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        """Returns the cache counters and current size."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    @staticmethod
+    def _slot(tag):
+        return hash(tag) % VERSION_SLOTS
+
+    def _remove(self, key, tag):
+        """Removes an entry and its tag membership. Caller holds the lock."""
+        del self._entries[key]
+        if tag is not None:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from Modules.Cache import LRUCache
+
+
+def canonical_prompt(prompt):
+    """
+    Returns the canonical form of a prompt.
+
+    Prompts built by Scenario.compose_prompt are JSON strings; they are
+    re-serialized with compact separators so that prompts differing only in
+    whitespace share a cache entry. Key order is kept: the model reads the
+    sections in order, so reordering them can change its output. Any other
+    prompt is used as is.
+    """
+    if not isinstance(prompt, str):
+        return json.dumps(prompt, separators=(",", ":"), ensure_ascii=False)
+    try:
+        return json.dumps(json.loads(prompt), separators=(",", ":"), ensure_ascii=False)
+    except ValueError:
+        return prompt
+
+
+def completion_key(prompt, model, config):
+    """Returns the content address of a completion: a SHA-256 of prompt, model and config."""
+    material = json.dumps(
+        {"prompt": canonical_prompt(prompt), "model": model, "config": config or {}},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(config):
+    """Whether a generation config requests greedy decoding, so that a completion can be reused."""
+    config = config or {}
+    if config.get("do_sample"):
+        return False
+    temperature = config.get("temperature")
+    return temperature is None or temperature <= 0
+
+
+class CompletionCache:
+    """
+    A content-addressed cache of LLM completions.
+
+    Completions are kept in an in-memory LRU and, when a path is given, in a
+    SQLite file so that they survive restarts. Memory misses fall through to
+    SQLite and are promoted back into memory.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, path=None, allow_sampled=False):
+        """
+        Args:
+            maxsize (int, optional): Completions kept in memory. Defaults to 1024.
+            ttl (float, optional): Seconds a completion stays valid, in memory and on disk.
+                None keeps completions until evicted.
+            path (str, optional): SQLite file for the on-disk store. None keeps completions in memory only.
+            allow_sampled (bool, optional): Also cache completions generated with
+                temperature > 0 or do_sample. Defaults to False.
+        """
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.path = path
+        self.allow_sampled = allow_sampled
+        self.bypassed = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY, model TEXT, completion TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def cacheable(self, config):
+        """Whether completions generated with this config may be cached."""
+        return self.allow_sampled or is_deterministic(config)
+
+    def get(self, prompt, model, config):
+        """
+        Returns the cached completion for a prompt, or None on a miss or when
+        the config is not cacheable.
+        """
+        if not self.cacheable(config):
+            with self._lock:
+                self.bypassed += 1
+            return None
+        key = completion_key(prompt, model, config)
+        completion = self.memory.get(key)
+        if completion is None and self._conn is not None:
+            completion = self._load(key)
+            if completion is not None:
+                self.memory.set(key, completion)
+        return completion
+
+    def set(self, prompt, model, config, completion):
+        """Stores a completion. Completions for configs that are not cacheable are ignored."""
+        if not self.cacheable(config):
+            return
+        key = completion_key(prompt, model, config)
+        self.memory.set(key, completion)
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO completions (key, model, completion, created_at) VALUES (?, ?, ?, ?)",
+                    (key, model, completion, time.time()),
+                )
+                self._conn.commit()
+
+    def delete(self, prompt, model, config):
+        """Removes one completion, in memory and on disk, e.g. when it turned out to be unusable."""
+        key = completion_key(prompt, model, config)
+        self.memory.invalidate(key)
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._conn.commit()
+
+    def clear(self):
+        """Removes every cached completion, in memory and on disk."""
+        self.memory.clear()
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute("DELETE FROM completions")
+                self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self):
+        """Returns the in-memory cache counters plus the number of bypassed lookups."""
+        stats = self.memory.stats()
+        stats["bypassed"] = self.bypassed
+        return stats
+
+    def _load(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT completion, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        completion, created_at = row
+        if self.ttl is not None and created_at + self.ttl <= time.time():
+            return None
+        return completion
@@ -0,0 +1,86 @@
+from neo4j import GraphDatabase
+
+# Driver settings used unless overridden. Connections are pooled by the driver
+# and shared by every session, so callers should open short-lived sessions per
+# unit of work rather than holding on to one.
+DEFAULT_DRIVER_CONFIG = {
+    "max_connection_pool_size": 50,         # Connections kept per server.
+    "connection_acquisition_timeout": 30.0, # Seconds to wait for a free connection.
+    "max_connection_lifetime": 3600,        # Seconds before a pooled connection is recycled.
+    "max_transaction_retry_time": 15.0,     # Seconds managed transactions retry transient errors.
+}
+
+
+class DataLayer:
+    """
+    Owns the Neo4j driver and runs all work through managed transactions.
+
+    Managed transactions (execute_read / execute_write) are retried by the
+    driver on transient errors such as deadlocks, leader switches and dropped
+    connections, so transaction functions passed here must be idempotent and
+    must not have side effects outside the transaction.
+    """
+
+    def __init__(self, uri, user, password, **driver_config):
+        self.config = {**DEFAULT_DRIVER_CONFIG, **driver_config}
+        self.driver = GraphDatabase.driver(uri, auth=(user, password), **self.config)
+
+    def close(self):
+        self.driver.close()
+
+    def read(self, work, *args, **kwargs):
+        """
+        Runs a transaction function in a managed read transaction.
+
+        Args:
+            work (callable): Called as work(tx, *args, **kwargs).
+
+        Returns:
+            The value returned by work.
+        """
+        with self.driver.session() as session:
+            return session.execute_read(work, *args, **kwargs)
+
+    def write(self, work, *args, **kwargs):
+        """
+        Runs a transaction function in a managed write transaction.
+
+        Args:
+            work (callable): Called as work(tx, *args, **kwargs).
+
+        Returns:
+            The value returned by work.
+        """
+        with self.driver.session() as session:
+            return session.execute_write(work, *args, **kwargs)
+
+    def run_read(self, query, params=None):
+        """Runs a single read query and returns its records as a list of dicts."""
+        return self.read(_run_query, query, params or {})
+
+    def run_write(self, query, params=None):
+        """Runs a single write query and returns its records as a list of dicts."""
+        return self.write(_run_query, query, params or {})
+
+    def execute_cypher(self, query, params=None, write=True):
+        """
+        Runs a single query, reporting failures instead of raising them.
+
+        Args:
+            query (str): The Cypher query.
+            params (dict, optional): Query parameters.
+            write (bool, optional): Run in a write transaction. Defaults to True.
+
+        Returns:
+            tuple: (records, None) on success or (None, error message) on failure.
+        """
+        try:
+            records = self.run_write(query, params) if write else self.run_read(query, params)
+            return records, None
+        except Exception as e:
+            return None, str(e)
+
+
+def _run_query(tx, query, params):
+    """Transaction function that runs one query and materializes its records."""
+    return tx.run(query, params).data()
@@ -1,71 +1,843 @@
-from neo4j import GraphDatabase
+import json
+from Modules.Cache import LRUCache
+from Modules.DataLayer import DataLayer
+
+# Labels whose state can be rotated by commit_entry. Labels cannot be passed as
+# query parameters, so they are checked against this list before being
+# interpolated into Cypher.
+STATEFUL_LABELS = ("Trait", "Character", "Location")
+
+
+def group_state_changes(state_changes):
+    """
+    Groups state changes by object label for UNWIND batching.
+
+    If the same object is changed more than once in a single commit only the
+    last change is kept, since all rows of one UNWIND are matched before any
+    History rotation is written.
+
+    Args:
+        state_changes (list): State change dicts with "type", "id" and "new_state".
+
+    Returns:
+        dict: Maps each label to a list of {"id", "new_state"} dicts.
+    """
+    grouped = {}
+    for change in state_changes:
+        obj_type = change["type"]
+        if obj_type not in STATEFUL_LABELS:
+            raise ValueError(f"Unsupported state change type: {obj_type}")
+        grouped.setdefault(obj_type, {})[change["id"]] = change["new_state"]
+    return {
+        label: [{"id": obj_id, "new_state": new_state} for obj_id, new_state in changes.items()]
+        for label, changes in grouped.items()
+    }
+
+
+def page_info(entries, first, last, entry_count):
+    """
+    Builds the cursor block returned alongside a page of entries.
+
+    Args:
+        entries (list): The entries in the page, in story order.
+        first (int): Ordinal of the first requested entry.
+        last (int): Ordinal of the last requested entry.
+        entry_count (int): Total number of entries in the story.
+
+    Returns:
+        dict: Cursors for the neighbouring pages and whether they exist.
+    """
+    return {
+        "entry_count": entry_count,
+        "before": entries[0]["entry_id"] if entries else None,
+        "after": entries[-1]["entry_id"] if entries else None,
+        "has_more_before": first > 1,
+        "has_more_after": last < entry_count,
+    }
+
+
+def lineage_segments(info, first, last, include_own=True):
+    """
+    Resolves an ordinal range of a story into per-story ranges along its branch lineage.
+
+    A branch stores only its own entries. Ordinals up to each fork point are
+    read from the ancestor that owns them, so a branch forked from a story at
+    ordinal 8 reads 1..8 from the parent and 9.. from itself.
+
+    Args:
+        info (dict): The story's "story_id", "entry_count", "lineage" (ancestor
+            IDs from the root down) and "lineage_ordinals" (fork ordinal in each).
+        first (int): First ordinal of the range.
+        last (int): Last ordinal of the range.
+        include_own (bool, optional): Include the story's own segment. Defaults to True.
+
+    Returns:
+        list: {"story_id", "first", "last"} dicts in story order.
+    """
+    last = min(last, info["entry_count"])
+    segments = []
+    lower = 1
+    for ancestor_id, fork_ordinal in zip(info["lineage"], info["lineage_ordinals"]):
+        lo, hi = max(first, lower), min(last, fork_ordinal)
+        if lo <= hi:
+            segments.append({"story_id": ancestor_id, "first": lo, "last": hi})
+        lower = fork_ordinal + 1
+    lo = max(first, lower)
+    if include_own and lo <= last:
+        segments.append({"story_id": info["story_id"], "first": lo, "last": last})
+    return segments
+
+
+def legacy_entry_order(rows):
+    """
+    Orders the entries of a story written before entries had ordinals.
+
+    Entries linked by Entry-to-Entry NEXT relationships follow that chain.
+    Chains, and entries with no links at all, are ordered by node creation
+    sequence, the only ordering such entries carry.
+
+    Args:
+        rows (list): Dicts with the entry's "id", the "next" entry's ID (or None)
+            and its creation "sequence".
+
+    Returns:
+        list: Entry IDs in story order.
+    """
+    following = {row["id"]: row["next"] for row in rows}
+    sequence = {row["id"]: row["sequence"] for row in rows}
+    linked = {row["next"] for row in rows if row["next"] in following}
+    order, seen = [], set()
+    # Chain heads first, then whatever a cycle left unvisited.
+    starts = sorted(following, key=lambda entry_id: (entry_id in linked, sequence[entry_id]))
+    for entry_id in starts:
+        while entry_id in following and entry_id not in seen:
+            seen.add(entry_id)
+            order.append(entry_id)
+            entry_id = following[entry_id]
+    return order
+
+
+# Rows written per transaction by import_world and read per page by export_world.
+WORLD_BATCH_SIZE = 500
+
+# Labels written by import_world, the properties each carries (mirroring
+# create_trait, create_character and create_location) and whether the label
+# owns traits through HAS_TRAIT relationships.
+WORLD_LABELS = {
+    "traits": ("Trait", ("title", "description"), False),
+    "characters": ("Character", ("name", "description"), True),
+    "locations": ("Location", ("name", "description"), True),
+}
+
+# The world kept by the Telegram command layer (modules/CommandHandler.py), in
+# the same form. Its nodes hold whatever properties their commands set; these
+# are the ones export_world reads.
+COMMAND_WORLD_LABELS = {
+    "traits": ("BaseTrait", ("name", "title", "description"), False),
+    "characters": ("BaseCharacter", ("name", "description"), True),
+    "locations": ("BaseLocation", ("name", "description", "path"), True),
+}
+
+# Labels that can own traits.
+TRAIT_OWNER_LABELS = ("Character", "Location")
+
+# Number of nodes prune_story deletes per transaction.
+PRUNE_BATCH_SIZE = 1000
+
+# A full state Snapshot is written every SNAPSHOT_INTERVAL entries, so
+# reconstructing any point of a story replays at most that many entries' deltas.
+SNAPSHOT_INTERVAL = 50
+
+
+# Reserves the next ordinal of a story. Incrementing entry_count takes the write
+# lock on the Story node, so concurrent appends to the same story are
+# serialized and ordinals stay gapless. No row is returned while a prune is
+# still deleting entries that hold the ordinals after entry_count.
+_RESERVE_ORDINAL = """
+    MERGE (story:Story {id: $story_id})
+    ON CREATE SET story.created_at = timestamp()
+    SET story.entry_count = coalesce(story.entry_count, 0) + 1
+    WITH story WHERE story.pruning IS NULL
+"""
+
+# Creates an Entry (and its Summary) with a reserved ordinal at the tail of a
+# story, linking it from the previous tail and moving the TAIL pointer. The
+# first entry of a branch follows its parent's fork entry, which is not linked
+# to it: NEXT chains never cross stories.
+_LINK_ENTRY = """
+    OPTIONAL MATCH (story)-[old_tail:TAIL]->(prev:Entry)
+    CREATE (e:Entry {id: entry_id, story_id: $story_id, text: $entry_text, ordinal: ordinal})
+    CREATE (s:Summary {text: $summary_text})
+    CREATE (e)-[:NEXT]->(s)
+    CREATE (story)-[:TAIL]->(e)
+    DELETE old_tail
+    FOREACH (ignored IN CASE WHEN prev IS NULL THEN [1] ELSE [] END | CREATE (story)-[:HEAD]->(e))
+    FOREACH (ignored IN CASE WHEN prev.story_id = $story_id THEN [1] ELSE [] END | CREATE (prev)-[:NEXT]->(e))
+    RETURN e.id AS entry_id, e.ordinal AS ordinal
+"""
+
+# Appends an Entry in one statement.
+APPEND_ENTRY_QUERY = _RESERVE_ORDINAL + """
+    WITH story, randomUUID() AS entry_id, story.entry_count AS ordinal
+""" + _LINK_ENTRY
+
 
 class Database:
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(self, uri=None, user=None, password=None, data_layer=None,
+                 snapshot_interval=SNAPSHOT_INTERVAL, state_cache_size=256, state_cache_ttl=300,
+                 **driver_config):
+        """
+        Args:
+            uri, user, password (str): Neo4j connection details, used when no data_layer is given.
+            data_layer (DataLayer, optional): An existing data layer to share.
+            snapshot_interval (int, optional): Entries between state Snapshots. Defaults to SNAPSHOT_INTERVAL.
+            state_cache_size (int, optional): Number of retrieve_state results kept in memory. Defaults to 256.
+            state_cache_ttl (float, optional): Seconds a cached result stays valid. Defaults to 300.
+            **driver_config: Driver settings such as max_connection_pool_size,
+                connection_acquisition_timeout and max_connection_lifetime.
+        """
+        self.data_layer = data_layer or DataLayer(uri, user, password, **driver_config)
+        self.driver = self.data_layer.driver
+        self.snapshot_interval = snapshot_interval
+        # Read-through cache for retrieve_state, tagged by story and invalidated
+        # by every method that writes to a story.
+        self.state_cache = LRUCache(maxsize=state_cache_size, ttl=state_cache_ttl)
+        # Callbacks told about every write to a story, see add_listener.
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """
+        Registers a callback for writes to story state.
+
+        The listener is called as listener(event, story_id, changes) after
+        the write has committed:
+            - "commit": an entry was committed; changes lists its state changes
+              in the form taken by commit_entry,
+            - "invalidate": the story's state changed in a way that cannot be
+              described as changes (prune, new branch); changes is None,
+            - "world": world nodes were created, changed or deleted; story_id
+              and changes are None.
+        Exceptions raised by listeners are ignored.
+        """
+        self.listeners.append(listener)
+
+    def _notify(self, event, story_id, changes=None):
+        for listener in list(self.listeners):
+            try:
+                listener(event, story_id, changes)
+            except Exception:
+                pass
 
     def close(self):
-        self.driver.close()
+        self.data_layer.close()
+
+    def execute_cypher(self, query, params=None, write=True):
+        """Runs a single query through the data layer, returning (records, error)."""
+        return self.data_layer.execute_cypher(query, params, write=write)
 
     def setup_schema(self):
-        """Ensures the database schema supports the required node and relationship types."""
-        with self.driver.session() as session:
-            # Execute each CREATE CONSTRAINT statement separately
-            session.run("CREATE CONSTRAINT IF NOT EXISTS FOR (e:Entry) REQUIRE e.id IS UNIQUE;")
-            session.run("CREATE CONSTRAINT IF NOT EXISTS FOR (t:Trait) REQUIRE t.id IS UNIQUE;")
-            session.run("CREATE CONSTRAINT IF NOT EXISTS FOR (c:Character) REQUIRE c.id IS UNIQUE;")
-            session.run("CREATE CONSTRAINT IF NOT EXISTS FOR (l:Location) REQUIRE l.id IS UNIQUE;")
+        """
+        Ensures the database schema supports the required node and relationship types,
+        then numbers the entries of legacy stories with backfill_ordinals.
+
+        Returns:
+            dict: The result of backfill_ordinals.
+        """
+        # Execute each CREATE CONSTRAINT statement separately
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (e:Entry) REQUIRE e.id IS UNIQUE;")
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (t:Trait) REQUIRE t.id IS UNIQUE;")
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (c:Character) REQUIRE c.id IS UNIQUE;")
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (l:Location) REQUIRE l.id IS UNIQUE;")
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (s:Story) REQUIRE s.id IS UNIQUE;")
+        # Entries are looked up by position within their story.
+        self.data_layer.run_write("CREATE INDEX entry_story_ordinal IF NOT EXISTS FOR (e:Entry) ON (e.story_id, e.ordinal);")
+        # History rotations are looked up by id and by position when rolling back.
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (h:History) REQUIRE h.id IS UNIQUE;")
+        self.data_layer.run_write("CREATE INDEX history_story_ordinal IF NOT EXISTS FOR (h:History) ON (h.story_id, h.ordinal);")
+        self.data_layer.run_write("CREATE INDEX snapshot_story_ordinal IF NOT EXISTS FOR (s:Snapshot) ON (s.story_id, s.ordinal);")
+        # Labels used by the Telegram command layer (modules/CommandHandler.py). The
+        # uniqueness constraints also back the keyset pagination of list commands.
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (c:BaseCharacter) REQUIRE c.id IS UNIQUE;")
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (t:BaseTrait) REQUIRE t.id IS UNIQUE;")
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (l:BaseLocation) REQUIRE l.id IS UNIQUE;")
+        self.data_layer.run_write("CREATE CONSTRAINT IF NOT EXISTS FOR (s:Scenario) REQUIRE s.id IS UNIQUE;")
+        # Locations are addressed by path, so a path names at most one location. The
+        # constraint's range index serves exact and STARTS WITH lookups and replaces
+        # the plain path index of earlier schemas.
+        self.data_layer.run_write("DROP INDEX base_location_path IF EXISTS;")
+        self.data_layer.run_write("CREATE CONSTRAINT base_location_path IF NOT EXISTS FOR (l:BaseLocation) REQUIRE l.path IS UNIQUE;")
+        # Children of a location, for sibling lookups in the location hierarchy.
+        self.data_layer.run_write("CREATE INDEX base_location_parent_path IF NOT EXISTS FOR (l:BaseLocation) ON (l.parent_path);")
+        return self.backfill_ordinals()
+
+    def backfill_ordinals(self):
+        """
+        Numbers the entries of stories written before entries had ordinals.
+
+        Each such story gets ordinals in the order given by legacy_entry_order,
+        a NEXT chain between consecutive entries, its entry_count and its HEAD
+        and TAIL pointers, one story per transaction. Stories whose entries
+        are all numbered are not touched, so this is cheap to run on every
+        startup. A story with both numbered and unnumbered entries was
+        appended to before the backfill ran; renumbering it would move
+        History and Snapshot ordinals, so it is skipped and reported. Each
+        story is locked before its entries are read, so workers starting
+        together number a story once.
+
+        Returns:
+            dict: The IDs of the "backfilled" and "skipped" stories.
+        """
+        story_ids = self.data_layer.run_read("""
+            MATCH (e:Entry) WHERE e.ordinal IS NULL AND e.story_id IS NOT NULL
+            RETURN DISTINCT e.story_id AS story_id
+        """)
+        result = {"backfilled": [], "skipped": []}
+        for row in story_ids:
+            story_id = row["story_id"]
+            outcome = self.data_layer.write(self._backfill_story_tx, story_id)
+            if outcome is None:
+                continue
+            result[outcome].append(story_id)
+            self.state_cache.invalidate_tag(story_id)
+            self._notify("invalidate", story_id)
+        return result
+
+    @staticmethod
+    def _backfill_story_tx(tx, story_id):
+        """
+        Transaction function for backfill_ordinals.
+
+        Returns:
+            str: "backfilled", or "skipped" if the story is partly numbered. None if
+                every entry was numbered meanwhile, by another process's backfill.
+        """
+        # Take the story's write lock first; a concurrent backfill of the story then waits and finds it numbered.
+        tx.run("""
+            MERGE (story:Story {id: $story_id})
+            ON CREATE SET story.created_at = timestamp()
+            SET story.backfilled_at = timestamp()
+        """, story_id=story_id).consume()
+        rows = tx.run("""
+            MATCH (e:Entry {story_id: $story_id})
+            OPTIONAL MATCH (e)-[:NEXT]->(next:Entry {story_id: $story_id})
+            RETURN e.id AS id, e.ordinal AS ordinal, next.id AS next, id(e) AS sequence
+        """, story_id=story_id).data()
+        numbered = sum(row["ordinal"] is not None for row in rows)
+        if numbered == len(rows):
+            return None
+        if numbered:
+            return "skipped"
+        order = legacy_entry_order(rows)
+        tx.run("""
+            UNWIND range(0, size($order) - 1) AS i
+            MATCH (e:Entry {id: $order[i]})
+            SET e.ordinal = i + 1
+            WITH e, i
+            MATCH (next:Entry {id: $order[i + 1]})
+            MERGE (e)-[:NEXT]->(next)
+        """, order=order).consume()
+        tx.run("""
+            MATCH (story:Story {id: $story_id})
+            SET story.entry_count = size($order)
+            WITH story
+            OPTIONAL MATCH (story)-[pointer:HEAD|TAIL]->()
+            DELETE pointer
+            WITH DISTINCT story
+            MATCH (head:Entry {id: $order[0]}), (tail:Entry {id: $order[-1]})
+            CREATE (story)-[:HEAD]->(head)
+            CREATE (story)-[:TAIL]->(tail)
+        """, story_id=story_id, order=order).consume()
+        return "backfilled"
 
     def create_trait(self, id, title, description):
         """Creates a Trait node in the database if it doesn't already exist."""
-        with self.driver.session() as session:
-            session.run("""
-                MERGE (t:Trait {id: $id})
-                ON CREATE SET t.title = $title, t.description = $description
-            """, id=id, title=title, description=description)
+        self.data_layer.run_write("""
+            MERGE (t:Trait {id: $id})
+            ON CREATE SET t.title = $title, t.description = $description
+        """, {"id": id, "title": title, "description": description})
+        self.world_changed()
 
     def create_character(self, id, name, description):
         """Creates a Character node in the database if it doesn't already exist."""
-        with self.driver.session() as session:
-            session.run("""
-                MERGE (c:Character {id: $id})
-                ON CREATE SET c.name = $name, c.description = $description
-            """, id=id, name=name, description=description)
+        self.data_layer.run_write("""
+            MERGE (c:Character {id: $id})
+            ON CREATE SET c.name = $name, c.description = $description
+        """, {"id": id, "name": name, "description": description})
+        self.world_changed()
 
     def create_location(self, id, name, description):
         """Creates a Location node in the database if it doesn't already exist."""
-        with self.driver.session() as session:
-            session.run("""
-                MERGE (l:Location {id: $id})
-                ON CREATE SET l.name = $name, l.description = $description
-            """, id=id, name=name, description=description)
-
-    def retrieve_state(self, story_id):
-        """Retrieves the current state of the narrative and game objects for a given story."""
-        with self.driver.session() as session:
-            # Retrieve narrative entries
-            entries = session.run("""
-                MATCH (e:Entry)-[:NEXT*]->(s:Summary)
-                WHERE e.story_id = $story_id
-                RETURN e.id AS entry_id, e.text AS entry_text, s.text AS summary_text
-            """, story_id=story_id).data()
-
-            # Retrieve mutable state (Traits, Characters, Locations)
-            state = session.run("""
-                MATCH (h:History)-[:CURRENT]->(t:Trait)
-                WHERE h.story_id = $story_id
-                RETURN t.id AS trait_id, t.title AS trait_title, t.description AS trait_description
-            """, story_id=story_id).data()
+        self.data_layer.run_write("""
+            MERGE (l:Location {id: $id})
+            ON CREATE SET l.name = $name, l.description = $description
+        """, {"id": id, "name": name, "description": description})
+        self.world_changed()
+
+    def import_world(self, traits=(), characters=(), locations=(), batch_size=WORLD_BATCH_SIZE):
+        """
+        Creates Trait, Character and Location nodes in bulk.
+
+        Rows are written with one UNWIND MERGE query per batch of batch_size,
+        each batch in its own transaction. As with create_trait and friends,
+        nodes that already exist are left unchanged. Characters and locations
+        may list trait IDs under "traits"; a HAS_TRAIT relationship to each is
+        merged in the same transaction as the owner. Traits are written first
+        so they exist by the time their owners are linked.
+
+        Args:
+            traits (iterable): Dicts with "id", "title" and "description".
+            characters (iterable): Dicts with "id", "name", "description" and optionally "traits".
+            locations (iterable): Dicts with "id", "name", "description" and optionally "traits".
+            batch_size (int, optional): Rows per transaction. Defaults to WORLD_BATCH_SIZE.
+
+        Returns:
+            dict: Number of rows written per kind.
+        """
+        counts = {}
+        for kind, rows in (("traits", traits), ("characters", characters), ("locations", locations)):
+            label, properties, has_traits = WORLD_LABELS[kind]
+            counts[kind] = 0
+            batch = []
+            for row in rows:
+                record = {key: row.get(key) for key in ("id",) + properties}
+                if has_traits:
+                    record["traits"] = list(row.get("traits") or [])
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    counts[kind] += self.data_layer.write(self._import_batch_tx, label, properties, has_traits, batch)
+                    batch = []
+            if batch:
+                counts[kind] += self.data_layer.write(self._import_batch_tx, label, properties, has_traits, batch)
+        self.world_changed()
+        return counts
+
+    def world_changed(self):
+        """
+        Drops every cached retrieve_state result after a world write and tells
+        listeners with a "world" event. Called by the world-writing methods
+        here, and by code that writes world nodes directly, such as the
+        command layer.
+
+        The stories affected by a new node are those with History for its ID,
+        including branches inheriting it, which cannot be found without
+        scanning History. World writes are rare, so all stories are dropped.
+        """
+        self.state_cache.clear()
+        self._notify("world", None)
+
+    @staticmethod
+    def _import_batch_tx(tx, label, properties, has_traits, rows):
+        """Merges one batch of nodes of a single label, and their HAS_TRAIT relationships."""
+        assignments = ", ".join(f"n.{key} = row.{key}" for key in properties)
+        tx.run(f"""
+            UNWIND $rows AS row
+            MERGE (n:{label} {{id: row.id}})
+            ON CREATE SET {assignments}
+        """, rows=rows).consume()
+        if has_traits:
+            tx.run(f"""
+                UNWIND $rows AS row
+                UNWIND row.traits AS trait_id
+                MATCH (n:{label} {{id: row.id}})
+                MATCH (t:Trait {{id: trait_id}})
+                MERGE (n)-[:HAS_TRAIT]->(t)
+            """, rows=rows).consume()
+        return len(rows)
+
+    def export_world(self, batch_size=WORLD_BATCH_SIZE, labels=WORLD_LABELS):
+        """
+        Streams every Trait, Character and Location node.
+
+        Nodes are read in pages of batch_size ordered by id, each page in its
+        own read transaction, so memory use stays flat for large worlds.
+
+        Args:
+            batch_size (int, optional): Nodes read per transaction. Defaults to WORLD_BATCH_SIZE.
+            labels (dict, optional): The labels to read, in the form of WORLD_LABELS.
+
+        Yields:
+            dict: One node's properties plus a "kind" key ("traits", "characters" or
+                "locations"). Characters and locations also list their trait IDs under "traits".
+        """
+        for kind, (label, properties, has_traits) in labels.items():
+            after = ""
+            while True:
+                rows = self.data_layer.read(self._export_page_tx, label, properties, has_traits, after, batch_size)
+                for row in rows:
+                    row["kind"] = kind
+                    yield row
+                if len(rows) < batch_size:
+                    break
+                after = rows[-1]["id"]
+
+    def export_command_world(self, batch_size=WORLD_BATCH_SIZE):
+        """
+        Streams every BaseTrait, BaseCharacter and BaseLocation node, as export_world does for the story world.
+
+        Args:
+            batch_size (int, optional): Nodes read per transaction. Defaults to WORLD_BATCH_SIZE.
+
+        Yields:
+            dict: One node's properties plus a "kind" key, as yielded by export_world.
+        """
+        return self.export_world(batch_size, COMMAND_WORLD_LABELS)
+
+    @staticmethod
+    def _export_page_tx(tx, label, properties, has_traits, after, limit):
+        """Reads one page of nodes of a single label with ids greater than after."""
+        columns = ", ".join(f"n.{key} AS {key}" for key in properties)
+        if has_traits:
+            columns += ", COLLECT { MATCH (n)-[:HAS_TRAIT]->(t) RETURN t.id } AS traits"
+        return tx.run(f"""
+            MATCH (n:{label})
+            WHERE n.id > $after
+            WITH n ORDER BY n.id LIMIT $limit
+            RETURN n.id AS id, {columns}
+        """, after=after, limit=limit).data()
+
+    def get_entity_with_traits(self, label, entity_id):
+        """
+        Fetches a Character or Location together with all of its traits in one query.
+
+        Args:
+            label (str): "Character" or "Location".
+            entity_id (str): The ID of the entity.
+
+        Returns:
+            dict: The entity's properties with its traits' properties under "traits", or None if not found.
+        """
+        entities = self.get_entities_with_traits(label, [entity_id])
+        return entities[0] if entities else None
+
+    def get_entities_with_traits(self, label, entity_ids):
+        """
+        Fetches several Characters or Locations together with their traits in one query.
+
+        Args:
+            label (str): "Character" or "Location".
+            entity_ids (list): The IDs of the entities.
 
-            # Combine narrative and state into a structured response
-            return {
-                "entries": entries,
-                "state": state
+        Returns:
+            list: The entities found, each with its traits under "traits".
+        """
+        if label not in TRAIT_OWNER_LABELS:
+            raise ValueError(f"Unsupported trait owner type: {label}")
+        return self.data_layer.read(self._entities_with_traits_tx, label, list(entity_ids))
+
+    @staticmethod
+    def _entities_with_traits_tx(tx, label, entity_ids):
+        """Transaction function for get_entities_with_traits."""
+        records = tx.run(f"""
+            UNWIND $entity_ids AS entity_id
+            MATCH (n:{label} {{id: entity_id}})
+            RETURN n {{.*, traits: COLLECT {{ MATCH (n)-[:HAS_TRAIT]->(t:Trait) RETURN t {{.*}} }}}} AS entity
+        """, entity_ids=entity_ids)
+        return [record["entity"] for record in records]
+
+    def retrieve_state(self, story_id, last_n=None):
+        """
+        Retrieves the current state of the narrative and game objects for a given story.
+
+        Entries are read by ordinal from the (story_id, ordinal) index, so the
+        cost depends on the number of entries returned, not on story length.
+        Results are served from the state cache until the story is written to;
+        callers must treat them as read-only.
+
+        Args:
+            story_id (str): The ID of the story.
+            last_n (int, optional): Only return the most recent last_n entries.
+
+        Returns:
+            dict: "entries" in story order and the current "state".
+        """
+        key = (story_id, last_n)
+        result = self.state_cache.get(key)
+        if result is None:
+            version = self.state_cache.version(story_id)
+            result = self.data_layer.read(self._retrieve_state_tx, story_id, last_n)
+            self.state_cache.set(key, result, tag=story_id, version=version)
+        return result
+
+    def get_summaries(self, story_id):
+        """
+        Returns the summaries of a story's entries, oldest first, including those a branch inherits.
+
+        Args:
+            story_id (str): The ID of the story.
+
+        Returns:
+            list: One summary text per entry in story order, "" for entries without one.
+        """
+        return self.data_layer.read(self._summaries_tx, story_id)
+
+    @staticmethod
+    def _summaries_tx(tx, story_id):
+        """Transaction function for get_summaries."""
+        info = Database._story_info(tx, story_id)
+        segments = lineage_segments(info, 1, info["entry_count"])
+        if not segments:
+            return []
+        return tx.run("""
+            UNWIND $segments AS seg
+            MATCH (e:Entry)
+            WHERE e.story_id = seg.story_id AND e.ordinal >= seg.first AND e.ordinal <= seg.last
+            OPTIONAL MATCH (e)-[:NEXT]->(s:Summary)
+            RETURN coalesce(s.text, "") AS summary
+            ORDER BY e.ordinal
+        """, segments=segments).value("summary")
+
+    def cache_stats(self):
+        """Returns hit, miss and eviction counters for the state cache."""
+        return self.state_cache.stats()
+
+    @staticmethod
+    def _retrieve_state_tx(tx, story_id, last_n):
+        """Transaction function for retrieve_state."""
+        info = Database._story_info(tx, story_id)
+        entry_count = info["entry_count"]
+        first = 1 if last_n is None else max(1, entry_count - last_n + 1)
+
+        # Retrieve narrative entries
+        entries = Database._entries_range(tx, info, first, entry_count)
+
+        # Retrieve mutable state (Traits, Characters, Locations)
+        state = tx.run("""
+            MATCH (h:History)-[:CURRENT]->(t:Trait)
+            WHERE h.story_id = $story_id
+            RETURN t.id AS trait_id, t.title AS trait_title, t.description AS trait_description, h.state AS trait_state
+        """, story_id=story_id).data()
+
+        # A branch inherits the state of its ancestors as of each fork point
+        # for every object it has not changed itself.
+        if info["lineage"]:
+            changed = {row["trait_id"] for row in state}
+            inherited = {
+                object_id: obj["state"]
+                for object_id, obj in Database._state_at(tx, info, info["lineage_ordinals"][-1]).items()
+                if obj["type"] == "Trait" and object_id not in changed
             }
+            state.extend(tx.run("""
+                MATCH (t:Trait) WHERE t.id IN $trait_ids
+                RETURN t.id AS trait_id, t.title AS trait_title, t.description AS trait_description
+            """, trait_ids=list(inherited)).data())
+            for row in state:
+                row.setdefault("trait_state", inherited.get(row["trait_id"]))
+
+        # Combine narrative and state into a structured response
+        result = {
+            "entries": entries,
+            "state": state
+        }
+        if last_n is not None:
+            result["page"] = page_info(entries, first, entry_count, entry_count)
+        return result
+
+    @staticmethod
+    def _story_info(tx, story_id):
+        """Returns a story's entry count and branch lineage, or an empty story if it does not exist."""
+        record = tx.run("""
+            MATCH (story:Story {id: $story_id})
+            RETURN coalesce(story.entry_count, 0) AS entry_count,
+                coalesce(story.lineage, []) AS lineage,
+                coalesce(story.lineage_ordinals, []) AS lineage_ordinals
+        """, story_id=story_id).single()
+        info = record.data() if record else {"entry_count": 0, "lineage": [], "lineage_ordinals": []}
+        info["story_id"] = story_id
+        return info
+
+    @staticmethod
+    def _entry_ordinal(tx, info, entry_id):
+        """Returns the ordinal of an entry visible in a story, raising ValueError if it is not part of it."""
+        record = tx.run("""
+            MATCH (e:Entry {id: $entry_id})
+            RETURN e.story_id AS story_id, e.ordinal AS ordinal
+        """, entry_id=entry_id).single()
+        if record is not None and record["ordinal"] is not None:
+            ordinal = record["ordinal"]
+            if any(seg["story_id"] == record["story_id"] for seg in lineage_segments(info, ordinal, ordinal)):
+                return ordinal
+        raise ValueError(f"Entry {entry_id} is not part of story {info['story_id']}")
+
+    @staticmethod
+    def _entries_range(tx, info, first, last):
+        """Returns the entries of a story with ordinals in [first, last], in story order."""
+        segments = lineage_segments(info, first, last)
+        if not segments:
+            return []
+        return tx.run("""
+            UNWIND $segments AS seg
+            MATCH (e:Entry)
+            WHERE e.story_id = seg.story_id AND e.ordinal >= seg.first AND e.ordinal <= seg.last
+            OPTIONAL MATCH (e)-[:NEXT]->(s:Summary)
+            RETURN e.id AS entry_id, e.ordinal AS ordinal, e.text AS entry_text, s.text AS summary_text
+            ORDER BY e.ordinal
+        """, segments=segments).data()
 
-    def commit_entry(self, story_id, entry_text, summary_text, state_changes):
+    def get_entries_page(self, story_id, after=None, before=None, limit=50):
+        """
+        Returns one page of a story's entries using entry IDs as cursors.
+
+        With no cursor the most recent page is returned. "after" pages towards
+        newer entries and "before" towards older ones.
+
+        Args:
+            story_id (str): The ID of the story.
+            after (str, optional): Return entries following this Entry ID.
+            before (str, optional): Return entries preceding this Entry ID.
+            limit (int, optional): Maximum number of entries to return. Defaults to 50.
+
+        Returns:
+            dict: "entries" in story order and "page" cursor information.
+        """
+        if after is not None and before is not None:
+            raise ValueError("Only one of 'after' and 'before' may be given.")
+        if limit < 1:
+            raise ValueError("Page limit must be at least 1.")
+        return self.data_layer.read(self._entries_page_tx, story_id, after, before, limit)
+
+    @staticmethod
+    def _entries_page_tx(tx, story_id, after, before, limit):
+        """Transaction function for get_entries_page."""
+        info = Database._story_info(tx, story_id)
+        entry_count = info["entry_count"]
+        if after is not None:
+            first = Database._entry_ordinal(tx, info, after) + 1
+            last = min(first + limit - 1, entry_count)
+        elif before is not None:
+            last = Database._entry_ordinal(tx, info, before) - 1
+            first = max(1, last - limit + 1)
+        else:
+            last = entry_count
+            first = max(1, last - limit + 1)
+
+        entries = Database._entries_range(tx, info, first, last)
+        return {
+            "entries": entries,
+            "page": page_info(entries, first, last, entry_count)
+        }
+
+    def get_entries_window(self, story_id, entry_id, radius=10):
+        """
+        Returns the entries surrounding a given entry.
+
+        Args:
+            story_id (str): The ID of the story.
+            entry_id (str): The ID of the Entry at the centre of the window.
+            radius (int, optional): Number of entries to include on each side. Defaults to 10.
+
+        Returns:
+            dict: "entries" in story order and "page" cursor information.
+        """
+        if radius < 0:
+            raise ValueError("Window radius cannot be negative.")
+        return self.data_layer.read(self._entries_window_tx, story_id, entry_id, radius)
+
+    @staticmethod
+    def _entries_window_tx(tx, story_id, entry_id, radius):
+        """Transaction function for get_entries_window."""
+        info = Database._story_info(tx, story_id)
+        entry_count = info["entry_count"]
+        ordinal = Database._entry_ordinal(tx, info, entry_id)
+        first = max(1, ordinal - radius)
+        last = min(entry_count, ordinal + radius)
+
+        entries = Database._entries_range(tx, info, first, last)
+        return {
+            "entries": entries,
+            "page": page_info(entries, first, last, entry_count)
+        }
+
+    def get_latest_entry(self, story_id):
+        """
+        Returns the last Entry of a story by following its TAIL pointer.
+
+        Args:
+            story_id (str): The ID of the story.
+
+        Returns:
+            dict: The entry's id, ordinal, text and summary, or None if the story is empty.
+        """
+        return self.data_layer.read(self._latest_entry_tx, story_id)
+
+    @staticmethod
+    def _latest_entry_tx(tx, story_id):
+        """Transaction function for get_latest_entry."""
+        record = tx.run("""
+            MATCH (:Story {id: $story_id})-[:TAIL]->(e:Entry)
+            OPTIONAL MATCH (e)-[:NEXT]->(s:Summary)
+            RETURN e.id AS entry_id, e.ordinal AS ordinal, e.text AS entry_text, s.text AS summary_text
+        """, story_id=story_id).single()
+        return record.data() if record else None
+
+    def get_entry_at(self, story_id, ordinal):
+        """
+        Returns the Entry at an ordinal of a story, including entries a branch inherits.
+
+        Args:
+            story_id (str): The ID of the story.
+            ordinal (int): The entry's position in the story, starting at 1.
+
+        Returns:
+            dict: The entry's id, ordinal, text, summary and owning "story_id", or None if there is no such entry.
+        """
+        return self.data_layer.read(self._entry_at_tx, story_id, ordinal)
+
+    @staticmethod
+    def _entry_at_tx(tx, story_id, ordinal):
+        """Transaction function for get_entry_at."""
+        info = Database._story_info(tx, story_id)
+        entries = Database._entries_range(tx, info, ordinal, ordinal)
+        if not entries:
+            return None
+        entry = entries[0]
+        entry["story_id"] = lineage_segments(info, ordinal, ordinal)[0]["story_id"]
+        return entry
+
+    def revise_entry(self, story_id, ordinal, entry_text):
+        """
+        Replaces the text of one of a story's own entries.
+
+        Entries a branch inherits belong to the parent story and cannot be
+        revised through the branch. Cached state of the story and of every
+        branch inheriting the entry is invalidated, and listeners are sent an
+        "invalidate" event for each of them.
+
+        Args:
+            story_id (str): The ID of the story.
+            ordinal (int): The entry's position in the story.
+            entry_text (str): The new text.
+
+        Returns:
+            str: The ID of the revised Entry.
+
+        Raises:
+            ValueError: If the story has no entry of its own at that ordinal.
+        """
+        records = self.data_layer.run_write("""
+            MATCH (story:Story {id: $story_id}), (e:Entry {story_id: $story_id, ordinal: $ordinal})
+            WHERE e.ordinal <= story.entry_count
+            SET e.text = $entry_text, e.revised_at = timestamp()
+            WITH e
+            OPTIONAL MATCH (branch:Story)
+            WHERE $story_id IN branch.lineage
+            RETURN e.id AS entry_id, collect(branch.id) AS branch_ids
+        """, {"story_id": story_id, "ordinal": ordinal, "entry_text": entry_text})
+        if not records:
+            raise ValueError(f"Story {story_id} has no entry of its own at position {ordinal}")
+        for tag in [story_id] + records[0]["branch_ids"]:
+            self.state_cache.invalidate_tag(tag)
+            self._notify("invalidate", tag)
+        return records[0]["entry_id"]
+
+    def commit_entry(self, story_id, entry_text, summary_text, state_changes, batched=True):
         """
         Commits a new narrative entry and updates the mutable state.
+
+        In batched mode (the default) the Entry, Summary and every History
+        rotation are written in a single write transaction, with one UNWIND
+        query per object label instead of one query per change. Changes to
+        objects that do not exist are skipped and left out of the "commit"
+        event sent to listeners.
         
         Args:
             story_id (str): The ID of the story.
@@ -75,85 +847,445 @@ class Database:
                 - "type": The type of object ("Trait", "Character", "Location").
                 - "id": The ID of the object.
                 - "new_state": The new state description.
+            batched (bool, optional): Apply all changes in one transaction. Defaults to True.
         
         Returns:
             str: The ID of the newly created Entry node.
         """
-        with self.driver.session() as session:
-            # Create the Entry and Summary nodes
-            result = session.run("""
-                CREATE (e:Entry {id: randomUUID(), story_id: $story_id, text: $entry_text})
-                CREATE (s:Summary {text: $summary_text})
-                CREATE (e)-[:NEXT]->(s)
-                RETURN e.id AS entry_id
-            """, story_id=story_id, entry_text=entry_text, summary_text=summary_text)
-            
-            entry_id = result.single()["entry_id"]
-
-            # Update mutable state
-            for change in state_changes:
-                obj_type = change["type"]
-                obj_id = change["id"]
-                new_state = change["new_state"]
-
-                session.run(f"""
-                    MATCH (o:{obj_type} {{id: $obj_id}})
-                    MATCH (h:History)-[r:CURRENT]->(o)
-                    DELETE r
-                    CREATE (new_h:History {{id: randomUUID(), story_id: $story_id, state: $new_state}})
-                    CREATE (new_h)-[:CURRENT]->(o)
-                """, obj_id=obj_id, story_id=story_id, new_state=new_state)
-
-            return entry_id
+        if batched:
+            grouped_changes = group_state_changes(state_changes)
+            try:
+                entry_id, applied = self.data_layer.write(
+                    self._commit_entry_tx, story_id, entry_text, summary_text, grouped_changes, self.snapshot_interval
+                )
+            finally:
+                self.state_cache.invalidate_tag(story_id)
+        else:
+            try:
+                entry_id, applied = self._commit_entry_unbatched(story_id, entry_text, summary_text, state_changes)
+            except Exception:
+                # Some changes may have been committed before the failure.
+                self._notify("invalidate", story_id)
+                raise
+            finally:
+                self.state_cache.invalidate_tag(story_id)
+        self._notify("commit", story_id, [
+            change for change in state_changes if (change["type"], change["id"]) in applied
+        ])
+        return entry_id
+
+    def _commit_entry_unbatched(self, story_id, entry_text, summary_text, state_changes):
+        """Commits the entry and each state change in their own transactions."""
+        record = self.data_layer.write(self._append_entry_tx, story_id, entry_text, summary_text)
+        applied = set()
+        for change in state_changes:
+            for label, changes in group_state_changes([change]).items():
+                applied.update((label, object_id) for object_id in self.data_layer.write(
+                    self._rotate_history_tx, label, changes, story_id, record["entry_id"], record["ordinal"]
+                ))
+        if record["ordinal"] % self.snapshot_interval == 0:
+            self.data_layer.write(self._write_snapshot_tx, story_id, record["ordinal"])
+        return record["entry_id"], applied
+
+    def begin_entry(self, story_id):
+        """
+        Starts committing an Entry whose state changes arrive before its text.
+
+        Args:
+            story_id (str): The ID of the story.
+
+        Returns:
+            EntryWriter: The open writer; commit() or rollback() must be called,
+                or the writer used as a context manager.
+        """
+        return EntryWriter(self, story_id)
+
+    @staticmethod
+    def _append_entry_tx(tx, story_id, entry_text, summary_text):
+        """Appends an Entry, returning its "entry_id" and "ordinal"; raises ValueError while the story is being pruned."""
+        record = tx.run(
+            APPEND_ENTRY_QUERY, story_id=story_id, entry_text=entry_text, summary_text=summary_text
+        ).single()
+        if record is None:
+            raise ValueError(
+                f"Story {story_id} is being pruned; retry once the prune finishes, or prune again to finish it"
+            )
+        return record.data()
+
+    @staticmethod
+    def _commit_entry_tx(tx, story_id, entry_text, summary_text, grouped_changes, snapshot_interval):
+        """Transaction function for the batched commit_entry path, returning (entry_id, applied (label, id) pairs)."""
+        record = Database._append_entry_tx(tx, story_id, entry_text, summary_text)
+        entry_id, ordinal = record["entry_id"], record["ordinal"]
+
+        applied = set()
+        for label, changes in grouped_changes.items():
+            applied.update(
+                (label, object_id) for object_id in Database._rotate_history_tx(tx, label, changes, story_id, entry_id, ordinal)
+            )
+
+        if ordinal % snapshot_interval == 0:
+            Database._write_snapshot_tx(tx, story_id, ordinal)
+
+        return entry_id, applied
+
+    @staticmethod
+    def _rotate_history_tx(tx, label, changes, story_id, entry_id, ordinal):
+        """
+        Rotates the story's CURRENT History for every changed object of one label,
+        keeping the previous History reachable through PREVIOUS.
+
+        Returns:
+            list: The IDs of the objects found; changes to missing objects are skipped.
+        """
+        return tx.run(f"""
+            UNWIND $changes AS change
+            MATCH (o:{label} {{id: change.id}})
+            OPTIONAL MATCH (h:History {{story_id: $story_id}})-[r:CURRENT]->(o)
+            DELETE r
+            CREATE (new_h:History {{
+                id: randomUUID(), story_id: $story_id, entry_id: $entry_id, ordinal: $ordinal,
+                object_id: change.id, object_type: $label, state: change.new_state
+            }})
+            CREATE (new_h)-[:CURRENT]->(o)
+            FOREACH (ignored IN CASE WHEN h IS NULL THEN [] ELSE [1] END | CREATE (new_h)-[:PREVIOUS]->(h))
+            RETURN change.id AS id
+        """, changes=changes, label=label, story_id=story_id, entry_id=entry_id, ordinal=ordinal).value()
+
+    def get_state_at(self, story_id, ordinal=None):
+        """
+        Reconstructs the mutable state of a story as of a given entry.
+
+        The nearest Snapshot at or before the ordinal is loaded and the History
+        rotations committed after it are replayed on top, so the cost is bounded
+        by the snapshot interval rather than by story length. Branches resolve
+        both snapshots and rotations through their lineage.
+
+        Args:
+            story_id (str): The ID of the story.
+            ordinal (int, optional): The entry ordinal to reconstruct. Defaults to the latest entry.
+
+        Returns:
+            dict: Maps object IDs to {"type", "state", "history_id"}.
+        """
+        return self.data_layer.read(self._state_at_tx, story_id, ordinal)
+
+    def get_story(self, story_id):
+        """
+        Fetches a Story node.
+
+        Args:
+            story_id (str): The ID of the story.
+
+        Returns:
+            dict: The story's properties, or None if not found.
+        """
+        records = self.data_layer.run_read("MATCH (story:Story {id: $story_id}) RETURN story", {"story_id": story_id})
+        return records[0]["story"] if records else None
+
+    def get_entry_count(self, story_id):
+        """Returns the number of entries in a story, 0 if it does not exist."""
+        return self.data_layer.read(self._story_info, story_id)["entry_count"]
+
+    @staticmethod
+    def _state_at_tx(tx, story_id, ordinal):
+        """Transaction function for get_state_at."""
+        info = Database._story_info(tx, story_id)
+        ordinal = info["entry_count"] if ordinal is None else min(ordinal, info["entry_count"])
+        return Database._state_at(tx, info, ordinal)
+
+    @staticmethod
+    def _state_at(tx, info, ordinal):
+        """Returns the state of a story at an ordinal as nearest Snapshot plus replayed History."""
+        base_ordinal, state = 0, {}
+        segments = lineage_segments(info, 1, ordinal)
+        if segments:
+            record = tx.run("""
+                UNWIND $segments AS seg
+                MATCH (snap:Snapshot)
+                WHERE snap.story_id = seg.story_id AND snap.ordinal >= seg.first AND snap.ordinal <= seg.last
+                RETURN snap.ordinal AS ordinal, snap.state AS state
+                ORDER BY snap.ordinal DESC LIMIT 1
+            """, segments=segments).single()
+            if record is not None:
+                base_ordinal, state = record["ordinal"], json.loads(record["state"])
+
+        deltas = lineage_segments(info, base_ordinal + 1, ordinal)
+        if deltas:
+            rotations = tx.run("""
+                UNWIND $segments AS seg
+                MATCH (h:History)
+                WHERE h.story_id = seg.story_id AND h.ordinal >= seg.first AND h.ordinal <= seg.last
+                RETURN h.id AS history_id, h.object_id AS object_id, h.object_type AS type, h.state AS state
+                ORDER BY h.ordinal
+            """, segments=deltas)
+            for row in rotations:
+                state[row["object_id"]] = {"type": row["type"], "state": row["state"], "history_id": row["history_id"]}
+        return state
+
+    @staticmethod
+    def _write_snapshot_tx(tx, story_id, ordinal):
+        """Materializes the full state of a story at an ordinal as a Snapshot node."""
+        info = Database._story_info(tx, story_id)
+        state = Database._state_at(tx, info, ordinal)
+        tx.run("""
+            MATCH (story:Story {id: $story_id})
+            MERGE (snap:Snapshot {story_id: $story_id, ordinal: $ordinal})
+            SET snap.state = $state, snap.created_at = timestamp()
+            MERGE (story)-[:SNAPSHOT]->(snap)
+        """, story_id=story_id, ordinal=ordinal, state=json.dumps(state)).consume()
 
     def create_branch(self, entry_id, branch_title=None, branch_id=None):
         """
         Creates a new branch starting from the specified Entry node.
+
+        The branch is a new Story that shares every entry and state change of
+        its parent up to and including the Entry. Only entries committed to the
+        branch afterwards, and the History rotations they cause, are stored
+        under the branch's own story_id; reads resolve everything else through
+        the branch lineage.
         
         Args:
             entry_id (str): The ID of the Entry node where the branch starts.
             branch_title (str, optional): A title for the branch.
-            branch_id (str, optional): A unique identifier for the branch.
+            branch_id (str, optional): A unique identifier for the branch. Generated if omitted.
         
         Returns:
-            str: The ID of the newly created Entry node for the branch.
+            str: The story ID of the new branch.
         """
-        with self.driver.session() as session:
-            # Create the new Entry node and link it with a BRANCH relationship
-            result = session.run("""
-                MATCH (e:Entry {id: $entry_id})
-                CREATE (new_entry:Entry {id: randomUUID(), text: 'Branch starting point'})
-                CREATE (e)-[:BRANCH {title: $branch_title, id: $branch_id}]->(new_entry)
-                RETURN new_entry.id AS new_entry_id
-            """, entry_id=entry_id, branch_title=branch_title, branch_id=branch_id)
-            
-            return result.single()["new_entry_id"]
+        records = self.data_layer.run_write("""
+            MATCH (e:Entry {id: $entry_id})
+            MATCH (parent:Story {id: e.story_id})
+            CREATE (branch:Story {
+                id: coalesce($branch_id, randomUUID()),
+                title: $branch_title,
+                created_at: timestamp(),
+                parent_id: parent.id,
+                fork_ordinal: e.ordinal,
+                entry_count: e.ordinal,
+                lineage: coalesce(parent.lineage, []) + parent.id,
+                lineage_ordinals: coalesce(parent.lineage_ordinals, []) + e.ordinal
+            })
+            CREATE (branch)-[:FORKED_FROM {ordinal: e.ordinal}]->(parent)
+            CREATE (e)-[:BRANCH {title: $branch_title, id: branch.id}]->(branch)
+            CREATE (branch)-[:TAIL]->(e)
+            WITH parent, branch
+            OPTIONAL MATCH (parent)-[:HEAD]->(head:Entry)
+            FOREACH (ignored IN CASE WHEN head IS NULL THEN [] ELSE [1] END | CREATE (branch)-[:HEAD]->(head))
+            RETURN branch.id AS branch_id
+        """, {"entry_id": entry_id, "branch_title": branch_title, "branch_id": branch_id})
+        if not records:
+            raise ValueError(f"Entry {entry_id} is not part of a story")
+
+        # Drop anything cached for the branch ID before it existed.
+        self.state_cache.invalidate_tag(records[0]["branch_id"])
+        self._notify("invalidate", records[0]["branch_id"])
+        return records[0]["branch_id"]
 
-    def prune_story(self, entry_id):
+    def prune_story(self, entry_id, batch_size=None, story_id=None):
         """
         Rolls back the story to the specified Entry node by deleting all subsequent entries and state changes.
+
+        A branch can be rolled back to any entry it shows, including one it
+        inherits from an ancestor: pass the branch as story_id. Only the
+        branch's own entries and History are removed. Rolling back before
+        the fork point moves the fork point back to the Entry, so the branch
+        then continues from there.
+
+        The rollback is planned once: a single write transaction locks the
+        story, moves its TAIL and entry_count back to the Entry, restores the
+        CURRENT History of every object changed after it, collects the IDs of
+        everything to remove and marks the story as pruning. The detached
+        nodes are then deleted in chunks of batch_size, each in its own
+        transaction, and a last transaction clears the mark. Readers only read
+        entries and History up to entry_count, so they stop seeing pruned
+        entries as soon as the first transaction commits. Appends are refused
+        while the story is marked, since the next ordinals still belong to
+        entries not yet deleted. Calling prune_story again for the same Entry
+        finishes an interrupted cleanup.
         
         Args:
             entry_id (str): The ID of the Entry node to roll back to.
+            batch_size (int, optional): Nodes deleted per transaction. Defaults to PRUNE_BATCH_SIZE.
+            story_id (str, optional): The story to roll back. Defaults to the story that owns the Entry.
         
         Returns:
-            str: A confirmation message indicating the rollback was successful.
-        """
-        with self.driver.session() as session:
-            # Collect the IDs of all subsequent entries
-            session.run("""
-                MATCH (e:Entry {id: $entry_id})-[:NEXT*]->(to_delete:Entry)
-                OPTIONAL MATCH (to_delete)-[:NEXT]->(s:Summary)
-                DETACH DELETE to_delete, s
-            """, entry_id=entry_id)
-
-            # Remove all History nodes and CURRENT relationships associated with pruned entries
-            session.run("""
-                MATCH (e:Entry {id: $entry_id})-[:NEXT*]->(to_delete:Entry)
-                WITH collect(to_delete.story_id) AS pruned_story_ids
-                MATCH (h:History)-[:CURRENT]->(o)
-                WHERE h.story_id IN pruned_story_ids
-                DETACH DELETE h
-            """, entry_id=entry_id)
-
-            return f"Story successfully rolled back to Entry {entry_id}."
\ No newline at end of file
+            dict: A confirmation "message" and the IDs of the removed "entries" and "history" nodes.
+        """
+        batch_size = batch_size or PRUNE_BATCH_SIZE
+        plan = self.data_layer.write(self._truncate_story_tx, entry_id, story_id)
+        self.state_cache.invalidate_tag(plan["story_id"])
+        self._notify("invalidate", plan["story_id"])
+
+        for i in range(0, len(plan["history"]), batch_size):
+            self.data_layer.write(self._delete_history_tx, plan["history"][i:i + batch_size])
+        for i in range(0, len(plan["entries"]), batch_size):
+            self.data_layer.write(self._delete_entries_tx, plan["entries"][i:i + batch_size])
+        self.data_layer.run_write("MATCH (story:Story {id: $story_id}) REMOVE story.pruning", {"story_id": plan["story_id"]})
+
+        return {
+            "message": f"Story successfully rolled back to Entry {entry_id}.",
+            "story_id": plan["story_id"],
+            "entries": plan["entries"],
+            "history": plan["history"]
+        }
+
+    @staticmethod
+    def _truncate_story_tx(tx, entry_id, story_id=None):
+        """Transaction function that logically truncates a story after an Entry and plans the deletes."""
+        if story_id is None:
+            story_id = tx.run("MATCH (e:Entry {id: $entry_id}) RETURN e.story_id AS story_id",
+                              entry_id=entry_id).value("story_id")
+            if not story_id:
+                raise ValueError(f"Entry {entry_id} is not part of a story")
+            story_id = story_id[0]
+        # Taking the write lock on the Story node first means no entry can be
+        # appended, and the lineage read below cannot change, mid-prune.
+        if tx.run("MATCH (story:Story {id: $story_id}) SET story.pruned_at = timestamp() RETURN story.id",
+                  story_id=story_id).single() is None:
+            raise ValueError(f"Story {story_id} does not exist")
+        info = Database._story_info(tx, story_id)
+        ordinal = Database._entry_ordinal(tx, info, entry_id)
+
+        # Rolling back into the shared prefix moves the fork point back, so the
+        # branch's next entry gets an ordinal of its own rather than one an
+        # ancestor owns. Ancestor entries are left as they are.
+        lineage_ordinals = [min(fork, ordinal) for fork in info["lineage_ordinals"]]
+        refork = lineage_ordinals != info["lineage_ordinals"]
+        tx.run("""
+            MATCH (story:Story {id: $story_id}), (e:Entry {id: $entry_id})
+            SET story.entry_count = $ordinal, story.lineage_ordinals = $lineage_ordinals, story.pruning = true
+            WITH story, e
+            OPTIONAL MATCH (story)-[old_tail:TAIL]->()
+            DELETE old_tail
+            CREATE (story)-[:TAIL]->(e)
+        """, story_id=story_id, entry_id=entry_id, ordinal=ordinal, lineage_ordinals=lineage_ordinals).consume()
+        if refork:
+            tx.run("""
+                MATCH (story:Story {id: $story_id})-[f:FORKED_FROM]->(), (e:Entry {id: $entry_id})
+                SET story.fork_ordinal = $ordinal, f.ordinal = $ordinal
+                WITH story, e
+                OPTIONAL MATCH ()-[old:BRANCH {id: $story_id}]->(story)
+                CREATE (e)-[:BRANCH {title: old.title, id: story.id}]->(story)
+                DELETE old
+            """, story_id=story_id, entry_id=entry_id, ordinal=ordinal).consume()
+
+        # Branches read their parent's entries up to the fork point, so those
+        # entries cannot be removed while such a branch exists.
+        dependents = tx.run("""
+            MATCH (branch:Story)-[f:FORKED_FROM]->(:Story {id: $story_id})
+            WHERE f.ordinal > $ordinal
+            RETURN branch.id AS id
+        """, story_id=story_id, ordinal=ordinal).value("id")
+        if dependents:
+            raise ValueError(f"Cannot prune story {story_id} before the fork point of branches: {', '.join(dependents)}")
+
+        entries = tx.run("""
+            MATCH (d:Entry)
+            WHERE d.story_id = $story_id AND d.ordinal > $ordinal
+            RETURN d.id AS id ORDER BY d.ordinal DESC
+        """, story_id=story_id, ordinal=ordinal).value("id")
+
+        history = tx.run("""
+            MATCH (h:History)
+            WHERE h.story_id = $story_id AND h.ordinal > $ordinal
+            RETURN h.id AS id ORDER BY h.ordinal DESC
+        """, story_id=story_id, ordinal=ordinal).value("id")
+
+        tx.run("""
+            MATCH (snap:Snapshot)
+            WHERE snap.story_id = $story_id AND snap.ordinal > $ordinal
+            DETACH DELETE snap
+        """, story_id=story_id, ordinal=ordinal).consume()
+
+        # Hand CURRENT back to the newest surviving History of each object. Only
+        # pruned History nodes are visited: the one whose PREVIOUS falls at or
+        # before the rollback point is the boundary for its object.
+        tx.run("""
+            MATCH (h:History)-[r:CURRENT]->(o)
+            WHERE h.story_id = $story_id AND h.ordinal > $ordinal
+            DELETE r
+            WITH o
+            MATCH (p:History)-[:PREVIOUS]->(keep:History)
+            WHERE p.story_id = $story_id AND p.object_id = o.id
+                AND p.ordinal > $ordinal AND coalesce(keep.ordinal, 0) <= $ordinal
+            CREATE (keep)-[:CURRENT]->(o)
+        """, story_id=story_id, ordinal=ordinal).consume()
+
+        return {"story_id": story_id, "entries": entries, "history": history}
+
+    @staticmethod
+    def _delete_entries_tx(tx, entry_ids):
+        """Deletes a chunk of Entry nodes and their Summaries."""
+        tx.run("""
+            UNWIND $entry_ids AS entry_id
+            MATCH (d:Entry {id: entry_id})
+            OPTIONAL MATCH (d)-[:NEXT]->(s:Summary)
+            DETACH DELETE d, s
+        """, entry_ids=entry_ids).consume()
+
+    @staticmethod
+    def _delete_history_tx(tx, history_ids):
+        """Deletes a chunk of History nodes."""
+        tx.run("""
+            UNWIND $history_ids AS history_id
+            MATCH (h:History {id: history_id})
+            DETACH DELETE h
+        """, history_ids=history_ids).consume()
+
+
+class EntryWriter:
+    """
+    Collects one Entry's state changes while its content is still being generated.
+
+    Changes are validated and buffered as they arrive with apply(); nothing
+    is written until commit(), which writes the Entry, its Summary and every
+    change through Database.commit_entry in one short managed transaction.
+    No transaction or connection is held during generation, so other stories
+    committing changes to the same objects are never kept waiting, and the
+    driver retries the commit on transient errors. Errors from the commit
+    are raised to the caller.
+    """
+
+    def __init__(self, db, story_id):
+        self.db = db
+        self.story_id = story_id
+        self.changes = {}   # (type, id) -> change, last change wins as in commit_entry
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.closed:
+            self.rollback()
+        return False
+
+    def apply(self, change):
+        """
+        Adds one state change to the Entry.
+
+        Args:
+            change (dict): A state change with "type", "id" and "new_state", as for commit_entry.
+
+        Raises:
+            ValueError: If the change's type is not a stateful label.
+            KeyError: If the change lacks "type", "id" or "new_state".
+        """
+        group_state_changes([change])
+        self.changes[(change["type"], change["id"])] = change
+
+    def commit(self, entry_text, summary_text):
+        """
+        Writes the Entry, its Summary and the collected changes.
+
+        Returns:
+            str: The ID of the new Entry node.
+        """
+        self.closed = True
+        return self.db.commit_entry(self.story_id, entry_text, summary_text, list(self.changes.values()))
+
+    def rollback(self):
+        """Discards the collected changes."""
+        self.closed = True
+        self.changes = {}
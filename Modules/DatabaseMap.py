@@ -0,0 +1,132 @@
+import threading
+import time
+import weakref
+
+from Modules.Cache import LRUCache
+
+# Short keys used in the map for each stateful label.
+TYPE_KEYS = {"Character": "C", "Location": "L", "Trait": "T"}
+
+# Explanation of the map format, sent once with the directives.
+MAP_DIRECTIVE = (
+	"database_map lists the current state of objects by ID: C = Characters, L = Locations, "
+	"T = Traits. Each maps object IDs to an index into s, the list of distinct states."
+)
+
+
+def render_map(states):
+	"""
+	Renders object states as a compact database map.
+
+	Args:
+		states (dict): Maps (type, id) to the object's current state.
+
+	Returns:
+		dict: {"s": [distinct states], "C"/"L"/"T": {id: index into s}}. Type
+			keys with no objects are omitted. Ordering is deterministic so
+			unchanged states render identically.
+	"""
+	pool, positions, compact = [], {}, {}
+	for (object_type, object_id), state in sorted(states.items()):
+		position = positions.get(state)
+		if position is None:
+			position = positions[state] = len(pool)
+			pool.append(state)
+		compact.setdefault(TYPE_KEYS.get(object_type, object_type), {})[object_id] = position
+	return {"s": pool, **compact} if pool else {}
+
+
+class DatabaseMapBuilder:
+	"""
+	Maintains the compact database map of each story.
+
+	A story's state is read once with Database.get_state_at and then kept up
+	to date from the changes the Database reports for every committed entry,
+	so the graph is not walked again on later turns. The rendered map is kept
+	until the next change. Prunes and new branches invalidate the story, and
+	its state is read again on next use.
+
+	Listeners only hear about writes made in this process, so before a map is
+	served the story's entry count is checked against the database, and a
+	story whose count moved (an entry committed by another worker) is read
+	again. Maps older than max_age seconds are read again regardless, which
+	bounds how long writes that keep the count, such as revisions, go unseen.
+	"""
+
+	def __init__(self, db, maxsize=128, max_age=300):
+		"""
+		Args:
+			db (Database): The database to read state from and listen to.
+			maxsize (int, optional): Stories kept in memory. Defaults to 128.
+			max_age (float, optional): Seconds a story's state is trusted before it is read again. Defaults to 300.
+		"""
+		self.db = db
+		self.max_age = max_age
+		# story_id -> {"states": {...}, "map": dict or None, "entry_count": int, "built_at": float}
+		self.stories = LRUCache(maxsize=maxsize)
+		self._lock = threading.Lock()
+		self.builds = 0
+		self.updates = 0
+		db.add_listener(self.on_change)
+
+	def get(self, story_id):
+		"""Returns the compact database map of a story."""
+		entry_count = self.db.get_entry_count(story_id)
+		with self._lock:
+			story = self.stories.get(story_id)
+			if story is not None and story["entry_count"] == entry_count and (
+				self.max_age is None or time.monotonic() - story["built_at"] < self.max_age
+			):
+				if story["map"] is None:
+					story["map"] = render_map(story["states"])
+				return story["map"]
+			version = self.stories.version(story_id)
+
+		# Read outside the lock; a change reported meanwhile bumps the version and the result is dropped.
+		# The count was read first, so a commit landing in between makes the next get read again.
+		state = self.db.get_state_at(story_id)
+		states = {(item["type"], object_id): item["state"] for object_id, item in state.items()}
+		story = {"states": states, "map": render_map(states), "entry_count": entry_count, "built_at": time.monotonic()}
+		with self._lock:
+			self.builds += 1
+			self.stories.set(story_id, story, tag=story_id, version=version)
+		return story["map"]
+
+	def on_change(self, event, story_id, changes):
+		"""Database listener: applies committed changes, or invalidates the story (every story on world writes)."""
+		if event == "world":
+			self.invalidate()
+			return
+		with self._lock:
+			story = self.stories.get(story_id)
+			# Bump the version so that a concurrent read of the old state is not cached.
+			self.stories.invalidate_tag(story_id)
+			if story is None or event != "commit":
+				return
+			for change in changes:
+				story["states"][(change["type"], change["id"])] = change["new_state"]
+			story["entry_count"] += 1
+			story["map"] = None
+			self.updates += 1
+			self.stories.set(story_id, story, tag=story_id)
+
+	def invalidate(self, story_id=None):
+		"""Drops one story's map, or every map when story_id is None."""
+		with self._lock:
+			if story_id is None:
+				self.stories.clear()
+			else:
+				self.stories.invalidate_tag(story_id)
+
+
+_builders = weakref.WeakKeyDictionary()
+_builders_lock = threading.Lock()
+
+
+def shared_map_builder(db, **kwargs):
+	"""Returns the DatabaseMapBuilder shared by every Scenario using db."""
+	with _builders_lock:
+		builder = _builders.get(db)
+		if builder is None:
+			builder = _builders[db] = DatabaseMapBuilder(db, **kwargs)
+		return builder
@@ -1,3 +1,4 @@
+import json
 from Modules.Database import Database
 
 class Trait:
@@ -17,6 +18,13 @@ class Trait:
         """Saves the Trait object to the database."""
         db.create_trait(self.id, self.title, self.description)
 
+    def to_dict(self):
+        return {"id": self.id, "title": self.title, "description": self.description}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data.get("title"), data.get("description"))
+
 
 class BaseCharacter:
     def __init__(self, id, name, description):
@@ -29,10 +37,20 @@ class BaseCharacter:
         self.traits.append(trait)
 
     def save_to_db(self, db: Database):
-        """Saves the Character object to the database."""
-        db.create_character(self.id, self.name, self.description)
-        for trait in self.traits:
-            trait.save_to_db(db)
+        """Saves the Character object, its traits and the links between them in one batch."""
+        save_world(db, [self])
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "traits": [trait.id for trait in self.traits]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data.get("name"), data.get("description"))
 
 
 class BaseLocation:
@@ -46,7 +64,112 @@ class BaseLocation:
         self.traits.append(trait)
 
     def save_to_db(self, db: Database):
-        """Saves the Location object to the database."""
-        db.create_location(self.id, self.name, self.description)
-        for trait in self.traits:
-            trait.save_to_db(db)
\ No newline at end of file
+        """Saves the Location object, its traits and the links between them in one batch."""
+        save_world(db, [self])
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "traits": [trait.id for trait in self.traits]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data.get("name"), data.get("description"))
+
+
+# Maps world-file kinds to the classes that represent them.
+WORLD_KINDS = {
+    "traits": Trait,
+    "characters": BaseCharacter,
+    "locations": BaseLocation,
+}
+
+
+def save_world(db: Database, objects, batch_size=None):
+    """
+    Saves Traits, BaseCharacters and BaseLocations (and the traits attached to
+    them, linked with HAS_TRAIT) with batched UNWIND writes instead of one
+    query per object.
+
+    Args:
+        db (Database): The database to write to.
+        objects (iterable): Trait, BaseCharacter and BaseLocation instances.
+        batch_size (int, optional): Rows per transaction, see Database.import_world.
+
+    Returns:
+        dict: Number of rows written per kind.
+    """
+    rows = {kind: {} for kind in WORLD_KINDS}
+    for obj in objects:
+        for kind, cls in WORLD_KINDS.items():
+            if isinstance(obj, cls):
+                rows[kind][obj.id] = obj.to_dict()
+        for trait in getattr(obj, "traits", []):
+            rows["traits"][trait.id] = trait.to_dict()
+    kwargs = {"batch_size": batch_size} if batch_size else {}
+    return db.import_world(
+        traits=rows["traits"].values(),
+        characters=rows["characters"].values(),
+        locations=rows["locations"].values(),
+        **kwargs
+    )
+
+
+def read_world_file(path):
+    """
+    Reads game objects from a world file.
+
+    A ".jsonl" file holds one object per line with a "kind" key ("traits",
+    "characters" or "locations"). Any other file is read as a JSON object with
+    "traits", "characters" and "locations" lists. Characters and locations may
+    list the ids of their traits under "traits".
+
+    Args:
+        path (str): Path to the world file.
+
+    Returns:
+        list: Trait, BaseCharacter and BaseLocation instances.
+    """
+    records = []
+    with open(path, "r") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+        else:
+            world = json.load(f)
+            for kind in WORLD_KINDS:
+                records.extend(dict(record, kind=kind) for record in world.get(kind, []))
+
+    objects = [WORLD_KINDS[record["kind"]].from_dict(record) for record in records]
+    traits = {obj.id: obj for obj in objects if isinstance(obj, Trait)}
+    for obj, record in zip(objects, records):
+        if isinstance(obj, Trait):
+            continue
+        for trait_id in record.get("traits", []):
+            obj.add_trait(traits[trait_id])
+    return objects
+
+
+def write_world_file(db: Database, path, batch_size=None):
+    """
+    Streams every Trait, Character and Location in the database to a JSONL world file.
+
+    Args:
+        db (Database): The database to read from.
+        path (str): Path of the ".jsonl" file to write.
+        batch_size (int, optional): Nodes read per transaction, see Database.export_world.
+
+    Returns:
+        int: Number of objects written.
+    """
+    kwargs = {"batch_size": batch_size} if batch_size else {}
+    count = 0
+    with open(path, "w") as f:
+        for record in db.export_world(**kwargs):
+            f.write(json.dumps(record) + "\n")
+            count += 1
+    return count
\ No newline at end of file
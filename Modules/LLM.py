@@ -1,11 +1,22 @@
 # modules/llm_handler.py
 
+import asyncio
 import json
+import queue
+import threading
+import time
 import traceback
-from huggingface_hub import InferenceClient
+from huggingface_hub import AsyncInferenceClient, InferenceClient
+from Modules.Resilience import (
+	CircuitBreaker, CircuitOpenError, LLMError, RetryPolicy, call_with_retry, call_with_retry_async, is_retryable
+)
+
+# Default of set_model's fallback_model: keep the fallback model already set.
+_KEEP = object()
 
 class LLM:
-	def __init__(self, api_key, model="meta-llama/Llama-3.3-70B-Instruct", config=None):
+	def __init__(self, api_key, model="meta-llama/Llama-3.3-70B-Instruct", config=None, cache=None, batcher=None,
+			timeout=60.0, deadline=120.0, retry=None, fallback_model=None, breaker_threshold=5, breaker_reset=30.0):
 		"""
 		Initializes the LLMHandler with the given Hugging Face API key, model, and configuration.
 		
@@ -15,18 +26,84 @@ class LLM:
 			- frequency_penalty
 			- presence_penalty
 			- etc.
+		
+		cache is an optional CompletionCache. Completions for prompts already
+		seen with the same model and config are then served from it instead of
+		calling the API.
+		
+		batcher is an optional LLMBatcher. Prompts for the preferred model,
+		streamed turns included, are then generated through it, batched with
+		other turns arriving at the same time. A batched call that fails or
+		takes longer than timeout falls back to an individual call.
+		
+		Failure handling:
+			- timeout: seconds allowed for each call, and between streamed tokens.
+			- deadline: seconds after which no further retry is started (None for no limit).
+			- retry: a RetryPolicy; transient errors (timeouts, dropped connections,
+			  429 and 5xx responses) are retried with jittered exponential backoff.
+			- breaker_threshold / breaker_reset: each model has a CircuitBreaker that
+			  opens after that many consecutive transient failures and refuses
+			  calls for breaker_reset seconds.
+			- fallback_model: tried when the primary model fails with a transient
+			  error or its circuit is open.
+		Failures are raised as LLMError.
 		"""
 		self.api_key = api_key
 		self.model = model
+		self.fallback_model = fallback_model
 		self.config = config or {}
-		self.client = InferenceClient(api_key=self.api_key, model=self.model)
+		self.cache = cache
+		self.batcher = batcher
+		self.timeout = timeout
+		self.deadline = deadline
+		self.retry = retry or RetryPolicy()
+		self.breaker_threshold = breaker_threshold
+		self.breaker_reset = breaker_reset
+		self.breakers = {}   # model -> CircuitBreaker
+		self._clients = {}   # model -> (InferenceClient, AsyncInferenceClient)
+		self._clients_lock = threading.Lock()
+		self.client, self.async_client = self._clients_for(self.model)
+		# Event loop used to drive streams for synchronous callers (Flask, TeleBot).
+		self._loop = None
+		self._loop_lock = threading.Lock()
 	
-	def set_model(self, model):
+	def set_model(self, model, fallback_model=_KEEP):
 		"""
-		Sets the preferred model and reinitializes the InferenceClient.
+		Sets the preferred model, and optionally a fallback model used while
+		the preferred one is failing, and reinitializes the InferenceClient.
+		The current fallback model is kept unless one is given; pass None to
+		remove it.
 		"""
 		self.model = model
-		self.client = InferenceClient(api_key=self.api_key, model=self.model)
+		if fallback_model is not _KEEP:
+			self.fallback_model = fallback_model
+		self.client, self.async_client = self._clients_for(self.model)
+	
+	def _clients_for(self, model):
+		"""Returns the (sync, async) inference clients for a model, creating them on first use."""
+		with self._clients_lock:
+			if model not in self._clients:
+				self._clients[model] = (
+					InferenceClient(api_key=self.api_key, model=model, timeout=self.timeout),
+					AsyncInferenceClient(api_key=self.api_key, model=model, timeout=self.timeout)
+				)
+			return self._clients[model]
+	
+	def _breaker(self, model):
+		"""Returns the circuit breaker of a model."""
+		with self._clients_lock:
+			if model not in self.breakers:
+				self.breakers[model] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+			return self.breakers[model]
+	
+	def _models(self):
+		"""The models to try, in order."""
+		if self.fallback_model and self.fallback_model != self.model:
+			return [self.model, self.fallback_model]
+		return [self.model]
+	
+	def _deadline(self):
+		return time.monotonic() + self.deadline if self.deadline is not None else None
 	
 	def set_config(self, config):
 		"""
@@ -50,15 +127,198 @@ class LLM:
 		"""
 		Sends a prompt (a JSON string) to the LLM, including any additional configuration parameters.
 		Returns the parsed JSON response.
+		Identical prompts are answered from the cache, if one is set. Answers of
+		the fallback model are not cached: the cache is read for the preferred
+		model, and a fallback answer stored under it would outlive the outage.
+		With a batcher the prompt is generated through it first; a batched call
+		that fails, times out or does not return JSON falls back to an
+		individual call. Transient failures are retried, then the fallback model is tried;
+		raises LLMError if no model produced a response.
 		"""
-		try:
-			# Combine the prompt with the configuration.
-			# This assumes the API accepts a payload with "inputs" and "parameters" keys.
-			payload = {
-				"inputs": prompt,
-				"parameters": self.config
-			}
-			response = self.client.infer(payload)
+		if self.cache is not None:
+			cached = self.cache.get(prompt, self.model, self.config)
+			if cached is not None:
+				return json.loads(cached)
+		response = self._batched(prompt)
+		if response is not None and _valid(json.loads, response):
+			if self.cache is not None:
+				self.cache.set(prompt, self.model, self.config, response)
 			return json.loads(response)
+		deadline = self._deadline()
+		error = None
+		for model in self._models():
+			try:
+				response = call_with_retry(lambda: self._infer(model, prompt), self.retry, self._breaker(model), deadline)
+				result = json.loads(response)
+			except Exception as e:
+				error = e
+				if isinstance(e, CircuitOpenError) or is_retryable(e):
+					continue
+				break
+			if self.cache is not None and model == self.model:
+				self.cache.set(prompt, model, self.config, response)
+			return result
+		raise _llm_error(error) from error
+
+	def _batched(self, prompt):
+		"""
+		Generates a completion with the preferred model through the batcher.
+		
+		Returns:
+			str: The completion, or None if there is no batcher or the batched call
+				failed or timed out; the caller then makes an individual call.
+		"""
+		if self.batcher is None:
+			return None
+		try:
+			return self.batcher.submit(prompt, self.model, self.config, timeout=self.timeout)
+		except Exception:
+			return None
+
+	def _infer(self, model, prompt):
+		"""Makes one completion call to a model."""
+		# Combine the prompt with the configuration.
+		# This assumes the API accepts a payload with "inputs" and "parameters" keys.
+		payload = {
+			"inputs": prompt,
+			"parameters": self.config
+		}
+		client, _ = self._clients_for(model)
+		return client.infer(payload)
+
+	async def stream_prompt(self, prompt, validate=None):
+		"""
+		Streams the completion for a prompt token by token.
+		
+		An async generator: use as "async for token in llm.stream_prompt(prompt)".
+		The configuration parameters are passed through as generation parameters.
+		A cached completion, or one generated through the batcher, is yielded
+		as a single chunk; a completion streamed
+		to the end is added to the cache only if it passes validate, so a
+		truncated or malformed completion is generated afresh next time rather
+		than served forever. A cached completion that fails validate is evicted.
+		As in send_prompt, completions of the fallback model are not cached.
+		Opening the stream is retried and falls back like send_prompt; a stream
+		that stalls for longer than the timeout between tokens, or fails part
+		way, raises LLMError.
+		
+		Args:
+			prompt (str): The prompt.
+			validate (callable, optional): Called with the complete completion text;
+				raises if it is unusable. Defaults to checking that it is JSON.
+		"""
+		validate = validate or json.loads
+		if self.cache is not None:
+			cached = self.cache.get(prompt, self.model, self.config)
+			if cached is not None:
+				if _valid(validate, cached):
+					yield cached
+					return
+				self.cache.delete(prompt, self.model, self.config)
+		if self.batcher is not None:
+			# A batched completion arrives whole and is yielded as a single chunk.
+			completion = await asyncio.get_running_loop().run_in_executor(None, self._batched, prompt)
+			if completion is not None:
+				if self.cache is not None and _valid(validate, completion):
+					self.cache.set(prompt, self.model, self.config, completion)
+				yield completion
+				return
+		deadline = self._deadline()
+		stream = model = error = None
+		for model in self._models():
+			_, async_client = self._clients_for(model)
+
+			def open_stream():
+				return asyncio.wait_for(async_client.text_generation(prompt, stream=True, **self.config), self.timeout)
+
+			try:
+				stream = await call_with_retry_async(open_stream, self.retry, self._breaker(model), deadline)
+				break
+			except Exception as e:
+				error = e
+				if not (isinstance(e, CircuitOpenError) or is_retryable(e)):
+					break
+		if stream is None:
+			raise _llm_error(error) from error
+
+		# Tokens already yielded cannot be taken back, so failures mid-stream are not retried.
+		tokens = []
+		iterator = stream.__aiter__()
+		try:
+			while True:
+				try:
+					token = await asyncio.wait_for(iterator.__anext__(), self.timeout)
+				except StopAsyncIteration:
+					break
+				tokens.append(token)
+				yield token
 		except Exception as e:
-			raise Exception(f"LLM communication error: {str(e)}\n{traceback.format_exc()}")
\ No newline at end of file
+			if is_retryable(e):
+				self._breaker(model).record_failure()
+			raise _llm_error(e) from e
+		completion = "".join(tokens)
+		if self.cache is not None and model == self.model and _valid(validate, completion):
+			self.cache.set(prompt, model, self.config, completion)
+
+	def stream_prompt_sync(self, prompt, validate=None):
+		"""
+		Streams the completion for a prompt token by token to a synchronous caller.
+		
+		The stream runs on a background event loop shared by all streams of this
+		LLM, and tokens are handed over through a queue as they arrive. Closing
+		the generator early cancels the underlying request. validate is passed
+		to stream_prompt.
+		"""
+		tokens = queue.Queue()
+		done = object()
+
+		async def pump():
+			try:
+				async for token in self.stream_prompt(prompt, validate):
+					tokens.put(token)
+			except BaseException as e:
+				tokens.put(_StreamError(e))
+			finally:
+				tokens.put(done)
+
+		future = asyncio.run_coroutine_threadsafe(pump(), self._background_loop())
+		try:
+			while True:
+				item = tokens.get()
+				if item is done:
+					return
+				if isinstance(item, _StreamError):
+					raise item.error
+				yield item
+		finally:
+			future.cancel()
+
+	def _background_loop(self):
+		"""Returns the event loop used by stream_prompt_sync, starting it on first use."""
+		with self._loop_lock:
+			if self._loop is None:
+				self._loop = asyncio.new_event_loop()
+				threading.Thread(target=self._loop.run_forever, daemon=True).start()
+			return self._loop
+
+
+def _valid(validate, completion):
+	"""Whether a completion passes a validator that raises on bad input."""
+	try:
+		validate(completion)
+	except Exception:
+		return False
+	return True
+
+
+def _llm_error(error):
+	"""Wraps the final error of a call, with its traceback, as an LLMError."""
+	details = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+	return LLMError(f"LLM communication error: {str(error)}\n{details}")
+
+
+class _StreamError:
+	"""Carries an exception raised inside a stream across the token queue."""
+
+	def __init__(self, error):
+		self.error = error
@@ -0,0 +1,225 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from Modules.CompletionCache import completion_key, is_deterministic
+
+try:
+    from transformers import pipeline
+except ImportError:
+    pipeline = None
+
+# Generation parameters passed from an LLM config to a transformers pipeline.
+GENERATION_KEYS = ("max_new_tokens", "temperature", "top_p", "top_k", "repetition_penalty", "do_sample")
+
+
+class LocalTextGenerationBackend:
+    """
+    A local stand-in for a batching text-generation server.
+
+    Completions are produced by a plain function of the prompt (by default
+    it echoes the prompt back), optionally after a fixed per-call delay that
+    imitates inference latency. Every call is recorded in self.calls as a
+    list of prompts, so tests can check how requests were batched.
+    """
+
+    supports_batching = True
+
+    def __init__(self, respond=None, latency=0.0):
+        """
+        Args:
+            respond (callable, optional): Maps (prompt, config) to a completion. Defaults to echoing the prompt.
+            latency (float, optional): Seconds each call takes, whatever its batch size. Defaults to 0.
+        """
+        self.respond = respond or (lambda prompt, config: prompt)
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, model, config):
+        return self.generate_batch([prompt], model, config)[0]
+
+    def generate_batch(self, prompts, model, config):
+        with self._lock:
+            self.calls.append(list(prompts))
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.respond(prompt, config) for prompt in prompts]
+
+
+class TransformersBackend:
+    """
+    Generates completions with local transformers text-generation pipelines.
+
+    A batch of prompts is padded and generated in one pass of the model, so
+    concurrent turns share the model's forward passes. A pipeline is loaded
+    per model on first use, and calls to one model run one batch at a time.
+    Requires the optional transformers package (and a backend such as torch).
+    """
+
+    supports_batching = True
+
+    def __init__(self, device=None, **pipeline_kwargs):
+        """
+        Args:
+            device (optional): Device to run on, as accepted by transformers.pipeline.
+            **pipeline_kwargs: Further arguments for transformers.pipeline, e.g. torch_dtype.
+        """
+        if pipeline is None:
+            raise ImportError("TransformersBackend needs the transformers package.")
+        self.device = device
+        self.pipeline_kwargs = pipeline_kwargs
+        self._pipelines = {}   # model -> (pipeline, lock)
+        self._lock = threading.Lock()
+
+    def _pipeline(self, model):
+        with self._lock:
+            if model not in self._pipelines:
+                generator = pipeline("text-generation", model=model, device=self.device, **self.pipeline_kwargs)
+                # Batches of decoder-only prompts are padded on the left.
+                generator.tokenizer.padding_side = "left"
+                if generator.tokenizer.pad_token_id is None:
+                    generator.tokenizer.pad_token_id = generator.tokenizer.eos_token_id
+                self._pipelines[model] = (generator, threading.Lock())
+            return self._pipelines[model]
+
+    def generate(self, prompt, model, config):
+        return self.generate_batch([prompt], model, config)[0]
+
+    def generate_batch(self, prompts, model, config):
+        kwargs = {key: config[key] for key in GENERATION_KEYS if key in config}
+        kwargs.setdefault("do_sample", bool(kwargs.get("temperature")))
+        generator, lock = self._pipeline(model)
+        with lock:
+            outputs = generator(list(prompts), batch_size=len(prompts), return_full_text=False, **kwargs)
+        return [output[0]["generated_text"] for output in outputs]
+
+
+class LLMBatcher:
+    """
+    Gathers prompts that arrive within a short window into batched calls.
+
+    The first prompt to arrive opens a window of max_wait seconds. Prompts
+    submitted before it closes, or until max_batch_size is reached, are sent
+    to the backend together. Prompts are batched only with others for the
+    same model and config, because a batch shares its generation parameters.
+    Identical prompts in a window are coalesced into one generation when the
+    config is deterministic. If a batched call fails, each of its prompts is
+    retried on its own, so one bad prompt does not fail the others.
+
+    Backends without batching support (supports_batching = False) are
+    called directly on the caller's thread, with no window.
+
+    LLM takes a batcher and sends turns through it, streamed or not, falling
+    back to individual calls when submit fails or times out.
+    """
+
+    def __init__(self, backend, max_batch_size=8, max_wait=0.02, timeout=120.0):
+        """
+        Args:
+            backend: Provides generate(prompt, model, config) and, if supports_batching,
+                generate_batch(prompts, model, config) returning completions in order.
+            max_batch_size (int, optional): Prompts per batched call. Defaults to 8.
+            max_wait (float, optional): Seconds a window stays open. Defaults to 0.02.
+            timeout (float, optional): Default seconds submit waits for a completion (None for no limit). Defaults to 120.
+        """
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._windows = {}   # (model, config key) -> list of (prompt, future)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.prompts = 0
+        self.coalesced = 0
+
+    def submit(self, prompt, model, config, timeout=None):
+        """
+        Generates a completion, batched with concurrent prompts where possible.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the completion. Defaults to self.timeout.
+
+        Returns:
+            str: The completion.
+
+        Raises:
+            concurrent.futures.TimeoutError: If the completion is not ready in time.
+                Its batch still runs, and the completion is discarded.
+        """
+        config = dict(config or {})
+        if not getattr(self.backend, "supports_batching", False):
+            return self.backend.generate(prompt, model, config)
+
+        future = Future()
+        group = (model, completion_key("", model, config))
+        with self._lock:
+            self.prompts += 1
+            window = self._windows.get(group)
+            opened = window is None
+            if opened:
+                window = self._windows[group] = []
+            window.append((prompt, future))
+            full = len(window) >= self.max_batch_size
+            if full:
+                del self._windows[group]
+        if full:
+            self._dispatch(window, model, config)
+        elif opened:
+            timer = threading.Timer(self.max_wait, self._close_window, (group, window, model, config))
+            timer.daemon = True
+            timer.start()
+        return future.result(self.timeout if timeout is None else timeout)
+
+    def _close_window(self, group, window, model, config):
+        with self._lock:
+            if self._windows.get(group) is not window:
+                return   # Already dispatched when it filled up.
+            del self._windows[group]
+        self._dispatch(window, model, config)
+
+    def _dispatch(self, window, model, config):
+        """Sends one window to the backend and resolves its futures."""
+        futures = {}
+        if is_deterministic(config):
+            for prompt, future in window:
+                futures.setdefault(prompt, []).append(future)
+            prompts = list(futures)
+        else:
+            prompts = [prompt for prompt, _ in window]
+        with self._lock:
+            self.batches += 1
+            self.coalesced += len(window) - len(prompts)
+        try:
+            completions = self.backend.generate_batch(prompts, model, config)
+            if len(completions) != len(prompts):
+                raise ValueError(f"Backend returned {len(completions)} completions for {len(prompts)} prompts.")
+        except Exception:
+            completions = None
+
+        for i, prompt in enumerate(prompts):
+            targets = futures[prompt] if futures else [window[i][1]]
+            if completions is not None:
+                result, error = completions[i], None
+            else:
+                result, error = self._generate_single(prompt, model, config)
+            for future in targets:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def _generate_single(self, prompt, model, config):
+        try:
+            return self.backend.generate(prompt, model, config), None
+        except Exception as e:
+            return None, e
+
+    def stats(self):
+        with self._lock:
+            return {
+                "prompts": self.prompts,
+                "batches": self.batches,
+                "coalesced": self.coalesced,
+                "avg_batch_size": self.prompts / self.batches if self.batches else 0.0,
+            }
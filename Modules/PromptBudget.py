@@ -0,0 +1,198 @@
+import json
+import math
+import re
+
+from Modules.Cache import LRUCache
+
+try:
+	import tiktoken
+except ImportError:
+	tiktoken = None
+
+
+class TokenCounter:
+	"""
+	Counts tokens in prompt text.
+
+	Uses a tiktoken encoding when tiktoken and the encoding are available.
+	Otherwise it falls back to a heuristic of one token per four characters,
+	rounded up. The heuristic overestimates most English prose, so budgets
+	computed with it stay on the safe side.
+	"""
+
+	def __init__(self, encoding="cl100k_base"):
+		self.encoding = None
+		if tiktoken is not None:
+			try:
+				self.encoding = tiktoken.get_encoding(encoding)
+			except Exception:
+				# The encoding file may be unavailable offline.
+				self.encoding = None
+
+	def count(self, text):
+		if self.encoding is not None:
+			return len(self.encoding.encode(text, disallowed_special=()))
+		return math.ceil(len(text) / 4)
+
+
+class PromptBudgetError(ValueError):
+	"""Raised when a prompt cannot fit its budget even with history and errors removed."""
+
+
+def first_sentence(text):
+	"""Returns the first sentence of a text, or the whole text if it has no sentence break."""
+	match = re.match(r"\s*(.+?[.!?])(\s|$)", text, flags=re.DOTALL)
+	return match.group(1) if match else text.strip()
+
+
+def extractive_summary(texts):
+	"""Default rollup: the first sentence of each summary, in order."""
+	return " ".join(first_sentence(text) for text in texts if text)
+
+
+def _join(encoded_items):
+	"""Joins JSON-encoded items into a JSON array, as json.dumps would."""
+	return "[" + ", ".join(encoded_items) + "]"
+
+
+def _assemble(encoded_sections):
+	"""Joins JSON-encoded sections, in order, into a JSON object, as json.dumps would."""
+	return "{" + ", ".join(f"{json.dumps(key)}: {encoded}" for key, encoded in encoded_sections.items()) + "}"
+
+
+class PromptBudget:
+	"""
+	Keeps a Scenario prompt under a token budget.
+
+	History is compacted hierarchically:
+		- the most recent `recent` summaries are kept verbatim,
+		- older summaries are rolled up in groups of `fanout`,
+		- once more than `fanout` rollups exist at a level, the oldest are
+		  rolled up again at the next level,
+	so the compacted history grows logarithmically with story length. If the
+	prompt is still over budget, the oldest history items are dropped,
+	followed by the oldest errors.
+
+	Rollups only depend on the summaries they cover and history only grows at
+	the end, so rollups are memoized and each is computed once.
+	"""
+
+	def __init__(self, max_tokens=8192, recent=8, fanout=4, summarizer=None, counter=None, rollup_cache_size=512):
+		"""
+		Args:
+			max_tokens (int, optional): Token budget for the whole serialized prompt. Defaults to 8192.
+			recent (int, optional): Summaries kept verbatim. Defaults to 8.
+			fanout (int, optional): Items merged into one rollup. Defaults to 4.
+			summarizer (callable, optional): Turns a list of summaries into one. Defaults to extractive_summary.
+			counter (TokenCounter, optional): Token counter. Defaults to TokenCounter().
+			rollup_cache_size (int, optional): Rollups memoized. Defaults to 512.
+		"""
+		if fanout < 2:
+			raise ValueError("fanout must be at least 2.")
+		self.max_tokens = max_tokens
+		self.recent = recent
+		self.fanout = fanout
+		self.summarizer = summarizer or extractive_summary
+		self.counter = counter or TokenCounter()
+		self.rollups = LRUCache(maxsize=rollup_cache_size)
+		self.token_counts = LRUCache(maxsize=4096)
+		self.last_report = {}
+
+	def compact_history(self, history):
+		"""
+		Returns the compacted history: rollups, coarsest and oldest first, then
+		the recent summaries verbatim. Rollups are labelled with the range of
+		entries they cover, e.g. "[Entries 1-4] ...".
+		"""
+		split = max(len(history) - self.recent, 0)
+		# Level 0 items are the older summaries themselves, as (first, last, text).
+		level = [(i + 1, i + 1, text) for i, text in enumerate(history[:split])]
+		compacted = []
+		while len(level) > self.fanout:
+			# Groups are aligned to the oldest item so they stay the same as history grows.
+			full_groups = len(level) // self.fanout
+			compacted = level[full_groups * self.fanout:] + compacted
+			level = [self._rollup(level[i * self.fanout:(i + 1) * self.fanout]) for i in range(full_groups)]
+		compacted = level + compacted
+		items = [text if first == last else f"[Entries {first}-{last}] {text}" for first, last, text in compacted]
+		return items + list(history[split:])
+
+	def _rollup(self, group):
+		first, last = group[0][0], group[-1][1]
+		texts = tuple(text for _, _, text in group)
+		summary = self.rollups.get(texts)
+		if summary is None:
+			summary = self.summarizer(list(texts))
+			self.rollups.set(texts, summary)
+		return (first, last, summary)
+
+	def fit(self, prompt_obj):
+		"""
+		Fits a prompt to the budget in place and serializes it.
+
+		prompt_obj["history"] must hold the full history; it is replaced by its
+		compacted form and trimmed from the oldest end as needed, then the oldest
+		errors are dropped. Per-section token counts are recorded in last_report.
+		Each section and each history and error item is encoded once and the
+		prompt is joined from the pieces, so trimming does not re-encode the
+		other sections, and token counts of encoded pieces are memoized; the
+		result is identical to json.dumps(prompt_obj).
+
+		Returns:
+			str: The serialized prompt.
+
+		Raises:
+			PromptBudgetError: If the prompt is over budget with no history and no errors.
+		"""
+		history = self.compact_history(prompt_obj["history"] or [])
+		errors = list(prompt_obj["errors"] or [])
+		encoded = {
+			key: "[]" if key in ("history", "errors") else json.dumps(value)
+			for key, value in prompt_obj.items()
+		}
+		encoded_history = [json.dumps(item) for item in history]
+		encoded_errors = [json.dumps(error) for error in errors]
+		base = self.counter.count(_assemble(encoded))
+
+		# Each list item costs its own tokens plus roughly one for the separator.
+		available = self.max_tokens - base
+		error_costs = [self._count(item) + 1 for item in encoded_errors]
+		history_costs = [self._count(item) + 1 for item in encoded_history]
+		error_total, history_total = sum(error_costs), sum(history_costs)
+		dropped_errors = dropped_history = 0
+		while dropped_errors < len(errors) and error_total > available:
+			error_total -= error_costs[dropped_errors]
+			dropped_errors += 1
+		available -= error_total
+		while dropped_history < len(history) and history_total > available:
+			history_total -= history_costs[dropped_history]
+			dropped_history += 1
+
+		# Token boundaries can shift when items are joined; confirm against the exact count.
+		while True:
+			encoded["history"] = _join(encoded_history[dropped_history:])
+			encoded["errors"] = _join(encoded_errors[dropped_errors:])
+			prompt = _assemble(encoded)
+			total = self.counter.count(prompt)
+			if total <= self.max_tokens:
+				break
+			if dropped_history < len(history):
+				dropped_history += 1
+			elif dropped_errors < len(errors):
+				dropped_errors += 1
+			else:
+				raise PromptBudgetError(f"Prompt needs {total} tokens without history or errors; the budget is {self.max_tokens}.")
+
+		prompt_obj["history"] = history[dropped_history:]
+		prompt_obj["errors"] = errors[dropped_errors:]
+		self.last_report = {key: self._count(value) for key, value in encoded.items()}
+		self.last_report["total"] = total
+		return prompt
+
+	def _count(self, text):
+		"""Token count of an encoded piece, memoized."""
+		tokens = self.token_counts.get(text)
+		if tokens is None:
+			tokens = self.counter.count(text)
+			self.token_counts.set(text, tokens)
+		return tokens
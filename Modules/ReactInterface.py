@@ -1,25 +1,79 @@
+import json
 from flask import Flask
+from Modules.Cache import LRUCache
 from Modules.Database import Database
-from flask import Blueprint, request, jsonify
+from Modules.Scenario import Scenario
+from Modules.TurnScheduler import TurnScheduler
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 
-def create_react_interface(db):
+def create_react_interface(db, llm=None, scheduler=None):
     """
     Factory function to create the ReactInterface Blueprint with a shared Database instance.
     
     Args:
         db (Database): The shared Database instance.
+        llm (LLM, optional): The shared LLM instance, required for streaming turns.
+        scheduler (TurnScheduler, optional): Runs turns, serialized per story. A new one is created if omitted.
     
     Returns:
         Blueprint: The ReactInterface Blueprint.
     """
     react_interface = Blueprint('react_interface', __name__)
+    scheduler = scheduler or TurnScheduler()
+    # One Scenario per story, so the errors and history of a turn reach the next prompt.
+    scenarios = LRUCache(maxsize=256)
+
+    def on_change(event, story_id, changes):
+        # Prunes and revisions rewrite history; the Scenario is rebuilt on next use.
+        if event == "invalidate":
+            scenarios.invalidate(story_id)
+
+    db.add_listener(on_change)
 
     @react_interface.route('/api/story/load/<storyID>', methods=['GET'])
     def load_story(storyID):
-        """Retrieve the current state of the story."""
+        """
+        Retrieve the current state of the story.
+
+        With a "limit" query parameter only the most recent page of entries is
+        returned, together with cursors for fetching older ones.
+        """
         try:
-            state = db.retrieve_state(story_id=storyID)
+            limit = request.args.get('limit', type=int)
+            if limit is not None and limit < 1:
+                raise ValueError("Page limit must be at least 1.")
+            state = db.retrieve_state(story_id=storyID, last_n=limit)
             return jsonify(state), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @react_interface.route('/api/story/entries/<storyID>', methods=['GET'])
+    def load_entries(storyID):
+        """
+        Retrieve a page of story entries.
+
+        Query parameters:
+            after / before: Entry ID cursors for paging forwards or backwards.
+            limit: Page size (default 50).
+            around: Entry ID to centre a window on, with "radius" entries either side (default 10).
+        """
+        try:
+            around = request.args.get('around')
+            if around is not None:
+                radius = request.args.get('radius', default=10, type=int)
+                page = db.get_entries_window(story_id=storyID, entry_id=around, radius=radius)
+            else:
+                page = db.get_entries_page(
+                    story_id=storyID,
+                    after=request.args.get('after'),
+                    before=request.args.get('before'),
+                    limit=request.args.get('limit', default=50, type=int)
+                )
+            return jsonify(page), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
@@ -42,19 +96,71 @@ def create_react_interface(db):
         """Create a new branch starting from the specified entry."""
         try:
             branch_id = request.json.get('branch_id', None)
-            new_branch_entry_id = db.create_branch(entry_id=entryID, branch_title=title, branch_id=branch_id)
-            return jsonify({"new_branch_entry_id": new_branch_entry_id}), 201
+            branch_story_id = db.create_branch(entry_id=entryID, branch_title=title, branch_id=branch_id)
+            return jsonify({"branch_story_id": branch_story_id}), 201
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
     @react_interface.route('/api/story/prune/<entryID>', methods=['DELETE'])
     def prune_story(entryID):
-        """Roll back the story to the specified entry."""
+        """Roll back the story to the specified entry; ?story_id= rolls back a branch into its shared prefix."""
         try:
-            result = db.prune_story(entry_id=entryID)
-            return jsonify({"message": result}), 200
+            result = db.prune_story(entry_id=entryID, story_id=request.args.get('story_id'))
+            return jsonify(result), 200
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+    @react_interface.route('/api/story/stream', methods=['POST'])
+    def stream_turn():
+        """
+        Run a player turn, streaming the LLM's response as Server-Sent Events.
+
+        Prose from response.content is sent as "data" events holding
+        {"content": ...} as soon as it is generated. Each state update is sent
+        as an "update" event once it has been accepted for the entry, and a
+        "done" event carries the parsed response after the entry is committed.
+        An "error" event is sent if the turn fails part way.
+
+        The turn runs on the scheduler, after any earlier turn of the same story.
+        """
+        if llm is None:
+            return jsonify({"error": "No LLM is configured for streaming."}), 503
+        try:
+            data = request.json
+            story_id, user_text = data['story_id'], data['user_text']
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+
+        def turn():
+            # Turns of a story run one at a time, so its Scenario is only used by one turn at once.
+            scenario = scenarios.get(story_id)
+            if scenario is None:
+                scenario = Scenario(story_id=story_id, db=db)
+                scenarios.set(story_id, scenario)
+            elif len(scenario.history) != db.get_entry_count(story_id):
+                # Entries were added or pruned by another process.
+                scenario.load_history()
+            prompt = scenario.compose_prompt(user_text)
+            return scenario.stream_turn(llm.stream_prompt_sync(prompt, validate=scenario.validate_completion))
+
+        def events():
+            try:
+                for event in scheduler.stream(story_id, turn):
+                    if event.kind == "text":
+                        yield f"data: {json.dumps({'content': event.value})}\n\n"
+                    elif event.kind == "item":
+                        yield f"event: update\ndata: {json.dumps(event.value)}\n\n"
+                    elif event.kind == "done":
+                        yield f"event: done\ndata: {json.dumps(event.value)}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+        return Response(stream_with_context(events()), mimetype='text/event-stream')
+
+    @react_interface.route('/api/scheduler/stats', methods=['GET'])
+    def scheduler_stats():
+        """Report turn queue depth, throughput and wait times."""
+        return jsonify(scheduler.stats()), 200
+
     return react_interface
 
@@ -0,0 +1,178 @@
+import asyncio
+import random
+import threading
+import time
+
+# HTTP statuses worth retrying: timeouts, rate limits and server-side failures.
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+# Exception class names (anywhere in the MRO) raised by requests, aiohttp and
+# huggingface_hub for timeouts and dropped connections.
+RETRYABLE_NAMES = frozenset({
+    "TimeoutError", "ConnectionError", "InferenceTimeoutError", "Timeout", "ConnectTimeout",
+    "ReadTimeout", "ClientConnectionError", "ClientConnectorError", "ServerDisconnectedError",
+})
+
+
+class LLMError(Exception):
+    """Raised when an LLM call fails after retries and fallback."""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling the endpoint while its circuit breaker is open."""
+
+
+def is_retryable(error):
+    """Whether an error is transient: a timeout, a dropped connection, or a retryable HTTP status."""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    return any(cls.__name__ in RETRYABLE_NAMES for cls in type(error).__mro__)
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff.
+
+    The delay before retry n (starting at 1) is drawn uniformly from
+    [0, min(max_delay, base_delay * 2 ** (n - 1))] ("full jitter"), which
+    spreads out retries from many clients hitting the same incident.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0):
+        """
+        Args:
+            max_attempts (int, optional): Calls made at most, including the first. Defaults to 3.
+            base_delay (float, optional): Upper bound of the first delay in seconds. Defaults to 0.5.
+            max_delay (float, optional): Cap on the delay bound in seconds. Defaults to 8.0.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt):
+        """Seconds to wait after the given failed attempt (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an endpoint is unhealthy.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    are refused for reset_timeout seconds. Then a single trial call is let
+    through (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if self.trial or time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self):
+        """Whether a call may be made now. In the half-open state only one trial call is allowed."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+    def release(self):
+        """Ends a trial call that neither succeeded nor failed for health reasons."""
+        with self._lock:
+            self.trial = False
+
+
+def call_with_retry(fn, retry, breaker=None, deadline=None, sleep=time.sleep):
+    """
+    Calls fn(), retrying transient failures.
+
+    Args:
+        fn (callable): The call to make.
+        retry (RetryPolicy): Attempt limit and backoff.
+        breaker (CircuitBreaker, optional): Consulted before and updated after every attempt.
+        deadline (float, optional): time.monotonic() value after which no retry is started.
+
+    Raises:
+        CircuitOpenError: If the breaker refuses the call.
+        Exception: The last error, when it is not retryable or retries are exhausted.
+    """
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError("Circuit breaker is open; the endpoint is failing.")
+        attempt += 1
+        try:
+            result = fn()
+        except Exception as e:
+            delay = _after_failure(e, attempt, retry, breaker, deadline)
+            if delay is None:
+                raise
+            sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+async def call_with_retry_async(fn, retry, breaker=None, deadline=None):
+    """Async form of call_with_retry: fn() returns an awaitable."""
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError("Circuit breaker is open; the endpoint is failing.")
+        attempt += 1
+        try:
+            result = await fn()
+        except Exception as e:
+            delay = _after_failure(e, attempt, retry, breaker, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+def _after_failure(error, attempt, retry, breaker, deadline):
+    """Records a failed attempt; returns the delay before the next one, or None to give up."""
+    retryable = is_retryable(error)
+    if breaker is not None:
+        if retryable:
+            breaker.record_failure()
+        else:
+            breaker.release()
+    if not retryable or attempt >= retry.max_attempts:
+        return None
+    delay = retry.backoff(attempt)
+    if deadline is not None and time.monotonic() + delay >= deadline:
+        return None
+    return delay
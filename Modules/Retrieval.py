@@ -0,0 +1,251 @@
+import itertools
+import json
+import math
+import re
+import threading
+import time
+import weakref
+from collections import Counter, defaultdict
+
+from Modules.PromptBudget import TokenCounter
+
+_TOKEN = re.compile(r"[\w']+")
+# Words as used to find names in text: split on apostrophes too, so "Mara's" mentions "Mara".
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i in into is it its me my of on or our
+she so that the their them then there they this to was we were what when where which who will with
+you your
+""".split())
+
+
+def tokenize(text):
+	"""Lower-cased word tokens of a text, without stopwords."""
+	return [token for token in _TOKEN.findall((text or "").lower()) if token not in _STOPWORDS]
+
+
+class BM25Index:
+	"""
+	An in-memory Okapi BM25 index over short documents.
+
+	Postings are kept per term, so a search only touches documents that share
+	a term with the query.
+	"""
+
+	def __init__(self, k1=1.5, b=0.75):
+		self.k1 = k1
+		self.b = b
+		self.postings = defaultdict(dict)   # term -> {doc_id: term frequency}
+		self.lengths = {}                   # doc_id -> document length in tokens
+		self.total_length = 0
+
+	def add(self, doc_id, tokens):
+		"""Indexes a document, replacing any previous version of it."""
+		self.remove(doc_id)
+		for term, frequency in Counter(tokens).items():
+			self.postings[term][doc_id] = frequency
+		self.lengths[doc_id] = len(tokens)
+		self.total_length += len(tokens)
+
+	def remove(self, doc_id):
+		length = self.lengths.pop(doc_id, None)
+		if length is None:
+			return
+		self.total_length -= length
+		for term in list(self.postings):
+			postings = self.postings[term]
+			if postings.pop(doc_id, None) is not None and not postings:
+				del self.postings[term]
+
+	def search(self, tokens, limit=None):
+		"""
+		Ranks documents against query tokens.
+
+		Returns:
+			list: (doc_id, score) pairs, best first.
+		"""
+		if not self.lengths:
+			return []
+		count = len(self.lengths)
+		average = self.total_length / count or 1
+		scores = defaultdict(float)
+		for term in set(tokens):
+			postings = self.postings.get(term)
+			if not postings:
+				continue
+			idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+			for doc_id, frequency in postings.items():
+				norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average)
+				scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+		ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+		return ranked[:limit] if limit is not None else ranked
+
+
+class ContextRetriever:
+	"""
+	Selects the world entries relevant to a turn.
+
+	Characters, locations and traits, both the story world and the command
+	layer's Base* nodes, are read with Database.export_world and indexed
+	with BM25 over their names and descriptions (names count twice).
+	Entries whose full name appears in the player's text are ranked first,
+	found through an index from each name's first word, so a turn costs
+	time in proportion to its text rather than to the size of the world;
+	the rest follow by BM25 score. The selection is cut off at max_items and
+	at max_tokens of serialized context.
+
+	The index is rebuilt when it is older than max_age seconds or after
+	invalidate(), which the Database triggers on every world write. Only
+	one rebuild runs at a time. Once an index exists, rebuilds run in the
+	background and the old index is served until the new one is ready.
+	"""
+
+	def __init__(self, db, max_items=12, max_tokens=1500, max_age=300, counter=None):
+		"""
+		Args:
+			db (Database): The database to read the world from.
+			max_items (int, optional): Entries returned at most. Defaults to 12.
+			max_tokens (int, optional): Token budget for the serialized context. Defaults to 1500.
+			max_age (float, optional): Seconds before the index is rebuilt. None never rebuilds it. Defaults to 300.
+			counter (TokenCounter, optional): Token counter. Defaults to TokenCounter().
+		"""
+		self.db = db
+		self.max_items = max_items
+		self.max_tokens = max_tokens
+		self.max_age = max_age
+		self.counter = counter or TokenCounter()
+		self.index = None
+		self.entries = {}   # id -> exported node
+		self.names = {}     # first word of a name -> list of (name words, id)
+		self.built_at = None
+		self.generation = 0   # bumped by invalidate(), so a build that read the old world is not taken as fresh
+		self._lock = threading.Lock()
+		self._build_lock = threading.Lock()
+		self._rebuilding = False
+		if db is not None:
+			db.add_listener(self.on_change)
+
+	def on_change(self, event, story_id, changes):
+		"""Database listener: world writes invalidate the index."""
+		if event == "world":
+			self.invalidate()
+
+	def invalidate(self):
+		"""Forces the index to be rebuilt on next use."""
+		with self._lock:
+			self.built_at = None
+			self.generation += 1
+
+	def build(self, world=None):
+		"""
+		Builds the index.
+
+		Args:
+			world (iterable, optional): Exported nodes as yielded by Database.export_world.
+				Read from the database, story world and command layer world, if omitted.
+		"""
+		with self._lock:
+			generation = self.generation
+		if world is None:
+			world = itertools.chain(self.db.export_world(), self.db.export_command_world())
+		index = BM25Index()
+		entries, names = {}, defaultdict(list)
+		for node in world:
+			name = node.get("name") or node.get("title") or ""
+			entries[node["id"]] = node
+			words = tuple(_WORD.findall(name.lower()))
+			if words:
+				names[words[0]].append((words, node["id"]))
+			index.add(node["id"], tokenize(name) * 2 + tokenize(node.get("description")))
+		with self._lock:
+			self.index, self.entries, self.names = index, entries, names
+			self.built_at = time.monotonic() if generation == self.generation else None
+
+	def _ensure_index(self):
+		with self._lock:
+			if self.built_at is not None and (self.max_age is None or time.monotonic() - self.built_at < self.max_age):
+				return
+			if self.index is not None:
+				# Serve the current index while a single background rebuild runs.
+				if not self._rebuilding:
+					self._rebuilding = True
+					threading.Thread(target=self._rebuild, daemon=True).start()
+				return
+		# No index yet: build it once, with concurrent callers waiting for it.
+		with self._build_lock:
+			with self._lock:
+				if self.index is not None:
+					return
+			self.build()
+
+	def _rebuild(self):
+		try:
+			with self._build_lock:
+				self.build()
+		finally:
+			with self._lock:
+				self._rebuilding = False
+
+	def mentioned(self, text):
+		"""IDs of the entries whose full name appears in a text, in order of first mention."""
+		words = _WORD.findall((text or "").lower())
+		found = {}
+		for position, word in enumerate(words):
+			for name, entry_id in self.names.get(word, ()):
+				if entry_id not in found and tuple(words[position:position + len(name)]) == name:
+					found[entry_id] = True
+		return list(found)
+
+	def rank(self, text):
+		"""Returns the IDs of entries relevant to a text, most relevant first."""
+		self._ensure_index()
+		mentioned = self.mentioned(text)
+		ranked = [entry_id for entry_id, _ in self.index.search(tokenize(text))]
+		seen = set(mentioned)
+		return mentioned + [entry_id for entry_id in ranked if entry_id not in seen]
+
+	def get_context(self, text):
+		"""
+		Builds the prompt context for a turn.
+
+		Returns:
+			dict: Lists under "characters", "locations" and "traits" holding the
+				selected entries. Characters and locations list the titles of their
+				traits. Kinds with no selected entries are omitted.
+		"""
+		context = {}
+		used = 2
+		selected = 0
+		for entry_id in self.rank(text):
+			if selected >= self.max_items:
+				break
+			node = self.entries[entry_id]
+			item = {key: value for key, value in node.items() if key not in ("kind", "traits") and value is not None}
+			if node.get("traits"):
+				item["traits"] = [
+					self.entries[trait_id].get("title") or self.entries[trait_id].get("name")
+					for trait_id in node["traits"] if trait_id in self.entries
+				]
+			cost = self.counter.count(json.dumps(item)) + 1
+			if used + cost > self.max_tokens:
+				continue
+			context.setdefault(node["kind"], []).append(item)
+			used += cost
+			selected += 1
+		return context
+
+
+_retrievers = weakref.WeakKeyDictionary()
+_retrievers_lock = threading.Lock()
+
+
+def shared_retriever(db, **kwargs):
+	"""
+	Returns the ContextRetriever shared by every Scenario using db, so the
+	index is built once per process rather than once per request.
+	"""
+	with _retrievers_lock:
+		retriever = _retrievers.get(db)
+		if retriever is None:
+			retriever = _retrievers[db] = ContextRetriever(db, **kwargs)
+		return retriever
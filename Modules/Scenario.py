@@ -2,8 +2,10 @@ import json
 import uuid
 import re
 from datetime import datetime
-from app import execute_cypher  # Assumes execute_cypher is globally available
-import copy
+from Modules.DatabaseMap import MAP_DIRECTIVE, shared_map_builder
+from Modules.PromptBudget import PromptBudget
+from Modules.Retrieval import shared_retriever
+from Modules.StreamParser import ParseEvent, StreamingResponseParser
 
 class Scenario:
 	"""
@@ -18,21 +20,37 @@ class Scenario:
 		- The prompt template is stored as a property (self.prompt_template) and includes keys:
 			directives, errors, OOC, context, content, history, database_map.
 		These keys will be filled on each prompt composition.
-		- Only history is persistent (updated cumulatively). Dynamic values such as context and 
-			database_map are computed on demand.
+		- Only history is persistent (updated cumulatively). It is loaded from the
+			story's Entry summaries when an existing story is opened. Dynamic values
+			such as context and database_map are computed on demand.
 		- The directives property is a dict that the user populates with instructions.
 		- Errors are stored as a list.
+		- Prompts are kept under a token budget (self.budget): older history is
+			rolled up into hierarchical summaries and trimmed as needed.
 	"""
 	
-	def __init__(self, story_id=None):
+	def __init__(self, story_id=None, db=None, budget=None, retriever=None, map_builder=None):
+		# Database access goes through the shared data layer owned by the Database.
+		# Fall back to the application's instance when none is given.
+		if db is None:
+			from app import db
+		self.db = db
+
 		# Directives stored as a dict. The user is responsible for populating this.
 		self.directives = {
-			"main": "You are an LLM maintaining characters and world state in a prose exchange game."
+			"main": "You are an LLM maintaining characters and world state in a prose exchange game.",
+			"database_map": MAP_DIRECTIVE
 		}
 		# Errors is an array.
 		self.errors = []
 		# History (a list of summaries) is persistent.
 		self.history = []
+		# Token budget applied to every composed prompt.
+		self.budget = budget or PromptBudget()
+		# Selects the world entries relevant to each turn for the prompt context.
+		self.retriever = retriever or shared_retriever(self.db)
+		# Keeps each story's compact database map up to date from committed changes.
+		self.map_builder = map_builder or shared_map_builder(self.db)
 		
 		# The following two are not stored persistently:
 		# Context and database_map will be computed when needed.
@@ -62,6 +80,8 @@ class Scenario:
 		
 		self.story_id = story_id
 		self.init_story()
+		if story_id is not None:
+			self.load_history()
 
 	def init_story(self):
 		"""
@@ -73,7 +93,7 @@ class Scenario:
 			CREATE (s:Story {id: $story_id, created_at: timestamp()})
 			RETURN s
 			"""
-			result, err = execute_cypher(query, {"story_id": new_story_id})
+			result, err = self.db.execute_cypher(query, {"story_id": new_story_id})
 			if err:
 				raise Exception(f"Error creating new story: {err}")
 			self.story_id = new_story_id
@@ -82,11 +102,15 @@ class Scenario:
 			MATCH (s:Story {id: $story_id})
 			RETURN s
 			"""
-			result, err = execute_cypher(query, {"story_id": self.story_id})
+			result, err = self.db.execute_cypher(query, {"story_id": self.story_id}, write=False)
 			if err or not result:
 				raise Exception(f"Error loading story {self.story_id}: {err or 'Story not found'}")
 		return self.story_id
 
+	def load_history(self):
+		"""Replaces history with the summaries of the story's entries, one per entry."""
+		self.history = self.db.get_summaries(self.story_id)
+
 	def extract_ooc(self, text):
 		"""
 		Extract out-of-character (OOC) content from the given text.
@@ -100,22 +124,29 @@ class Scenario:
 		clean_text = re.sub(r'\[OOC:.*?\]', '', text, flags=re.IGNORECASE).strip()
 		return clean_text, ooc_text
 
-	def get_context(self):
+	def get_context(self, text=""):
 		"""
-		Compute and return dynamic context.
-		This could include current characters, room state, upcoming events, etc.
-		For now, we return an empty dict as a placeholder.
+		Compute and return dynamic context for a turn.
+		
+		The characters, locations and traits most relevant to the text (the
+		cleaned user input) are selected by self.retriever: entries named in the
+		text first, then by BM25 relevance of their names and descriptions,
+		within the retriever's item and token limits.
 		"""
-		# TODO: Replace with actual dynamic context computation.
-		return {}
+		return self.retriever.get_context(text)
 
 	def get_database_map(self):
 		"""
-		Compute and return a structured snapshot of the database state.
-		For now, return an empty dict as a placeholder.
+		Return a compact snapshot of the story's current object states.
+		
+		States are deduplicated into a list under "s" and objects are referenced
+		by ID under short type keys (see DatabaseMap.render_map). The map is
+		maintained incrementally by self.map_builder, so this reads only the
+		story's entry count unless the story changed elsewhere or was invalidated.
 		"""
-		# TODO: Replace with actual database map logic.
-		return {}
+		if self.story_id is None:
+			return {}
+		return self.map_builder.get(self.story_id)
 
 	def compose_prompt(self, user_text):
 		"""
@@ -124,23 +155,33 @@ class Scenario:
 		The final JSON object includes keys in this order:
 			directives, errors, OOC, context, content, history, database_map.
 		The values for 'directives', 'errors', and 'history' come from the object's properties.
-		'context' and 'database_map' are computed on demand.
+		'context' and 'database_map' are computed on demand; context only holds
+		the world entries relevant to the cleaned user text.
 		'OOC' and 'content' come from processing the user_text.
+		
+		The prompt is fitted to self.budget: history beyond the most recent
+		summaries is sent as rollups, and the oldest history items and errors
+		are dropped if the prompt would still exceed the token budget.
+		Per-section token counts are available in self.budget.last_report.
+		
+		Raises:
+			PromptBudgetError: If the prompt does not fit even without history and errors.
 		"""
 		clean_text, ooc_text = self.extract_ooc(user_text)
 		
-		# Create a fresh copy of the prompt template.
-		prompt_obj = copy.deepcopy(self.prompt_template)
+		# The template only fixes the key order; sections are filled in below
+		# and serialized piecewise by the budget.
+		prompt_obj = dict.fromkeys(self.prompt_template)
 		
 		prompt_obj["directives"] = self.directives
 		prompt_obj["errors"] = self.errors  # This is now an array.
 		prompt_obj["OOC"] = ooc_text
-		prompt_obj["context"] = self.get_context()
+		prompt_obj["context"] = self.get_context(clean_text)
 		prompt_obj["content"] = clean_text
 		prompt_obj["history"] = self.history
 		prompt_obj["database_map"] = self.get_database_map()
 		
-		return json.dumps(prompt_obj)
+		return self.budget.fit(prompt_obj)
 
 	def parse_response(self, response_json):
 		"""
@@ -183,4 +224,45 @@ class Scenario:
 				}
 			}
 		except Exception as e:
-			raise Exception(f"Error parsing response: {str(e)}")
\ No newline at end of file
+			raise Exception(f"Error parsing response: {str(e)}")
+
+	def validate_completion(self, completion):
+		"""Raises unless a complete LLM completion parses as a valid response; used to gate caching."""
+		self.parse_response(json.loads(completion))
+
+	def stream_turn(self, chunks):
+		"""
+		Consumes a streamed LLM response for one turn, committing it as it arrives.
+		
+		Each chunk is fed to an incremental parser driven by self.response_template.
+		Every element of response.updates is validated as soon as it closes and
+		collected by an EntryWriter. Once the response is complete it is
+		validated with parse_response, the Entry and its updates are committed
+		in one short transaction and its summary is appended to history.
+		Updates that cannot be applied are recorded in self.errors for the next
+		prompt.
+		
+		Args:
+			chunks (iterable): Text chunks of the response, e.g.
+				LLM.stream_prompt_sync(prompt, validate=scenario.validate_completion).
+		
+		Yields:
+			ParseEvent: "text" fragments of response.content, completed "field"s
+				and update "item"s, and finally "done" with the parsed response
+				once the Entry has been committed.
+		"""
+		parser = StreamingResponseParser(self.response_template)
+		with self.db.begin_entry(self.story_id) as writer:
+			for chunk in chunks:
+				for event in parser.feed(chunk):
+					if event.kind == "item" and event.path == ("response", "updates"):
+						try:
+							writer.apply(event.value)
+						except (ValueError, KeyError, TypeError) as e:
+							self.errors.append(f"Rejected update {json.dumps(event.value)}: {str(e)}")
+					if event.kind != "done":
+						yield event
+			parsed = self.parse_response(parser.close())
+			writer.commit(parsed["response"]["content"], parsed["response"]["summary"])
+		self.history.append(parsed["response"]["summary"])
+		yield ParseEvent("done", (), parsed)
@@ -0,0 +1,241 @@
+import json
+from collections import namedtuple
+
+# An event produced while parsing a streamed response.
+#   kind:  "text"  - a decoded fragment of a streamed string field (value is the fragment)
+#          "field" - a string or scalar field of the template has completed
+#          "item"  - an element of a list field of the template has completed
+#          "done"  - the whole response has been parsed (value is the full dict)
+#   path:  tuple of keys locating the field, e.g. ("response", "content")
+ParseEvent = namedtuple("ParseEvent", ["kind", "path", "value"])
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_DELIMITERS = set(",]} \t\r\n")
+
+
+class StreamingResponseParser:
+	"""
+	Incrementally parses an LLM's JSON response as it is streamed.
+
+	The parser is driven by a response template (see Scenario.response_template):
+		- string fields listed in stream_paths are emitted fragment by fragment
+		  as soon as their characters can be decoded,
+		- elements of list fields are emitted as soon as each one closes,
+		- other string and scalar fields are emitted once complete.
+	Anything before the first "{" (e.g. a Markdown code fence) is ignored, as
+	is anything after the top-level object closes.
+	"""
+
+	def __init__(self, template, stream_paths=(("response", "content"),)):
+		self.stream_paths = set(stream_paths)
+		self.field_paths, self.list_paths = self._template_paths(template)
+		self.buffer = []          # Characters of the top-level object.
+		self.offset = 0           # Length of the buffer.
+		self.stack = []           # Open containers: [type, key or index, start offset].
+		self.state = "START"
+		self.string = None        # String being read: {"key": bool, "chars": list, "escape": str or None}
+		self.pending_surrogate = ""
+		self.value_start = None   # Offset of the scalar or string value being read.
+		self.result = None
+
+	@staticmethod
+	def _template_paths(template, prefix=()):
+		"""Returns the paths of scalar fields and of list fields in a template."""
+		fields, lists = set(), set()
+		for key, value in template.items():
+			path = prefix + (key,)
+			if isinstance(value, dict):
+				sub_fields, sub_lists = StreamingResponseParser._template_paths(value, path)
+				fields |= sub_fields
+				lists |= sub_lists
+			elif isinstance(value, list):
+				lists.add(path)
+			else:
+				fields.add(path)
+		return fields, lists
+
+	def feed(self, chunk):
+		"""
+		Consumes a chunk of streamed text.
+
+		Returns:
+			list: The ParseEvents completed by this chunk, in order.
+		"""
+		events = []
+		for char in chunk:
+			if self.state == "END":
+				break
+			if self.state == "START":
+				if char == "{":
+					self._append(char)
+					self._open("object", events)
+				continue
+			self._append(char)
+			self._step(char, events)
+		return events
+
+	def close(self):
+		"""
+		Finishes parsing.
+
+		Returns:
+			dict: The complete parsed response.
+
+		Raises:
+			ValueError: If the stream ended before the response was complete.
+		"""
+		if self.result is None:
+			raise ValueError("Response stream ended before the JSON object was complete.")
+		return self.result
+
+	def _append(self, char):
+		self.buffer.append(char)
+		self.offset += 1
+
+	def _path(self):
+		"""Path of the value currently being read."""
+		return tuple(entry[1] for entry in self.stack)
+
+	def _step(self, char, events):
+		state = self.state
+		if state == "STRING":
+			self._string_char(char, events)
+		elif state == "SCALAR":
+			if char in _DELIMITERS:
+				# The delimiter belongs to the enclosing container.
+				self._complete_value(self.offset - 1, events)
+				self._step(char, events)
+		elif char in " \t\r\n":
+			return
+		elif state == "KEY_OR_END":
+			if char == '"':
+				self._start_string(key=True)
+			elif char == "}":
+				self._close(events)
+			else:
+				raise ValueError(f"Expected an object key, got {char!r}")
+		elif state == "COLON":
+			if char != ":":
+				raise ValueError(f"Expected ':', got {char!r}")
+			self.state = "VALUE"
+		elif state in ("VALUE", "VALUE_OR_END"):
+			if char == "]" and state == "VALUE_OR_END":
+				self._close(events)
+			else:
+				self._start_value(char, events)
+		elif state == "COMMA_OR_END":
+			container = self.stack[-1]
+			if char == ",":
+				if container[0] == "object":
+					self.state = "KEY"
+				else:
+					container[1] += 1
+					self.state = "VALUE"
+			elif char in "}]":
+				self._close(events)
+			else:
+				raise ValueError(f"Expected ',' or end of container, got {char!r}")
+		elif state == "KEY":
+			if char != '"':
+				raise ValueError(f"Expected an object key, got {char!r}")
+			self._start_string(key=True)
+
+	def _start_value(self, char, events):
+		self.value_start = self.offset - 1
+		if char == "{":
+			self._open("object", events)
+		elif char == "[":
+			self._open("array", events)
+		elif char == '"':
+			self._start_string(key=False)
+		else:
+			self.state = "SCALAR"
+
+	def _open(self, kind, events):
+		start = self.offset - 1
+		self.stack.append([kind, None if kind == "object" else 0, start])
+		self.state = "KEY_OR_END" if kind == "object" else "VALUE_OR_END"
+
+	def _close(self, events):
+		kind, _, start = self.stack.pop()
+		self.value_start = start
+		if not self.stack:
+			self.result = json.loads("".join(self.buffer))
+			self.state = "END"
+			events.append(ParseEvent("done", (), self.result))
+			return
+		self._complete_value(self.offset, events)
+
+	def _start_string(self, key):
+		self.string = {"key": key, "chars": [], "escape": None}
+		self.state = "STRING"
+
+	def _string_char(self, char, events):
+		string = self.string
+		if string["escape"] is not None:
+			string["escape"] += char
+			escape = string["escape"]
+			if escape[1] == "u" and len(escape) < 6:
+				return
+			string["escape"] = None
+			decoded = self._decode_escape(escape)
+		elif char == "\\":
+			string["escape"] = char
+			return
+		elif char == '"':
+			self._emit_text(self._flush_surrogate(), events)
+			text = "".join(string["chars"])
+			self.string = None
+			if string["key"]:
+				self.stack[-1][1] = text
+				self.state = "COLON"
+			else:
+				self._complete_value(self.offset, events)
+			return
+		else:
+			decoded = char
+		self._emit_text(decoded, events)
+
+	def _emit_text(self, decoded, events):
+		"""Adds decoded characters to the current string, emitting them if its field is streamed."""
+		if not decoded:
+			return
+		self.string["chars"].append(decoded)
+		if not self.string["key"]:
+			path = self._path()
+			if path in self.stream_paths:
+				events.append(ParseEvent("text", path, decoded))
+
+	def _decode_escape(self, escape):
+		"""Decodes one escape sequence, holding back a high surrogate until its pair arrives."""
+		if escape[1] != "u":
+			if escape[1] not in _ESCAPES:
+				raise ValueError(f"Invalid escape sequence {escape!r}")
+			return self._flush_surrogate() + _ESCAPES[escape[1]]
+		code = int(escape[2:], 16)
+		if 0xD800 <= code <= 0xDBFF:
+			held = self._flush_surrogate()
+			self.pending_surrogate = escape
+			return held
+		if 0xDC00 <= code <= 0xDFFF and self.pending_surrogate:
+			pair = self.pending_surrogate + escape
+			self.pending_surrogate = ""
+			return json.loads(f'"{pair}"')
+		return self._flush_surrogate() + chr(code)
+
+	def _flush_surrogate(self):
+		"""Releases a high surrogate that was not followed by its low half."""
+		held, self.pending_surrogate = self.pending_surrogate, ""
+		return json.loads(f'"{held}"') if held else ""
+
+	def _complete_value(self, end, events):
+		"""Handles a value that ended at offset end, then moves on to the enclosing container."""
+		path = self._path()
+		container = self.stack[-1]
+		if container[0] == "array" and path[:-1] in self.list_paths:
+			value = json.loads("".join(self.buffer[self.value_start:end]))
+			events.append(ParseEvent("item", path[:-1], value))
+		elif path in self.field_paths:
+			value = json.loads("".join(self.buffer[self.value_start:end]))
+			events.append(ParseEvent("field", path, value))
+		self.state = "COMMA_OR_END"
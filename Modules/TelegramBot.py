@@ -1,47 +1,139 @@
 # modules/telegram_bot.py
 
 import threading
+import time
 import traceback
 from telebot import TeleBot
 from datetime import datetime
 from modules.CommandHandler import CommandHandler
+from Modules.Scenario import Scenario
+from Modules.TurnScheduler import SchedulerFullError, TurnScheduler
 
-# For narrative input, assume you have a Scenario class defined elsewhere
-# from modules.scenario import Scenario
-# For now, we simulate narrative handling.
+# Minimum seconds between edits of a streaming reply; Telegram rate-limits
+# message edits to roughly one per second per chat.
+STREAM_EDIT_INTERVAL = 1.0
+# Telegram's maximum message length.
+MAX_MESSAGE_LENGTH = 4096
+# Reply sent when a message is refused because too many are waiting.
+BUSY_MESSAGE = "The storyteller is busy; please send that again in a moment."
 
 class TelegramBot:
-	def __init__(self, token, db, llm):
+	def __init__(self, token, db, llm, scheduler=None, workers=8, max_pending=100, max_pending_per_chat=5):
+		"""
+		Args:
+			token (str): The Telegram bot token.
+			db (Database): The database.
+			llm (LLM): Generates narrative turns; None to echo narrative input.
+			scheduler (TurnScheduler, optional): Runs LLM turns, one at a time per story.
+			workers (int, optional): Messages processed at the same time. Defaults to 8.
+			max_pending (int, optional): Messages allowed to wait, in total. Defaults to 100.
+			max_pending_per_chat (int, optional): Messages allowed to wait per chat. Defaults to 5.
+		"""
 		self.token = token
 		self.llm = llm
-		self.bot = TeleBot(self.token)
+		# Handlers only queue updates, so the polling thread can call them inline.
+		self.bot = TeleBot(self.token, threaded=False)
 		self.db = db
-		self.command_handler = CommandHandler()
+		self.command_handler = CommandHandler(db)
+		# One Scenario (and so one Story) per chat, created on first narrative input.
+		self.scenarios = {}
+		# Turns run on the scheduler, one at a time per story.
+		self.scheduler = scheduler or TurnScheduler()
+		# Messages are processed on a separate pool, one at a time per chat, so a
+		# slow turn holds up only its own chat. It must not share workers with the
+		# turn scheduler, whose turns the message workers wait on.
+		self.updates = TurnScheduler(max_concurrency=workers, max_pending=max_pending,
+			max_pending_per_key=max_pending_per_chat, thread_name_prefix="telegram")
+		self._polling_thread = None
 		self._setup_handlers()
 	
 	def _setup_handlers(self):
 		@self.bot.message_handler(func=lambda message: True)
 		def handle_message(message):
-			chat_id = message.chat.id
-			user_text = message.text.strip()
-			response_text = ""
 			try:
-				if user_text.startswith("/"):
-					# Allow for multiple commands separated by newlines.
-					commands = [cmd for cmd in user_text.split("\n") if cmd.startswith("/")]
-					response_text = self.command_handler.handle_commands(commands)
-				else:
-					# For narrative input, delegate to the Scenario layer.
-					# In your full implementation, you'd call something like:
-					# response_text = active_scenario.process_narrative(user_text)
-					timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-					response_text = f"Received narrative input at {timestamp}:\n{user_text}"
-				self.bot.send_message(chat_id, response_text)
-			except Exception as e:
-				error_message = f"Error handling message: {str(e)}\n{traceback.format_exc()}"
-				print(error_message)
-				self.bot.send_message(chat_id, error_message)
-	
+				self.updates.submit(message.chat.id, self._process_message, message)
+			except SchedulerFullError:
+				self.bot.send_message(message.chat.id, BUSY_MESSAGE)
+			except RuntimeError:
+				pass   # Shutting down; the update is dropped.
+
+	def _process_message(self, message):
+		"""Handles one message on a worker; messages of a chat are processed in order."""
+		chat_id = message.chat.id
+		user_text = (message.text or "").strip()
+		response_text = ""
+		try:
+			if user_text.startswith("/"):
+				# Allow for multiple commands separated by newlines.
+				commands = [cmd for cmd in user_text.split("\n") if cmd.startswith("/")]
+				current = self.scenarios.get(chat_id)
+				context = {"story_id": current.story_id if current else None}
+				response_text = self.command_handler.handle_commands(commands, context=context)
+				if context["story_id"] is not None and (current is None or context["story_id"] != current.story_id):
+					# /story/load switched the chat to another story.
+					self.scenarios[chat_id] = Scenario(story_id=context["story_id"], db=self.db)
+			elif self.llm is not None:
+				# For narrative input, delegate to the Scenario layer and stream the reply.
+				scenario = self._get_scenario(chat_id)
+
+				def turn():
+					prompt = scenario.compose_prompt(user_text)
+					return scenario.stream_turn(self.llm.stream_prompt_sync(prompt, validate=scenario.validate_completion))
+
+				events = self.scheduler.stream(scenario.story_id, turn)
+				self._stream_reply(chat_id, (event.value for event in events if event.kind == "text"))
+				return
+			else:
+				timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+				response_text = f"Received narrative input at {timestamp}:\n{user_text}"
+			self.bot.send_message(chat_id, response_text)
+		except Exception as e:
+			error_message = f"Error handling message: {str(e)}\n{traceback.format_exc()}"
+			print(error_message)
+			self.bot.send_message(chat_id, error_message)
+
+	def _get_scenario(self, chat_id):
+		"""Returns the chat's Scenario, starting a new story on first use."""
+		if chat_id not in self.scenarios:
+			self.scenarios[chat_id] = Scenario(db=self.db)
+		return self.scenarios[chat_id]
+
+	def _stream_reply(self, chat_id, chunks):
+		"""
+		Sends a reply that grows as text chunks arrive, editing one message in place
+		at most once every STREAM_EDIT_INTERVAL seconds.
+		
+		Returns:
+			str: The complete reply text.
+		"""
+		message = self.bot.send_message(chat_id, "…")
+		text = ""
+		shown = ""
+		last_edit = time.monotonic()
+		for chunk in chunks:
+			text += chunk
+			visible = text[:MAX_MESSAGE_LENGTH]
+			if visible.strip() and visible != shown and time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+				shown = visible
+				self.bot.edit_message_text(shown, chat_id, message.message_id)
+				last_edit = time.monotonic()
+		if text.strip() and text[:MAX_MESSAGE_LENGTH] != shown:
+			self.bot.edit_message_text(text[:MAX_MESSAGE_LENGTH], chat_id, message.message_id)
+		return text
+
 	def start_polling(self):
-		thread = threading.Thread(target=self.bot.polling, kwargs={"none_stop": True}, daemon=True)
-		thread.start()
+		self._polling_thread = threading.Thread(target=self.bot.polling, kwargs={"none_stop": True}, daemon=True)
+		self._polling_thread.start()
+
+	def stop(self, timeout=None):
+		"""
+		Stops polling for updates, then lets the messages already received finish.
+		
+		Args:
+			timeout (float, optional): Seconds to let waiting messages start; those still
+				waiting afterwards are dropped. Running turns always finish. Defaults to no limit.
+		"""
+		self.bot.stop_polling()
+		if self._polling_thread is not None:
+			self._polling_thread.join(timeout)
+		self.updates.shutdown(wait=True, timeout=timeout)
@@ -0,0 +1,232 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class SchedulerFullError(RuntimeError):
+    """Raised by TurnScheduler.submit when too many turns are already waiting."""
+
+
+class TurnScheduler:
+    """
+    Runs story turns concurrently while keeping each story's turns in order.
+
+    Every turn is submitted under a key (the story ID). Turns with different
+    keys run in parallel on a pool of max_concurrency workers, which bounds
+    the number of simultaneous LLM calls. Turns with the same key run one at
+    a time in submission order: a key's next turn is handed to the pool only
+    when its previous turn has finished, so a slow story never holds a
+    worker while it waits.
+
+    The queues can be bounded: once max_pending turns are waiting in total,
+    or max_pending_per_key for one key, further turns are refused with
+    SchedulerFullError instead of piling up.
+    """
+
+    def __init__(self, max_concurrency=4, max_pending=None, max_pending_per_key=None, thread_name_prefix="turn"):
+        """
+        Args:
+            max_concurrency (int, optional): Turns run at the same time. Defaults to 4.
+            max_pending (int, optional): Turns allowed to wait to start, in total. Defaults to no limit.
+            max_pending_per_key (int, optional): Turns allowed to wait to start per key. Defaults to no limit.
+            thread_name_prefix (str, optional): Names the worker threads. Defaults to "turn".
+        """
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.max_pending_per_key = max_pending_per_key
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=thread_name_prefix)
+        self._pending = {}      # key -> deque of (fn, args, kwargs, future, submitted_at)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.running = 0
+        self.queued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Queues a turn.
+
+        Args:
+            key: Turns sharing a key are serialized, e.g. a story ID.
+            fn (callable): The turn, called as fn(*args, **kwargs).
+
+        Returns:
+            Future: Resolves to the turn's return value or exception.
+
+        Raises:
+            SchedulerFullError: If the total or per-key limit of waiting turns is reached.
+            RuntimeError: If the scheduler has been shut down.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Cannot schedule new turns after shutdown.")
+            turns = self._pending.get(key)
+            if (self.max_pending is not None and self.queued >= self.max_pending) or \
+                    (self.max_pending_per_key is not None and turns and len(turns) >= self.max_pending_per_key):
+                self.rejected += 1
+                raise SchedulerFullError("Too many turns are waiting; try again later.")
+            self.submitted += 1
+            self.queued += 1
+            idle = turns is None
+            if idle:
+                turns = self._pending[key] = deque()
+            turns.append((fn, args, kwargs, future, time.monotonic()))
+        if idle:
+            self._executor.submit(self._run_next, key)
+        return future
+
+    def run(self, key, fn, *args, **kwargs):
+        """Runs a turn through the scheduler and waits for its result."""
+        return self.submit(key, fn, *args, **kwargs).result()
+
+    def stream(self, key, make_iterable):
+        """
+        Runs a streaming turn through the scheduler and yields its items.
+
+        make_iterable is called on a worker when the turn starts, and the
+        items it produces are handed to the caller through a queue. The
+        story stays locked until the iterable is exhausted. Closing the
+        returned generator early stops the turn at its next item.
+
+        Args:
+            key: Turns sharing a key are serialized, e.g. a story ID.
+            make_iterable (callable): Returns the turn's iterable, e.g. a Scenario.stream_turn generator.
+        """
+        items = queue.Queue()
+        done = object()
+        cancelled = threading.Event()
+
+        def turn():
+            try:
+                iterable = make_iterable()
+                try:
+                    for item in iterable:
+                        if cancelled.is_set():
+                            break
+                        items.put(item)
+                finally:
+                    close = getattr(iterable, "close", None)
+                    if close is not None:
+                        close()
+            except BaseException as e:
+                items.put(_TurnError(e))
+                raise
+            finally:
+                items.put(done)
+
+        self.submit(key, turn)
+        try:
+            while True:
+                item = items.get()
+                if item is done:
+                    return
+                if isinstance(item, _TurnError):
+                    raise item.error
+                yield item
+        finally:
+            cancelled.set()
+
+    def _run_next(self, key):
+        """Runs the oldest pending turn of a key, then hands the key's next turn to the pool."""
+        with self._lock:
+            fn, args, kwargs, future, submitted_at = self._pending[key].popleft()
+            wait = time.monotonic() - submitted_at
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        started = time.monotonic()
+        failed = cancelled = False
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                failed = True
+                future.set_exception(e)
+        else:
+            cancelled = True
+        with self._lock:
+            self.running -= 1
+            self.total_run += time.monotonic() - started
+            if cancelled:
+                self.cancelled += 1
+            elif failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            more = bool(self._pending[key])
+            if not more:
+                del self._pending[key]
+        if more:
+            self._executor.submit(self._run_next, key)
+
+    def queue_depth(self, key=None):
+        """Turns waiting to start, for one key or in total."""
+        with self._lock:
+            if key is None:
+                return self.queued
+            turns = self._pending.get(key)
+            return len(turns) if turns else 0
+
+    def stats(self):
+        """Returns queue depth, throughput and wait-time metrics."""
+        with self._lock:
+            started = self.completed + self.failed + self.cancelled + self.running
+            finished = self.completed + self.failed + self.cancelled
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_pending": self.max_pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "running": self.running,
+                "queued": self.queued,
+                "active_keys": len(self._pending),
+                "avg_wait": self.total_wait / started if started else 0.0,
+                "max_wait": self.max_wait,
+                "avg_run": self.total_run / finished if finished else 0.0,
+            }
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stops accepting turns and drains the queues.
+
+        Args:
+            wait (bool, optional): Block until queued and running turns have finished. Defaults to True.
+            timeout (float, optional): Seconds to let queued turns start; those still waiting
+                afterwards are cancelled. Running turns always finish. Defaults to no limit.
+        """
+        with self._lock:
+            self._closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if wait:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        break
+                    if deadline is not None and time.monotonic() >= deadline:
+                        for turns in self._pending.values():
+                            for turn in turns:
+                                turn[3].cancel()
+                        deadline = None
+                time.sleep(0.01)
+        self._executor.shutdown(wait=wait)
+
+
+class _TurnError:
+    """Carries an exception raised by a streaming turn across the item queue."""
+
+    def __init__(self, error):
+        self.error = error
@@ -5,6 +5,9 @@ from Modules.ReactInterface import create_react_interface
 from Modules.Database import Database
 from Modules.TelegramBot import TelegramBot
 from Modules.LLM import LLM
+from Modules.LLMBatcher import LLMBatcher, TransformersBackend
+from Modules.CompletionCache import CompletionCache
+from Modules.TurnScheduler import TurnScheduler
 
 # Global variable for the current active Scenario instance.
 current_scenario = None
@@ -30,19 +33,85 @@ LLM_API_KEY = os.environ.get("LLM_API_KEY", credentials["hugging_face"])
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN", credentials["telegram"])
 
 LLM_MODEL = os.environ.get("LLM_MODEL", "meta-llama/Llama-3.3-70B-Instruct")
+# Optional secondary model used while the primary one is failing.
+LLM_FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL")
+# Seconds allowed per LLM call (and between streamed tokens), and for a call including retries.
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 60.0))
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", 120.0))
+
+# Connection pool settings for the shared Neo4j driver.
+DB_MAX_POOL_SIZE = int(os.environ.get("NEO4J_MAX_POOL_SIZE", 50))
+DB_ACQUISITION_TIMEOUT = float(os.environ.get("NEO4J_ACQUISITION_TIMEOUT", 30.0))
+DB_MAX_CONNECTION_LIFETIME = int(os.environ.get("NEO4J_MAX_CONNECTION_LIFETIME", 3600))
+
+# Instantiate the Database.
+db = Database(
+    uri=DB_URI,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    max_connection_pool_size=DB_MAX_POOL_SIZE,
+    connection_acquisition_timeout=DB_ACQUISITION_TIMEOUT,
+    max_connection_lifetime=DB_MAX_CONNECTION_LIFETIME
+)
+
+# Create the constraints and indexes queries rely on. Every statement is IF NOT EXISTS,
+# so this is cheap once the schema is in place. Set NEO4J_SETUP_SCHEMA=0 to skip it
+# when the schema is managed separately.
+# It also numbers the entries of stories written before entries had ordinals; paging
+# and HEAD/TAIL reads need those ordinals.
+if os.environ.get("NEO4J_SETUP_SCHEMA", "1").lower() not in ("0", "false", "no"):
+    backfill = db.setup_schema()
+    if backfill["skipped"]:
+        print(f"Stories with partly numbered entries were not backfilled: {', '.join(backfill['skipped'])}")
+
+# Completion cache: identical prompts (retries, replays after a prune) are not re-sent.
+# Set LLM_CACHE_PATH to keep completions on disk across restarts.
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH")
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", 1024))
+LLM_CACHE_SAMPLED = os.environ.get("LLM_CACHE_SAMPLED", "").lower() in ("1", "true", "yes")
+
+# Optional local generation: with LLM_LOCAL_BATCHING=1, turns for LLM_MODEL are generated
+# by a local transformers pipeline (the transformers package must be installed), batching
+# up to LLM_BATCH_SIZE prompts that arrive within LLM_BATCH_WAIT seconds. A batched call
+# that fails or exceeds LLM_TIMEOUT falls back to the hosted inference API.
+LLM_LOCAL_BATCHING = os.environ.get("LLM_LOCAL_BATCHING", "").lower() in ("1", "true", "yes")
+LLM_BATCH_SIZE = int(os.environ.get("LLM_BATCH_SIZE", 8))
+LLM_BATCH_WAIT = float(os.environ.get("LLM_BATCH_WAIT", 0.02))
+batcher = None
+if LLM_LOCAL_BATCHING:
+    batcher = LLMBatcher(TransformersBackend(device=os.environ.get("LLM_DEVICE")),
+        max_batch_size=LLM_BATCH_SIZE, max_wait=LLM_BATCH_WAIT, timeout=LLM_TIMEOUT)
 
-# Instantiate the Database. This will also initialize constraints.
-db = Database(uri=DB_URI, user=DB_USER, password=DB_PASSWORD)
-
-# Register the ReactInterface Blueprint, passing the Database instance
-react_interface = create_react_interface(db)
+# Instantiate the LLM handler.
+llm = LLM(
+    api_key=LLM_API_KEY,
+    model=LLM_MODEL,
+    fallback_model=LLM_FALLBACK_MODEL,
+    timeout=LLM_TIMEOUT,
+    deadline=LLM_DEADLINE,
+    batcher=batcher,
+    cache=CompletionCache(maxsize=LLM_CACHE_SIZE, path=LLM_CACHE_PATH, allow_sampled=LLM_CACHE_SAMPLED)
+)
+
+# Turns of different stories run concurrently, at most LLM_MAX_CONCURRENCY at a time;
+# turns of the same story always run one after another.
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 4))
+scheduler = TurnScheduler(max_concurrency=LLM_MAX_CONCURRENCY)
+
+# Register the ReactInterface Blueprint, passing the Database, LLM and scheduler instances
+react_interface = create_react_interface(db, llm, scheduler)
 app.register_blueprint(react_interface)
 
-# Instantiate the LLM handler.
-llm = LLM(api_key=LLM_API_KEY, model=LLM_MODEL)
+# Telegram messages are processed by TELEGRAM_WORKERS workers, in order within each chat.
+# Beyond TELEGRAM_MAX_PENDING waiting messages (or TELEGRAM_MAX_PENDING_PER_CHAT for
+# one chat) new messages get a "busy" reply instead of queueing.
+TELEGRAM_WORKERS = int(os.environ.get("TELEGRAM_WORKERS", 8))
+TELEGRAM_MAX_PENDING = int(os.environ.get("TELEGRAM_MAX_PENDING", 100))
+TELEGRAM_MAX_PENDING_PER_CHAT = int(os.environ.get("TELEGRAM_MAX_PENDING_PER_CHAT", 5))
 
 # Instantiate the Telegram bot.
-# telegram_bot = TelegramBot(TELEGRAM_TOKEN, db, llm)
+# telegram_bot = TelegramBot(TELEGRAM_TOKEN, db, llm, scheduler, workers=TELEGRAM_WORKERS,
+#     max_pending=TELEGRAM_MAX_PENDING, max_pending_per_chat=TELEGRAM_MAX_PENDING_PER_CHAT)
 
     # @app.route('/')
     # def serve_react_app():
@@ -62,6 +131,7 @@ llm = LLM(api_key=LLM_API_KEY, model=LLM_MODEL)
 
 # Start the Telegram bot polling (runs in a background thread).
 # telegram_bot.start_polling()
+# On shutdown, telegram_bot.stop(timeout=30) stops polling and lets received messages finish.
 
 # Since we don't use HTTP endpoints for now, we don't need to define any Flask routes.
 # The Flask app is here mainly as a container for our application environment.
@@ -1,36 +1,116 @@
 # modules/command_handler.py
 
 import json
+import re
 import traceback
 import uuid
+from collections import namedtuple
+
+# Clauses that make a Cypher query a write.
+WRITE_CLAUSES = re.compile(r"\b(CREATE|MERGE|SET|DELETE|DETACH|REMOVE|FOREACH)\b", re.IGNORECASE)
+# First line of a message that makes the rest of it all-or-nothing.
+ATOMIC_COMMAND = "/atomic"
+# Rows returned by a list command unless a page size is given, and the most allowed.
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Separates the segments of a location path, e.g. "kingdom.castle.hall". Not "/",
+# which separates command arguments.
+PATH_SEPARATOR = "."
+# Location properties derived from the path, which commands may not set directly.
+HIERARCHY_PROPERTIES = ("path", "parent_path", "depth")
 
 def generate_uuid():
 	return str(uuid.uuid4())
 
+def is_write_query(query):
+	return bool(WRITE_CLAUSES.search(query))
+
+class BatchFailure(Exception):
+	"""Raised inside a batch transaction to abort it at a failing command."""
+
+	def __init__(self, index, error):
+		super().__init__(str(error))
+		self.index = index
+		self.error = error
+
 class CommandHandler:
 
-	def handle_commands(self, command_list):
+	def __init__(self, db=None):
+		"""
+		Args:
+			db (Database, optional): The shared Database. Falls back to the application's instance.
+		"""
+		if db is None:
+			from app import db
+		self.db = db
+
+	def handle_commands(self, command_list, atomic=False, context=None):
 		"""
 		Processes a list of command strings, aggregates their queries,
 		executes them in batch via the database module, and returns aggregated results.
+		
+		Every command is parsed first; the queries of all commands that parsed
+		are then run in one transaction (a read transaction if none of them
+		writes) instead of one round trip per query. Results are still
+		reported per command.
+		
+		If the first command is /atomic, or atomic is True, the batch is
+		all-or-nothing: any failing command rolls back every command. Otherwise
+		a failing command is reported and skipped, and the commands around it
+		are still committed.
+		
+		Commands implemented by Database methods (story prune, branch, revise,
+		load, and map of the current story) run on their own between
+		transactions and cannot be part of an atomic batch.
+		
+		context is a dict shared with the caller: "story_id" is the current
+		story, used when a story command names none, and /story/load sets it.
+		The current story is read as each command runs, so a command following
+		/story/load in the same message acts on the loaded story.
 		"""
+		if command_list and command_list[0].strip().lower() == ATOMIC_COMMAND:
+			atomic = True
+			command_list = command_list[1:]
+		context = context if context is not None else {}
 		aggregated_results = []
 		aggregated_errors = []
+		batch = []   # (command_str, query, params)
 		for command_str in command_list:
 			try:
-				queries = self.parse_command_to_queries(command_str)
+				queries = self.parse_command_to_queries(command_str, context)
 				for query, params in queries:
 					# Special handling for static responses
 					if query == "STATIC_API_DOC":
 						aggregated_results.append(f"API Documentation:\n{params['doc']}")
 					else:
-						result, err = run_query(query, params)
-						if err:
-							aggregated_errors.append(f"Error for '{command_str}': {err}")
-						else:
-							aggregated_results.append(f"Success for '{command_str}': {result}")
+						batch.append((command_str, query, params))
+			except CommandError as e:
+				aggregated_errors.append(f"Invalid command '{command_str}': {str(e)}")
 			except Exception as e:
 				aggregated_errors.append(f"Exception processing '{command_str}': {traceback.format_exc()}")
+		if batch:
+			if atomic and aggregated_errors:
+				aggregated_errors.append("Batch not run: every command must parse in atomic mode.")
+			elif atomic and any(callable(query) for _, query, _ in batch):
+				aggregated_errors.append("Batch not run: story prune, branch, revise, load and map of the current story cannot run in atomic mode.")
+			else:
+				# Runs of queries share a transaction; Database operations run between them.
+				queries = []
+				for operation in batch + [None]:
+					if operation is not None and not callable(operation[1]):
+						queries.append(operation)
+						continue
+					if queries:
+						results, errors = self.execute_batch(queries, atomic)
+						aggregated_results.extend(results)
+						aggregated_errors.extend(errors)
+						queries = []
+					if operation is not None:
+						command_str, run, params = operation
+						try:
+							aggregated_results.append(f"Success for '{command_str}': {run(self.db, **params)}")
+						except Exception as e:
+							aggregated_errors.append(f"Error for '{command_str}': {str(e)}")
 		response_lines = []
 		if aggregated_results:
 			response_lines.append("Results:")
@@ -40,182 +120,640 @@ class CommandHandler:
 			response_lines.extend(aggregated_errors)
 		return "\n".join(response_lines)
 
-	def parse_command_to_queries(self, command_str):
+	def execute_batch(self, batch, atomic=False):
+		"""
+		Runs parsed commands in as few transactions as possible.
+		
+		After a write batch commits anything, Database.world_changed is called
+		so caches built from the world are dropped.
+		
+		Args:
+			batch (list): (command_str, query, params) tuples, in order.
+			atomic (bool, optional): Roll back the whole batch if any command fails. Defaults to False.
+		
+		Returns:
+			tuple: (result lines, error lines).
+		"""
+		write = any(is_write_query(query) for _, query, _ in batch)
+		run = self.db.data_layer.write if write else self.db.data_layer.read
+		results, errors = [], []
+		try:
+			start = 0
+			while start < len(batch):
+				try:
+					records = run(self._run_batch_tx, batch[start:])
+				except BatchFailure as failure:
+					failed = start + failure.index
+					command_str = batch[failed][0]
+					if atomic:
+						errors.append(f"Error for '{command_str}': {failure.error}")
+						errors.append(f"Rolled back all {len(batch)} queries; nothing was committed.")
+						return [], errors
+					# A failed query aborts its transaction, so commit the commands before it on their own.
+					if failed > start:
+						try:
+							records = run(self._run_batch_tx, batch[start:failed])
+						except Exception as e:
+							error = e.error if isinstance(e, BatchFailure) else e
+							errors.extend(f"Error for '{prefix_str}': {error}" for prefix_str, _, _ in batch[start:failed])
+						else:
+							results.extend(self._format_results(batch[start:failed], records))
+					errors.append(f"Error for '{command_str}': {failure.error}")
+					start = failed + 1
+					continue
+				except Exception as e:
+					errors.append(f"Error running batch: {str(e)}")
+					return results, errors
+				results.extend(self._format_results(batch[start:], records))
+				break
+		finally:
+			if write and results:
+				# Entities may have been created, changed or deleted.
+				self.db.world_changed()
+		return results, errors
+
+	@staticmethod
+	def _run_batch_tx(tx, batch):
+		"""Transaction function running each query of a batch in order."""
+		records = []
+		for index, (_, query, params) in enumerate(batch):
+			try:
+				records.append(tx.run(query, params).data())
+			except Exception as e:
+				retryable = getattr(e, "is_retryable", None)
+				if callable(retryable) and retryable():
+					# Let the driver retry the whole batch on transient errors.
+					raise
+				raise BatchFailure(index, e)
+		return records
+
+	@staticmethod
+	def _format_results(batch, records):
+		return [f"Success for '{command_str}': {result}" for (command_str, _, _), result in zip(batch, records)]
+
+	def parse_command_to_queries(self, command_str, context=None):
 		"""
 		Parses a command string into one or more (query, parameters) tuples.
+		
+		The entity and action select a CommandSpec from COMMANDS in one lookup.
+		Its arguments are validated against the spec before anything runs, and
+		its builder returns operations using the precompiled queries, so the
+		query text of a command never varies and only its parameters do. An
+		operation's query is either a Cypher string or a callable run as
+		query(db, **params) for commands implemented by Database methods.
+		
+		Raises:
+			CommandError: If the command is unknown or its arguments are invalid.
 		"""
-		parts = [p for p in command_str.split('/') if p]
+		parts = [p for p in command_str.strip().split('/') if p]
 		if not parts:
-			raise ValueError("No command detected.")
+			raise CommandError("No command detected.")
 		entity = parts[0].lower()
 		action = parts[1].lower() if len(parts) > 1 else None
-		arguments = parts[2:]
-		if entity == "character":
-			return self._parse_character_command(action, arguments)
-		elif entity == "scenario":
-			return self._parse_scenario_command(action, arguments)
-		elif entity == "trait":
-			return self._parse_trait_command(action, arguments)
-		elif entity == "location":
-			return self._parse_location_command(action, arguments)
-		elif entity == "story":
-			return self._parse_story_command(action, arguments)
-		elif entity == "api":
-			return self._parse_api_command(action, arguments)
-		else:
-			raise ValueError("Unsupported entity: " + entity)
-
-	def _parse_character_command(self, action, args):
-		if action == "list":
-			if args and args[0].lower() != "none":
-				query = "MATCH (c:BaseCharacter {id: $id}) RETURN c"
-				params = {"id": args[0]}
-				return [(query, params)]
-			else:
-				query = "MATCH (c:BaseCharacter) RETURN c.name, c.id"
-				return [(query, {})]
-		elif action == "create":
-			if not args:
-				raise ValueError("Missing JSON object for character creation.")
-			data = json.loads("/".join(args))
-			new_id = generate_uuid()
-			query = """
-			CREATE (c:BaseCharacter {id: $id})
-			SET c += $data, c.created_at = timestamp()
-			RETURN c
-			"""
-			params = {"id": new_id, "data": data}
-			return [(query, params)]
-		else:
-			raise ValueError(f"Unknown character action '{action}'")
-
-	def _parse_scenario_command(self, action, args):
-		if action == "list":
-			if args and args[0].lower() != "none":
-				query = "MATCH (s:Scenario {id: $id}) RETURN s"
-				params = {"id": args[0]}
-				return [(query, params)]
-			else:
-				query = "MATCH (s:Scenario) RETURN s.title, s.id"
-				return [(query, {})]
-		elif action == "create":
-			if not args:
-				raise ValueError("Missing JSON object for scenario creation.")
-			data = json.loads("/".join(args))
-			new_id = generate_uuid()
-			query = """
-			CREATE (s:Scenario {id: $id})
-			SET s += $data, s.created_at = timestamp()
-			RETURN s
-			"""
-			params = {"id": new_id, "data": data}
-			return [(query, params)]
-		else:
-			raise ValueError(f"Unknown scenario action '{action}'")
-
-	def _parse_trait_command(self, action, args):
-		if action == "list":
-			query = "MATCH (t:BaseTrait) RETURN t.name, t.id"
-			return [(query, {})]
-		elif action == "create":
-			if not args:
-				raise ValueError("Missing JSON object for trait creation.")
-			data = json.loads("/".join(args))
-			new_id = generate_uuid()
-			query = """
-			CREATE (t:BaseTrait {id: $id})
-			SET t += $data, t.created_at = timestamp()
-			RETURN t
-			"""
-			params = {"id": new_id, "data": data}
-			return [(query, params)]
-		else:
-			raise ValueError(f"Unknown trait action '{action}'")
-
-	def _parse_location_command(self, action, args):
-		if action == "list":
-			if args and args[0] != "None":
-				query = "MATCH (l:BaseLocation {path: $path}) RETURN l.name, l.id"
-				params = {"path": args[0]}
-				return [(query, params)]
-			else:
-				query = "MATCH (l:BaseLocation) RETURN l.name, l.id"
-				return [(query, {})]
-		elif action == "create":
-			if len(args) < 2:
-				raise ValueError("Expecting a path and JSON object for location creation.")
-			path = args[0]
-			data = json.loads("/".join(args[1:]))
-			new_id = generate_uuid()
-			query = """
-			CREATE (l:BaseLocation {id: $id})
-			SET l += $data, l.created_at = timestamp(), l.path = $path
-			RETURN l
-			"""
-			params = {"id": new_id, "data": data, "path": path}
-			return [(query, params)]
-		else:
-			raise ValueError(f"Unknown location action '{action}'")
-
-	def _parse_story_command(self, action, args):
-		# This implementation covers a few basic story commands.
-		if action == "list":
-			if args and args[0].lower() != "none":
-				query = "MATCH (s:Story {id: $id}) RETURN s"
-				params = {"id": args[0]}
-				return [(query, params)]
-			else:
-				query = "MATCH (s:Story) RETURN s.title, s.id"
-				return [(query, {})]
-		elif action == "map":
-			if args and args[0].lower() != "none":
-				query = "MATCH (s:Story {id: $id}) RETURN s"
-				params = {"id": args[0]}
-				return [(query, params)]
-			else:
-				# Assume current_story_id is available as a global (or via a higher layer)
-				from app import current_story_id
-				query = "MATCH (s:Story {id: $id}) RETURN s"
-				params = {"id": current_story_id}
-				return [(query, params)]
-		# For branch, prune, revise, load, we leave a NotImplemented error for now.
+		spec = COMMANDS.get((entity, action))
+		if spec is None:
+			if entity not in ENTITIES:
+				raise CommandError("Unsupported entity: " + entity)
+			raise CommandError(f"Unknown {entity} action '{action}'")
+		args = parse_arguments(spec, parts[2:])
+		return spec.build(args, context if context is not None else {})
+
+
+class CommandError(ValueError):
+	"""Raised for unknown commands and invalid command arguments."""
+
+
+# ---------------------------------------------------------------------------
+# Argument parsing
+# ---------------------------------------------------------------------------
+
+def _is_none(value):
+	return value is None or value.lower() == "none"
+
+def _parse_required(value, name):
+	if _is_none(value):
+		raise CommandError(f"Missing {name}.")
+	return value
+
+def _parse_optional(value, name):
+	return None if _is_none(value) else value
+
+def _parse_bool(value, name):
+	if value is None or value.lower() not in ("true", "false", "yes", "no", "1", "0"):
+		raise CommandError(f"{name} must be true or false.")
+	return value.lower() in ("true", "yes", "1")
+
+def _parse_int(value, name):
+	try:
+		number = int(value)
+	except (TypeError, ValueError):
+		raise CommandError(f"{name} must be a whole number.")
+	if number < 1:
+		raise CommandError(f"{name} must be at least 1.")
+	return number
+
+def _parse_page_size(value, name):
+	if _is_none(value):
+		return DEFAULT_PAGE_SIZE
+	return min(_parse_int(value, name), MAX_PAGE_SIZE)
+
+def split_location_path(path):
+	"""Splits a location path into its segments, e.g. "kingdom.castle" into ["kingdom", "castle"]."""
+	segments = [segment.strip() for segment in path.split(PATH_SEPARATOR)]
+	if not all(segments):
+		raise CommandError(f"Invalid location path: {path!r}. Separate its parts with \"{PATH_SEPARATOR}\".")
+	return segments
+
+def location_hierarchy(path):
+	"""
+	Derives the hierarchy of a location path.
+	
+	Returns:
+		list: A dict per level from the root down to the path itself, holding its
+			"path", "parent_path" ("" for a root), "depth" (1 for a root) and
+			"name" (its last segment).
+	"""
+	segments = split_location_path(path)
+	levels = []
+	for depth in range(1, len(segments) + 1):
+		levels.append({
+			"path": PATH_SEPARATOR.join(segments[:depth]),
+			"parent_path": PATH_SEPARATOR.join(segments[:depth - 1]),
+			"depth": depth,
+			"name": segments[depth - 1],
+		})
+	return levels
+
+def _parse_path(value, name):
+	return PATH_SEPARATOR.join(split_location_path(_parse_required(value, name)))
+
+def _parse_optional_path(value, name):
+	return None if _is_none(value) else _parse_path(value, name)
+
+def _parse_json(value, name):
+	if value is None:
+		raise CommandError(f"Missing JSON object for {name}.")
+	try:
+		data = json.loads(value)
+	except ValueError as e:
+		raise CommandError(f"Invalid JSON for {name}: {e}")
+	if not isinstance(data, dict):
+		raise CommandError(f"{name} must be a JSON object.")
+	return data
+
+def _parse_text(value, name):
+	if not value:
+		raise CommandError(f"Missing {name}.")
+	return value
+
+# Argument kind -> (parser, consumes the rest of the command).
+ARG_KINDS = {
+	"required": (_parse_required, False),
+	"optional": (_parse_optional, False),
+	"bool": (_parse_bool, False),
+	"int": (_parse_int, False),
+	"page_size": (_parse_page_size, False),
+	"path": (_parse_path, False),
+	"optional_path": (_parse_optional_path, False),
+	"json": (_parse_json, True),
+	"text": (_parse_text, True),
+}
+
+def parse_arguments(spec, parts):
+	"""Validates the arguments of a command against its spec and returns them by name."""
+	args = {}
+	for position, (name, kind) in enumerate(spec.args):
+		parser, rest = ARG_KINDS[kind]
+		if rest:
+			value = "/".join(parts[position:]) or None
 		else:
-			raise ValueError(f"Unsupported story action: {action}")
-
-	def _parse_api_command(self, action, args):
-		api_doc = (
-			"/api - Show this documentation.\n"
-			"/character/list/<id or None>\n"
-			"/character/create/<JSON object>\n"
-			"/character/extend/<id>/<JSON object>\n"
-			"/character/clone/<id>/<JSON object>\n"
-			"/character/delete/<id>\n"
-			"/character/update/<id>/<boolean>/<JSON object>\n"
-			"/scenario/list/<id or None>\n"
-			"/scenario/create/<JSON object>\n"
-			"/scenario/extend/<JSON object>\n"
-			"/scenario/clone/<id>/<JSON object>\n"
-			"/scenario/delete/<id>\n"
-			"/scenario/update/<id>/<boolean>/<JSON object>\n"
-			"/scenario/link/entity/<id or location path>\n"
-			"/trait/list/<id or None>\n"
-			"/trait/create/<JSON object>\n"
-			"/trait/extend/<id>/<JSON object>\n"
-			"/trait/update/<id>/<boolean>/<JSON object>\n"
-			"/trait/delete/<id>\n"
-			"/location/list/<path or None>\n"
-			"/location/create/<path or None>/<JSON object>\n"
-			"/location/delete/<path>\n"
-			"/location/update/<path>/<boolean>/<JSON object>\n"
-			"/location/extend/<path>/<JSON object>\n"
-			"/location/clone/<path>/<JSON object>\n"
-			"/location/link/<target id/path>/<destination id/path>\n"
-			"/story/list/<id or None>\n"
-			"/story/map/<id or None>\n"
-			"/story/prune/<message integer>/<branch id or None>\n"
-			"/story/branch/<message integer>/<branch id or None>/<title>\n"
-			"/story/revise/<message integer>/<new persistent prompt string>\n"
-			"/story/load/<storyID>\n"
-		)
-		# Return a special static tuple.
-		return [("STATIC_API_DOC", {"doc": api_doc})]
\ No newline at end of file
+			value = parts[position] if position < len(parts) else None
+		args[name] = parser(value, name)
+	if spec.args and not ARG_KINDS[spec.args[-1][1]][1] and len(parts) > len(spec.args):
+		raise CommandError(f"Too many arguments. Usage: {spec.usage}")
+	if not spec.args and parts:
+		raise CommandError(f"Too many arguments. Usage: {spec.usage}")
+	return args
+
+
+# ---------------------------------------------------------------------------
+# Command registry
+# ---------------------------------------------------------------------------
+
+CommandSpec = namedtuple("CommandSpec", ["entity", "action", "args", "build", "usage"])
+
+# (entity, action) -> CommandSpec, in registration order (which is also the /api order).
+COMMANDS = {}
+
+def command(entity, action, usage, *args):
+	"""
+	Registers a command builder.
+	
+	Args:
+		entity, action (str): The first two parts of the command.
+		usage (str): The line shown by /api.
+		*args: (name, kind) pairs, kind being a key of ARG_KINDS. "json" and
+			"text" arguments take the rest of the command, slashes included.
+	"""
+	def register(build):
+		COMMANDS[(entity, action)] = CommandSpec(entity, action, tuple(args), build, usage)
+		return build
+	return register
+
+# Entity -> (label, key property, display property).
+ENTITIES = {
+	"character": ("BaseCharacter", "id", "name"),
+	"scenario": ("Scenario", "id", "title"),
+	"trait": ("BaseTrait", "id", "name"),
+	"location": ("BaseLocation", "path", "name"),
+	"story": ("Story", "id", "title"),
+	"api": (None, None, None),
+}
+
+def _entity_queries(label, key, display):
+	"""Builds the parameterized queries shared by the world entities."""
+	return {
+		"get": f"MATCH (n:{label} {{{key}: $key}}) RETURN n",
+		# Keyset pagination over the id uniqueness constraint: $after is the last id of the previous page.
+		"list": f"""
+			MATCH (n:{label}) WHERE n.id > $after
+			RETURN n.{display} AS {display}, n.id AS id
+			ORDER BY n.id LIMIT $limit
+		""",
+		"create": f"""
+			CREATE (n:{label} {{id: $id}})
+			SET n += $data, n.created_at = timestamp(), n.path = $path
+			RETURN n
+		""",
+		# Adds new properties without overwriting existing ones.
+		"extend": f"""
+			MATCH (n:{label} {{{key}: $key}})
+			WITH n, properties(n) AS existing
+			SET n += $data
+			SET n += existing
+			RETURN n
+		""",
+		"update_merge": f"""
+			MATCH (n:{label} {{{key}: $key}})
+			WITH n, n.id AS id
+			SET n += $data
+			SET n.id = id, n.updated_at = timestamp()
+			RETURN n
+		""",
+		# Replaces all properties, keeping identity, place in the location hierarchy and creation time.
+		"update_replace": f"""
+			MATCH (n:{label} {{{key}: $key}})
+			WITH n, n.id AS id, n.path AS path, n.parent_path AS parent_path, n.depth AS depth, n.created_at AS created_at
+			SET n = $data
+			SET n.id = id, n.path = coalesce(n.path, path), n.parent_path = parent_path, n.depth = depth,
+				n.created_at = created_at, n.updated_at = timestamp()
+			RETURN n
+		""",
+		"clone": f"""
+			MATCH (n:{label} {{{key}: $key}})
+			CREATE (c:{label})
+			SET c = properties(n)
+			SET c += $data, c.id = $id, c.created_at = timestamp(), c.cloned_from = n.id
+			WITH n, c
+			OPTIONAL MATCH (n)-[:HAS_TRAIT]->(t)
+			FOREACH (ignored IN CASE WHEN t IS NULL THEN [] ELSE [1] END | MERGE (c)-[:HAS_TRAIT]->(t))
+			RETURN DISTINCT c
+		""",
+		"delete": f"""
+			MATCH (n:{label} {{{key}: $key}})
+			DETACH DELETE n
+			RETURN count(n) AS deleted
+		""",
+	}
+
+QUERIES = {entity: _entity_queries(*ENTITIES[entity]) for entity in ("character", "scenario", "trait", "location")}
+
+# Matches a world entity by ID, or a location by path.
+# Each branch is a single-label lookup so it can use that label's index.
+_MATCH_REF = """
+	CALL {
+		MATCH (n:BaseCharacter {id: $ref}) RETURN n
+		UNION MATCH (n:BaseTrait {id: $ref}) RETURN n
+		UNION MATCH (n:BaseLocation {id: $ref}) RETURN n
+		UNION MATCH (n:BaseLocation {path: $ref}) RETURN n
+	}
+"""
+
+SCENARIO_LINK_QUERY = """
+	MATCH (s:Scenario {id: $key})
+""" + _MATCH_REF + """
+	MERGE (s)-[:INCLUDES]->(n)
+	RETURN s.id AS scenario, n.id AS linked
+"""
+
+LOCATION_LINK_QUERY = """
+	CALL {
+		MATCH (a:BaseLocation {id: $source}) RETURN a
+		UNION MATCH (a:BaseLocation {path: $source}) RETURN a
+	}
+	CALL {
+		MATCH (b:BaseLocation {id: $target}) RETURN b
+		UNION MATCH (b:BaseLocation {path: $target}) RETURN b
+	}
+	MERGE (a)-[:CONNECTS_TO]->(b)
+	RETURN a.id AS source, b.id AS target
+"""
+
+STORY_LIST_QUERY = """
+	MATCH (s:Story) WHERE s.id > $after
+	RETURN s.title AS title, s.id AS id
+	ORDER BY s.id LIMIT $limit
+"""
+STORY_GET_QUERY = "MATCH (s:Story {id: $key}) RETURN s"
+
+# Locations whose path starts with a prefix, served by the path index; $after is the last path of the previous page.
+LOCATION_PREFIX_QUERY = """
+	MATCH (n:BaseLocation) WHERE n.path STARTS WITH $prefix AND n.path > $after
+	RETURN n.name AS name, n.id AS id, n.path AS path, n.depth AS depth
+	ORDER BY n.path LIMIT $limit
+"""
+
+# Links the location bound to n into the hierarchy of its path: every missing
+# ancestor is created as a placeholder and each level is linked to its parent
+# with WITHIN. $ancestors lists the levels above n from the root down.
+_LOCATION_HIERARCHY = """
+	WITH n
+	CALL {
+		UNWIND $ancestors AS ancestor
+		MERGE (a:BaseLocation {path: ancestor.path})
+		ON CREATE SET a.id = ancestor.id, a.name = ancestor.name, a.parent_path = ancestor.parent_path,
+			a.depth = ancestor.depth, a.placeholder = true, a.created_at = timestamp()
+	}
+	CALL {
+		UNWIND $ancestors AS ancestor
+		MATCH (a:BaseLocation {path: ancestor.path}), (p:BaseLocation {path: ancestor.parent_path})
+		MERGE (a)-[:WITHIN]->(p)
+	}
+	CALL {
+		WITH n
+		MATCH (p:BaseLocation {path: n.parent_path})
+		MERGE (n)-[:WITHIN]->(p)
+	}
+	RETURN n
+"""
+
+# Creates the location for $path, with ID $id, unless a placeholder ancestor is
+# already at the path; the query then binds n by the placeholder's ID or $id.
+# Any other location at the path makes the CREATE fail on the path uniqueness
+# constraint, and since n is bound by ID an existing location is never
+# overwritten, even where the constraint is missing.
+_LOCATION_AT_PATH = """
+	OPTIONAL MATCH (placeholder:BaseLocation {path: $path, placeholder: true})
+	FOREACH (ignored IN CASE WHEN placeholder IS NULL THEN [1] ELSE [] END |
+		CREATE (:BaseLocation {path: $path, id: $id, created_at: timestamp()}))
+"""
+
+LOCATION_CREATE_QUERY = _LOCATION_AT_PATH + """
+	WITH DISTINCT coalesce(placeholder.id, $id) AS id
+	MATCH (n:BaseLocation {id: id})
+	SET n += $data
+	SET n.path = $path, n.parent_path = $parent_path, n.depth = $depth
+	REMOVE n.placeholder
+""" + _LOCATION_HIERARCHY
+
+LOCATION_CLONE_QUERY = """
+	MATCH (source:BaseLocation {path: $key})
+""" + _LOCATION_AT_PATH + """
+	WITH DISTINCT source, coalesce(placeholder.id, $id) AS id
+	MATCH (n:BaseLocation {id: id})
+	WITH source, n, n.id AS id, n.created_at AS created_at
+	SET n += properties(source)
+	SET n += $data
+	SET n.id = id, n.created_at = created_at, n.cloned_from = source.id,
+		n.path = $path, n.parent_path = $parent_path, n.depth = $depth
+	REMOVE n.placeholder
+	WITH source, n
+	OPTIONAL MATCH (source)-[:HAS_TRAIT]->(t)
+	FOREACH (ignored IN CASE WHEN t IS NULL THEN [] ELSE [1] END | MERGE (n)-[:HAS_TRAIT]->(t))
+	WITH DISTINCT n
+""" + _LOCATION_HIERARCHY
+
+# Deletes a location together with every location below it, so no location is left with a dangling parent_path.
+LOCATION_DELETE_QUERY = """
+	MATCH (n:BaseLocation {path: $key})
+	OPTIONAL MATCH (d:BaseLocation) WHERE d.path STARTS WITH $prefix
+	WITH [n] + collect(d) AS locations
+	UNWIND locations AS l
+	DETACH DELETE l
+	RETURN count(l) AS deleted
+"""
+
+# A location and the regions containing it, nearest first: what a turn needs to describe where it is.
+LOCATION_ANCESTORS_QUERY = """
+	MATCH (n:BaseLocation {path: $path})
+	MATCH chain = (n)-[:WITHIN*0..]->(a:BaseLocation)
+	RETURN a AS location, length(chain) AS distance
+	ORDER BY distance
+"""
+
+# Other locations with the same parent, served by the parent_path index.
+LOCATION_SIBLINGS_QUERY = """
+	MATCH (n:BaseLocation) WHERE n.parent_path = $parent_path AND n.path <> $path AND n.path > $after
+	RETURN n.name AS name, n.id AS id, n.path AS path
+	ORDER BY n.path LIMIT $limit
+"""
+
+def _located(params, path):
+	"""Adds the hierarchy parameters of a location path to a query's parameters."""
+	*ancestors, level = location_hierarchy(path)
+	for ancestor in ancestors:
+		ancestor["id"] = generate_uuid()
+	return {**params, "path": level["path"], "parent_path": level["parent_path"], "depth": level["depth"], "ancestors": ancestors}
+
+def _check_location_data(data):
+	hierarchy = [key for key in HIERARCHY_PROPERTIES if key in data]
+	if hierarchy:
+		raise CommandError(f"{', '.join(hierarchy)} cannot be set directly; clone the location to a new path instead.")
+
+
+def _register_entity_commands(entity, key_name):
+	"""Registers the list/create/extend/update/clone/delete commands of a world entity."""
+	queries = QUERIES[entity]
+	keyed = entity == "location"
+	key_kind = "path" if keyed else "required"
+
+	if keyed:
+		@command(entity, "list", f"/{entity}/list/<path prefix or None>/<after path or id, or None>/<page size or None>",
+				("prefix", "optional"), ("after", "optional"), ("limit", "page_size"))
+		def list_entities(args, context):
+			page = {"after": args["after"] or "", "limit": args["limit"]}
+			if args["prefix"] is None:
+				return [(queries["list"], page)]
+			return [(LOCATION_PREFIX_QUERY, {"prefix": args["prefix"], **page})]
+	else:
+		@command(entity, "list", f"/{entity}/list/<{key_name} or None>/<after id or None>/<page size or None>",
+				(key_name, "optional"), ("after", "optional"), ("limit", "page_size"))
+		def list_entities(args, context):
+			if args[key_name] is None:
+				return [(queries["list"], {"after": args["after"] or "", "limit": args["limit"]})]
+			return [(queries["get"], {"key": args[key_name]})]
+
+	if keyed:
+		@command(entity, "create", f"/{entity}/create/<path or None>/<JSON object>", ("path", "optional_path"), ("data", "json"))
+		def create_entity(args, context):
+			_check_location_data(args["data"])
+			params = {"id": generate_uuid(), "data": args["data"]}
+			if args["path"] is None:
+				return [(queries["create"], {**params, "path": None})]
+			return [(LOCATION_CREATE_QUERY, _located(params, args["path"]))]
+	else:
+		@command(entity, "create", f"/{entity}/create/<JSON object>", ("data", "json"))
+		def create_entity(args, context):
+			return [(queries["create"], {"id": generate_uuid(), "data": args["data"], "path": None})]
+
+	@command(entity, "extend", f"/{entity}/extend/<{key_name}>/<JSON object>", (key_name, key_kind), ("data", "json"))
+	def extend_entity(args, context):
+		if keyed:
+			_check_location_data(args["data"])
+		return [(queries["extend"], {"key": args[key_name], "data": args["data"]})]
+
+	@command(entity, "update", f"/{entity}/update/<{key_name}>/<replace: true or false>/<JSON object>",
+			(key_name, key_kind), ("replace", "bool"), ("data", "json"))
+	def update_entity(args, context):
+		if keyed:
+			_check_location_data(args["data"])
+		query = queries["update_replace"] if args["replace"] else queries["update_merge"]
+		return [(query, {"key": args[key_name], "data": args["data"]})]
+
+	@command(entity, "clone", f"/{entity}/clone/<{key_name}>/<JSON object>", (key_name, key_kind), ("data", "json"))
+	def clone_entity(args, context):
+		if keyed:
+			path = args["data"].pop("path", None)
+			path = None if path is None else _parse_path(str(path), "path")
+			if path in (None, args[key_name]):
+				raise CommandError("A cloned location needs a new \"path\" in its JSON object.")
+			_check_location_data(args["data"])
+			params = {"key": args[key_name], "data": args["data"], "id": generate_uuid()}
+			return [(LOCATION_CLONE_QUERY, _located(params, path))]
+		return [(queries["clone"], {"key": args[key_name], "data": args["data"], "id": generate_uuid()})]
+
+	if keyed:
+		@command(entity, "delete", f"/{entity}/delete/<{key_name}> - Also deletes every location below it.", (key_name, key_kind))
+		def delete_entity(args, context):
+			return [(LOCATION_DELETE_QUERY, {"key": args[key_name], "prefix": args[key_name] + PATH_SEPARATOR})]
+	else:
+		@command(entity, "delete", f"/{entity}/delete/<{key_name}>", (key_name, key_kind))
+		def delete_entity(args, context):
+			return [(queries["delete"], {"key": args[key_name]})]
+
+@command("api", None, "/api - Show this documentation.")
+def api_documentation(args, context):
+	lines = [spec.usage for spec in COMMANDS.values()]
+	lines.insert(1, "/atomic - As the first line: run the commands below all-or-nothing.")
+	# Return a special static tuple.
+	return [("STATIC_API_DOC", {"doc": "\n".join(lines) + "\n"})]
+
+_register_entity_commands("character", "id")
+_register_entity_commands("scenario", "id")
+
+@command("scenario", "link", "/scenario/link/<scenario id>/<entity id or location path>", ("scenario", "required"), ("entity", "required"))
+def link_scenario(args, context):
+	return [(SCENARIO_LINK_QUERY, {"key": args["scenario"], "ref": args["entity"]})]
+
+_register_entity_commands("trait", "id")
+_register_entity_commands("location", "path")
+
+@command("location", "link", "/location/link/<source id or path>/<target id or path>", ("source", "required"), ("target", "required"))
+def link_locations(args, context):
+	return [(LOCATION_LINK_QUERY, {"source": args["source"], "target": args["target"]})]
+
+@command("location", "subtree", "/location/subtree/<path>/<after path or None>/<page size or None>",
+		("path", "path"), ("after", "optional"), ("limit", "page_size"))
+def location_subtree(args, context):
+	params = {"prefix": args["path"] + PATH_SEPARATOR, "after": args["after"] or "", "limit": args["limit"]}
+	return [(LOCATION_PREFIX_QUERY, params)]
+
+@command("location", "ancestors", "/location/ancestors/<path>", ("path", "path"))
+def location_ancestors(args, context):
+	return [(LOCATION_ANCESTORS_QUERY, {"path": args["path"]})]
+
+@command("location", "siblings", "/location/siblings/<path>/<after path or None>/<page size or None>",
+		("path", "path"), ("after", "optional"), ("limit", "page_size"))
+def location_siblings(args, context):
+	parent_path = location_hierarchy(args["path"])[-1]["parent_path"]
+	params = {"path": args["path"], "parent_path": parent_path, "after": args["after"] or "", "limit": args["limit"]}
+	return [(LOCATION_SIBLINGS_QUERY, params)]
+
+
+def _story_id(story_id, context):
+	"""
+	The story named by a command, or the chat's current story.
+	
+	Called when the operation runs rather than when its message is parsed, so
+	a /story/load earlier in the same message is taken into account.
+	"""
+	story_id = story_id or context.get("story_id")
+	if story_id is None:
+		raise ValueError("No story given and no current story.")
+	return story_id
+
+def _entry_at(db, story_id, position):
+	entry = db.get_entry_at(story_id, position)
+	if entry is None:
+		raise ValueError(f"Story {story_id} has no message {position}.")
+	return entry
+
+def _prune(db, story_id, context, position):
+	story_id = _story_id(story_id, context)
+	entry = _entry_at(db, story_id, position)
+	result = db.prune_story(entry["entry_id"], story_id=story_id)
+	return {"message": result["message"], "entries": len(result["entries"]), "history": len(result["history"])}
+
+def _branch(db, story_id, context, position, title):
+	story_id = _story_id(story_id, context)
+	entry = _entry_at(db, story_id, position)
+	return {"branch_story_id": db.create_branch(entry["entry_id"], title)}
+
+def _revise(db, story_id, context, position, text):
+	return {"entry_id": db.revise_entry(_story_id(story_id, context), position, text)}
+
+def _map(db, story_id, context):
+	story_id = _story_id(story_id, context)
+	story = db.get_story(story_id)
+	if story is None:
+		raise ValueError(f"Story {story_id} not found.")
+	return story
+
+def _load(db, story_id, context):
+	state = db.retrieve_state(story_id, last_n=1)
+	if not state["page"]["entry_count"] and db.get_story(story_id) is None:
+		# An empty story is still loadable, but check it exists.
+		raise ValueError(f"Story {story_id} not found.")
+	context["story_id"] = story_id
+	latest = state["entries"][-1]["summary_text"] if state["entries"] else None
+	return {"story_id": story_id, "entries": state["page"]["entry_count"], "latest": latest}
+
+@command("story", "list", "/story/list/<id or None>/<after id or None>/<page size or None>",
+		("story", "optional"), ("after", "optional"), ("limit", "page_size"))
+def list_stories(args, context):
+	if args["story"] is None:
+		return [(STORY_LIST_QUERY, {"after": args["after"] or "", "limit": args["limit"]})]
+	return [(STORY_GET_QUERY, {"key": args["story"]})]
+
+@command("story", "map", "/story/map/<id or None>", ("story", "optional"))
+def map_story(args, context):
+	if args["story"] is not None:
+		return [(STORY_GET_QUERY, {"key": args["story"]})]
+	return [(_map, {"story_id": None, "context": context})]
+
+@command("story", "prune", "/story/prune/<message integer>/<story id or None>", ("message", "int"), ("story", "optional"))
+def prune_story(args, context):
+	return [(_prune, {"story_id": args["story"], "context": context, "position": args["message"]})]
+
+@command("story", "branch", "/story/branch/<message integer>/<story id or None>/<title>",
+		("message", "int"), ("story", "optional"), ("title", "text"))
+def branch_story(args, context):
+	return [(_branch, {"story_id": args["story"], "context": context, "position": args["message"], "title": args["title"]})]
+
+@command("story", "revise", "/story/revise/<message integer>/<new message text>", ("message", "int"), ("text", "text"))
+def revise_story(args, context):
+	return [(_revise, {"story_id": args["story"], "context": context, "position": args["message"], "text": args["text"]})]
+
+@command("story", "load", "/story/load/<storyID>", ("story", "required"))
+def load_story(args, context):
+	return [(_load, {"story_id": args["story"], "context": context})]
@@ -10,27 +10,30 @@ with db.driver.session() as session:
 # Ensure the schema is set up
 db.setup_schema()
 
-# Add a sample narrative entry
-with db.driver.session() as session:
-    session.run("""
-        CREATE (e:Entry {id: 'entry1', story_id: 'story1', text: 'The hero embarks on a journey.'})
-    """)
+# Add sample narrative entries
+entry1 = db.commit_entry("story1", "The hero embarks on a journey.", "The journey begins.", [])
+db.commit_entry("story1", "The hero takes the mountain road.", "The hero heads for the mountains.", [])
 
-# Create a branch
-new_branch_entry_id = db.create_branch(
-    entry_id="entry1",
+# Create a branch from the first entry and continue it
+branch_story_id = db.create_branch(
+    entry_id=entry1,
     branch_title="Alternate Path",
     branch_id="branch1"
 )
+db.commit_entry(branch_story_id, "The hero takes the river road.", "The hero heads for the river.", [])
 
 # Verify the results
 with db.driver.session() as session:
-    # Check the new Entry node and BRANCH relationship
+    # Check the new branch Story and BRANCH relationship
     branch_result = session.run("""
-        MATCH (e:Entry {id: 'entry1'})-[:BRANCH {id: 'branch1'}]->(new_entry:Entry)
-        RETURN e, new_entry
-    """).data()
+        MATCH (e:Entry {id: $entry_id})-[:BRANCH {id: 'branch1'}]->(branch:Story)
+        RETURN e, branch
+    """, entry_id=entry1).data()
     print("Branch Result:", branch_result)
 
+# The branch shares the first entry with its parent and stores only its own second entry
+print("Branch Entries:", db.retrieve_state(story_id=branch_story_id)["entries"])
+print("Parent Entries:", db.retrieve_state(story_id="story1")["entries"])
+
 # Close the database connection
 db.close()
\ No newline at end of file
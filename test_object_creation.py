@@ -27,6 +27,10 @@ location = BaseLocation(id="loc1", name="Castle", description="A grand medieval
 location.add_trait(trait)
 location.save_to_db(db)
 
+# Fetch each owner together with its linked traits
+print("Character:", db.get_entity_with_traits("Character", "char1"))
+print("Location:", db.get_entity_with_traits("Location", "loc1"))
+
 # Close the database connection
 db.close()
 
@@ -1,4 +1,5 @@
 from Modules.Database import Database
+from Modules.GameObjects import Trait
 
 # Initialize the database connection
 db = Database(uri="bolt://localhost:7687", user="neo4j", password="neo4j#9657")
@@ -10,23 +11,26 @@ with db.driver.session() as session:
 # Ensure the schema is set up
 db.setup_schema()
 
-# Add a sample narrative with multiple entries
+# Populate the database with a trait and its initial state
+trait = Trait(id="trait1", title="Bravery", description="The character is exceptionally brave.")
+trait.save_to_db(db)
 with db.driver.session() as session:
     session.run("""
-        CREATE (e1:Entry {id: 'entry1', story_id: 'story1', text: 'The hero embarks on a journey.'})
-        CREATE (e2:Entry {id: 'entry2', story_id: 'story1', text: 'The hero faces a challenge.'})
-        CREATE (e3:Entry {id: 'entry3', story_id: 'story1', text: 'The hero overcomes the challenge.'})
-        CREATE (s1:Summary {text: 'The journey begins.'})
-        CREATE (s2:Summary {text: 'A challenge arises.'})
-        CREATE (s3:Summary {text: 'The challenge is overcome.'})
-        CREATE (e1)-[:NEXT]->(e2)-[:NEXT]->(e3)
-        CREATE (e1)-[:NEXT]->(s1)
-        CREATE (e2)-[:NEXT]->(s2)
-        CREATE (e3)-[:NEXT]->(s3)
+        CREATE (h:History {id: 'history1', story_id: 'story1', state: 'Initial state'})
+        WITH h
+        MATCH (t:Trait {id: 'trait1'})
+        CREATE (h)-[:CURRENT]->(t)
     """)
 
+# Add a sample narrative with multiple entries, changing the trait after the first
+entry1 = db.commit_entry("story1", "The hero embarks on a journey.", "The journey begins.", [])
+db.commit_entry("story1", "The hero faces a challenge.", "A challenge arises.",
+                [{"type": "Trait", "id": "trait1", "new_state": "The hero hesitates."}])
+db.commit_entry("story1", "The hero overcomes the challenge.", "The challenge is overcome.",
+                [{"type": "Trait", "id": "trait1", "new_state": "The hero gains courage."}])
+
 # Prune the story back to entry1
-result = db.prune_story(entry_id="entry1")
+result = db.prune_story(entry_id=entry1)
 print(result)
 
 # Verify the results
@@ -35,5 +39,9 @@ with db.driver.session() as session:
     remaining_entries = session.run("MATCH (e:Entry) RETURN e").data()
     print("Remaining Entries:", remaining_entries)
 
+    # Check that the trait's initial state is current again
+    current_state = session.run("MATCH (h:History)-[:CURRENT]->(t:Trait {id: 'trait1'}) RETURN h.state").data()
+    print("Current State:", current_state)
+
 # Close the database connection
 db.close()
\ No newline at end of file
@@ -23,13 +23,9 @@ location = BaseLocation(id="loc1", name="Castle", description="A grand medieval
 location.add_trait(trait)
 location.save_to_db(db)
 
-# Add a sample narrative entry
-with db.driver.session() as session:
-    session.run("""
-        CREATE (e:Entry {id: 'entry1', story_id: 'story1', text: 'Once upon a time...'})
-        CREATE (s:Summary {text: 'A story begins.'})
-        CREATE (e)-[:NEXT]->(s)
-    """)
+# Add sample narrative entries
+db.commit_entry(story_id="story1", entry_text="Once upon a time...", summary_text="A story begins.", state_changes=[])
+db.commit_entry(story_id="story1", entry_text="The hero sets out.", summary_text="The hero leaves home.", state_changes=[])
 
 # Add History nodes and CURRENT relationships
 with db.driver.session() as session:
@@ -44,5 +40,9 @@ with db.driver.session() as session:
 state = db.retrieve_state(story_id="story1")
 print("Retrieved State:", state)
 
+# Retrieve only the most recent entry, both by window and by TAIL pointer
+print("Last Entry:", db.retrieve_state(story_id="story1", last_n=1)["entries"])
+print("Latest Entry:", db.get_latest_entry(story_id="story1"))
+
 # Close the database connection
 db.close()
\ No newline at end of file
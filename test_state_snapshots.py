@@ -0,0 +1,38 @@
+from Modules.Database import Database
+from Modules.GameObjects import Trait
+
+# Initialize the database connection, snapshotting every 3 entries
+db = Database(uri="bolt://localhost:7687", user="neo4j", password="neo4j#9657", snapshot_interval=3)
+
+# Cleanup: Delete all nodes of relevant types
+with db.driver.session() as session:
+    session.run("MATCH (n) DETACH DELETE n")
+
+# Ensure the schema is set up
+db.setup_schema()
+
+# Populate the database with sample data
+trait = Trait(id="trait1", title="Bravery", description="The character is exceptionally brave.")
+trait.save_to_db(db)
+
+# Commit a run of entries, each changing the trait
+for i in range(1, 8):
+    db.commit_entry(
+        story_id="story1",
+        entry_text=f"Turn {i}.",
+        summary_text=f"Summary {i}.",
+        state_changes=[{"type": "Trait", "id": "trait1", "new_state": f"Courage level {i}"}]
+    )
+
+# Verify the results
+with db.driver.session() as session:
+    # Snapshots should exist at ordinals 3 and 6
+    snapshots = session.run("MATCH (s:Snapshot {story_id: 'story1'}) RETURN s.ordinal AS ordinal ORDER BY ordinal").data()
+    print("Snapshots:", snapshots)
+
+# Reconstruct the state as of entry 5 (snapshot 3 plus two deltas) and the latest state
+print("State at 5:", db.get_state_at(story_id="story1", ordinal=5))
+print("Latest State:", db.get_state_at(story_id="story1"))
+
+# Close the database connection
+db.close()
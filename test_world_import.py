@@ -0,0 +1,41 @@
+import json
+import os
+import tempfile
+from Modules.Database import Database
+from Modules.GameObjects import read_world_file, save_world, write_world_file
+
+# Initialize the database connection
+db = Database(uri="bolt://localhost:7687", user="neo4j", password="neo4j#9657")
+
+# Cleanup: Delete all nodes of relevant types
+with db.driver.session() as session:
+    session.run("MATCH (n) DETACH DELETE n")
+
+# Ensure the schema is set up
+db.setup_schema()
+
+# Write a sample world file with a thousand characters sharing one trait
+world = {
+    "traits": [{"id": "trait1", "title": "Bravery", "description": "The character is exceptionally brave."}],
+    "characters": [
+        {"id": f"char{i}", "name": f"Villager {i}", "description": "A villager.", "traits": ["trait1"]}
+        for i in range(1000)
+    ],
+    "locations": [{"id": "loc1", "name": "Castle", "description": "A grand medieval castle.", "traits": ["trait1"]}]
+}
+world_dir = tempfile.mkdtemp()
+world_path = os.path.join(world_dir, "world.json")
+with open(world_path, "w") as f:
+    json.dump(world, f)
+
+# Import it in batches of 250 rows
+counts = save_world(db, read_world_file(world_path), batch_size=250)
+print("Imported:", counts)
+
+# Export it again as JSONL and read it back
+export_path = os.path.join(world_dir, "export.jsonl")
+print("Exported:", write_world_file(db, export_path, batch_size=250))
+print("Objects Read Back:", len(read_world_file(export_path)))
+
+# Close the database connection
+db.close()
@@ -0,0 +1,64 @@
+import time
+from Modules.Cache import VERSION_SLOTS, LRUCache
+
+def test_get_and_set():
+    """Test that stored values are returned and counted as hits."""
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+def test_lru_eviction():
+    """Test that the least recently used entry is evicted first."""
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expiry():
+    """Test that entries expire after their time-to-live."""
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_invalidate_tag():
+    """Test that invalidating a tag removes only the entries stored under it."""
+    cache = LRUCache()
+    cache.set(("story1", None), "full", tag="story1")
+    cache.set(("story1", 10), "page", tag="story1")
+    cache.set(("story2", None), "other", tag="story2")
+    cache.invalidate_tag("story1")
+    assert cache.get(("story1", None)) is None
+    assert cache.get(("story1", 10)) is None
+    assert cache.get(("story2", None)) == "other"
+    assert cache.stats()["invalidations"] == 2
+
+def test_stale_version_is_not_stored():
+    """Test that a value loaded before an invalidation is not cached."""
+    cache = LRUCache()
+    version = cache.version("story1")
+    cache.invalidate_tag("story1")
+    assert cache.set("key", "stale", tag="story1", version=version) is False
+    assert cache.get("key") is None
+
+def test_tags_leave_no_state_behind():
+    """Test that tag versions take fixed space and still reject stale loads."""
+    cache = LRUCache(maxsize=2)
+    for i in range(5000):
+        cache.set(i, i, tag=f"story{i}")
+        cache.invalidate_tag(f"story{i}")
+    assert len(cache._versions) == VERSION_SLOTS
+    assert cache._tags == {}
+    version = cache.version("story1")
+    cache.clear()
+    assert cache.set("key", "stale", tag="story1", version=version) is False
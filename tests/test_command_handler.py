@@ -0,0 +1,217 @@
+import json
+import os
+import uuid
+
+import pytest
+
+from modules.CommandHandler import CommandHandler
+
+class FakeResult:
+    def __init__(self, records):
+        self.records = records
+    def data(self):
+        return self.records
+
+class FakeTx:
+    def __init__(self, log):
+        self.log = log
+        self.pending = []
+    def run(self, query, params):
+        if params.get("data", {}).get("fail"):
+            raise RuntimeError("constraint violated")
+        self.pending.append(params.get("data", {}).get("name"))
+        return FakeResult([{"ok": True}])
+
+class FakeDataLayer:
+    """Runs transaction functions against a fake transaction, committing only on success."""
+    def __init__(self):
+        self.committed = []
+        self.transactions = []
+    def _run(self, kind, work, *args):
+        tx = FakeTx(self.committed)
+        result = work(tx, *args)
+        self.transactions.append(kind)
+        self.committed.extend(tx.pending)
+        return result
+    def write(self, work, *args):
+        return self._run("write", work, *args)
+    def read(self, work, *args):
+        return self._run("read", work, *args)
+
+class FakeDatabase:
+    def __init__(self):
+        self.data_layer = FakeDataLayer()
+        self.world_changes = 0
+    def world_changed(self):
+        self.world_changes += 1
+
+def create(name, fail=False):
+    data = {"name": name, "fail": True} if fail else {"name": name}
+    return "/character/create/" + json.dumps(data)
+
+def test_batch_runs_in_one_transaction():
+    """Test that all commands of a message share one transaction."""
+    db = FakeDatabase()
+    output = CommandHandler(db).handle_commands([create("a"), create("b"), create("c")])
+    assert db.data_layer.transactions == ["write"]
+    assert db.data_layer.committed == ["a", "b", "c"]
+    assert output.count("Success for") == 3
+    assert db.world_changes == 1
+
+def test_reads_use_read_transaction():
+    """Test that a batch with no writes runs in a read transaction."""
+    db = FakeDatabase()
+    CommandHandler(db).handle_commands(["/character/list/None", "/story/list/None"])
+    assert db.data_layer.transactions == ["read"]
+
+def test_non_atomic_skips_failing_command():
+    """Test that a failing command is reported while the others commit."""
+    db = FakeDatabase()
+    output = CommandHandler(db).handle_commands([create("a"), create("b", fail=True), create("c")])
+    assert db.data_layer.committed == ["a", "c"]
+    assert "constraint violated" in output
+    assert output.count("Success for") == 2
+
+def test_failed_prefix_rerun_reported_as_errors():
+    """Test that a failure re-running the commands before a failed one is reported, not raised."""
+    db = FakeDatabase()
+    write = db.data_layer.write
+    calls = []
+    def flaky_write(work, *args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise ConnectionError("connection lost")
+        return write(work, *args)
+    db.data_layer.write = flaky_write
+    output = CommandHandler(db).handle_commands([create("a"), create("b", fail=True), create("c")])
+    assert db.data_layer.committed == ["c"]
+    assert "Error for '/character/create/{\"name\": \"a\"}': connection lost" in output
+    assert "constraint violated" in output
+    assert output.count("Success for") == 1
+
+def test_atomic_rolls_back_everything():
+    """Test that /atomic makes one failure roll back the whole batch."""
+    db = FakeDatabase()
+    output = CommandHandler(db).handle_commands(["/atomic", create("a"), create("b", fail=True)])
+    assert db.data_layer.committed == []
+    assert "Rolled back all 2 queries" in output
+    assert db.world_changes == 0
+    assert "Success for" not in output
+
+def test_queries_are_parameter_stable():
+    """Test that repeated commands reuse the same query text with different parameters."""
+    handler = CommandHandler(FakeDatabase())
+    (first, first_params), = handler.parse_command_to_queries('/character/extend/c1/{"age": 30}')
+    (second, second_params), = handler.parse_command_to_queries('/character/extend/c2/{"mood": "calm"}')
+    assert first is second
+    assert first_params == {"key": "c1", "data": {"age": 30}}
+
+def test_arguments_validated_before_running():
+    """Test that invalid arguments are rejected without touching the database."""
+    db = FakeDatabase()
+    output = CommandHandler(db).handle_commands(["/character/update/c1/maybe/{}", "/story/prune/first", "/dragon/list"])
+    assert db.data_layer.transactions == []
+    assert "replace must be true or false" in output
+    assert "message must be a whole number" in output
+    assert "Unsupported entity: dragon" in output
+
+def test_story_commands_use_current_story():
+    """Test that story commands default to the current story and run as Database operations."""
+    class StoryDatabase(FakeDatabase):
+        def get_entry_at(self, story_id, ordinal):
+            return {"entry_id": f"{story_id}-e{ordinal}", "story_id": story_id}
+        def create_branch(self, entry_id, title):
+            self.branched = (entry_id, title)
+            return "branch1"
+    db = StoryDatabase()
+    output = CommandHandler(db).handle_commands(["/story/branch/3/None/Dark path"], context={"story_id": "s1"})
+    assert db.branched == ("s1-e3", "Dark path")
+    assert "branch1" in output
+    assert "cannot run in atomic mode" in CommandHandler(db).handle_commands(
+        ["/atomic", "/story/branch/3/None/Again"], context={"story_id": "s1"})
+
+def test_story_commands_follow_load_in_same_message():
+    """Test that a story command after /story/load acts on the loaded story."""
+    class StoryDatabase(FakeDatabase):
+        def retrieve_state(self, story_id, last_n=None):
+            return {"entries": [], "page": {"entry_count": 3}}
+        def get_entry_at(self, story_id, ordinal):
+            return {"entry_id": f"{story_id}-e{ordinal}", "story_id": story_id}
+        def prune_story(self, entry_id, story_id=None):
+            self.pruned = (entry_id, story_id)
+            return {"message": "pruned", "entries": [], "history": []}
+    db = StoryDatabase()
+    context = {}
+    CommandHandler(db).handle_commands(["/story/load/s2", "/story/prune/3"], context=context)
+    assert db.pruned == ("s2-e3", "s2")
+    assert "No story given" in CommandHandler(db).handle_commands(["/story/prune/3"], context={})
+
+def test_load_checks_empty_story_exists():
+    """Test that loading an empty story sets the current story only if it exists."""
+    class StoryDatabase(FakeDatabase):
+        def retrieve_state(self, story_id, last_n=None):
+            return {"entries": [], "page": {"entry_count": 0}}
+        def get_story(self, story_id):
+            return {"id": story_id} if story_id == "s1" else None
+    context = {}
+    handler = CommandHandler(StoryDatabase())
+    assert "Story s2 not found." in handler.handle_commands(["/story/load/s2"], context=context)
+    assert context == {}
+    handler.handle_commands(["/story/load/s1"], context=context)
+    assert context == {"story_id": "s1"}
+
+def test_list_commands_are_paginated():
+    """Test that list commands page by key with a capped page size and search locations by path prefix."""
+    handler = CommandHandler(FakeDatabase())
+    (query, params), = handler.parse_command_to_queries("/character/list/None/c20/5")
+    assert "ORDER BY n.id LIMIT $limit" in query
+    assert params == {"after": "c20", "limit": 5}
+    (_, params), = handler.parse_command_to_queries("/story/list")
+    assert params == {"after": "", "limit": 20}
+    (query, params), = handler.parse_command_to_queries("/location/list/kingdom/None/500")
+    assert "STARTS WITH $prefix" in query
+    assert params == {"prefix": "kingdom", "after": "", "limit": 100}
+
+def test_location_paths_form_a_hierarchy():
+    """Test that location paths are normalized and expanded into their ancestors for linking."""
+    handler = CommandHandler(FakeDatabase())
+    (query, params), = handler.parse_command_to_queries('/location/create/kingdom. castle.hall/{"name": "Hall"}')
+    assert "MERGE (n)-[:WITHIN]->(p)" in query
+    assert (params["path"], params["parent_path"], params["depth"]) == ("kingdom.castle.hall", "kingdom.castle", 3)
+    assert [(a["path"], a["parent_path"]) for a in params["ancestors"]] == [("kingdom", ""), ("kingdom.castle", "kingdom")]
+    (_, params), = handler.parse_command_to_queries("/location/subtree/kingdom.castle")
+    assert params["prefix"] == "kingdom.castle."
+    (_, params), = handler.parse_command_to_queries("/location/siblings/kingdom")
+    assert params["parent_path"] == ""
+    (query, params), = handler.parse_command_to_queries("/location/delete/kingdom.castle")
+    assert "STARTS WITH $prefix" in query
+    assert params == {"key": "kingdom.castle", "prefix": "kingdom.castle."}
+    output = CommandHandler(FakeDatabase()).handle_commands(['/location/update/kingdom/false/{"parent_path": "x"}', "/location/ancestors/a..b"])
+    assert "cannot be set directly" in output
+    assert "Invalid location path" in output
+
+def test_duplicate_location_path_refused():
+    """Test against a live Neo4j (NEO4J_TEST_URI) that a taken path is refused and a placeholder is adopted."""
+    uri = os.environ.get("NEO4J_TEST_URI")
+    if not uri:
+        pytest.skip("NEO4J_TEST_URI is not set")
+    from Modules.Database import Database
+    db = Database(uri=uri, user=os.environ.get("NEO4J_TEST_USER", "neo4j"), password=os.environ.get("NEO4J_TEST_PASSWORD"))
+    db.setup_schema()
+    root = f"test{uuid.uuid4().hex}"
+    handler = CommandHandler(db)
+    try:
+        assert "Success for" in handler.handle_commands([f'/location/create/{root}.hall/{{"name": "Hall"}}'])
+        output = handler.handle_commands([f'/location/create/{root}.hall/{{"name": "Other", "color": "red"}}'])
+        assert "Error for" in output and "Success for" not in output
+        records = db.data_layer.run_read(
+            "MATCH (l:BaseLocation {path: $path}) RETURN l.name AS name, l.color AS color", {"path": f"{root}.hall"})
+        assert records == [{"name": "Hall", "color": None}]
+        # The root was created as a placeholder ancestor and is filled in.
+        assert "Success for" in handler.handle_commands([f'/location/create/{root}/{{"name": "Root"}}'])
+        records = db.data_layer.run_read(
+            "MATCH (l:BaseLocation {path: $path}) RETURN l.name AS name, l.placeholder AS placeholder", {"path": root})
+        assert records == [{"name": "Root", "placeholder": None}]
+    finally:
+        handler.handle_commands([f"/location/delete/{root}"])
+        db.close()
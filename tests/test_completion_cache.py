@@ -0,0 +1,50 @@
+from Modules.CompletionCache import CompletionCache, completion_key
+
+def test_key_ignores_json_formatting():
+    """Test that prompts differing only in whitespace share a key, but not those differing in section order."""
+    a = completion_key('{"a": 1, "b": [1, 2]}', "model", {"temperature": 0})
+    assert a == completion_key('{"a":1,"b":[1,2]}', "model", {"temperature": 0})
+    assert a != completion_key('{"b":[1,2],"a":1}', "model", {"temperature": 0})
+    assert a != completion_key('{"a": 1, "b": [1, 2]}', "other-model", {"temperature": 0})
+    assert a != completion_key('{"a": 1, "b": [1, 2]}', "model", {"temperature": 0, "top_p": 0.9})
+
+def test_get_and_set():
+    """Test that a stored completion is returned for the same prompt, model and config."""
+    cache = CompletionCache(maxsize=4)
+    assert cache.get("prompt", "model", {}) is None
+    cache.set("prompt", "model", {}, "completion")
+    assert cache.get("prompt", "model", {}) == "completion"
+    assert cache.get("prompt", "model", {"max_new_tokens": 10}) is None
+
+def test_sampled_configs_bypass():
+    """Test that sampled generations are not cached unless explicitly allowed."""
+    cache = CompletionCache(maxsize=4)
+    cache.set("prompt", "model", {"temperature": 0.7}, "completion")
+    assert cache.get("prompt", "model", {"temperature": 0.7}) is None
+    assert cache.stats()["bypassed"] == 1
+    cache = CompletionCache(maxsize=4, allow_sampled=True)
+    cache.set("prompt", "model", {"temperature": 0.7}, "completion")
+    assert cache.get("prompt", "model", {"temperature": 0.7}) == "completion"
+
+def test_sqlite_store_survives_restart(tmp_path):
+    """Test that completions written to disk are served by a new cache."""
+    path = str(tmp_path / "completions.db")
+    cache = CompletionCache(maxsize=4, path=path)
+    cache.set("prompt", "model", {}, "completion")
+    cache.close()
+    cache = CompletionCache(maxsize=4, path=path)
+    assert cache.get("prompt", "model", {}) == "completion"
+    assert cache.stats()["hits"] == 0
+    assert cache.get("prompt", "model", {}) == "completion"
+    assert cache.stats()["hits"] == 1
+    cache.close()
+
+def test_delete_removes_from_disk(tmp_path):
+    """Test that a deleted completion is gone from memory and from the SQLite store."""
+    path = str(tmp_path / "completions.db")
+    cache = CompletionCache(maxsize=4, path=path)
+    cache.set("prompt", "model", {}, '{"truncated": ')
+    cache.delete("prompt", "model", {})
+    assert cache.get("prompt", "model", {}) is None
+    cache.close()
+    assert CompletionCache(maxsize=4, path=path).get("prompt", "model", {}) is None
@@ -0,0 +1,63 @@
+from Modules.DatabaseMap import DatabaseMapBuilder, render_map
+
+class FakeDatabase:
+    """Minimal stand-in recording listeners and serving a fixed state."""
+    def __init__(self, state):
+        self.state = state
+        self.listeners = []
+        self.reads = 0
+        self.entry_count = 1
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+    def get_entry_count(self, story_id):
+        return self.entry_count
+    def get_state_at(self, story_id):
+        self.reads += 1
+        return dict(self.state)
+    def notify(self, event, story_id, changes=None):
+        for listener in self.listeners:
+            listener(event, story_id, changes)
+
+def test_render_map_deduplicates_states():
+    """Test that identical states share one entry in the string pool."""
+    compact = render_map({("Character", "c1"): "tired", ("Character", "c2"): "tired", ("Trait", "t1"): "hidden"})
+    assert compact == {"s": ["tired", "hidden"], "C": {"c1": 0, "c2": 0}, "T": {"t1": 1}}
+    assert render_map({}) == {}
+
+def test_commits_update_map_without_reading():
+    """Test that committed changes are applied to the cached map in place."""
+    db = FakeDatabase({"c1": {"type": "Character", "state": "tired", "history_id": "h1"}})
+    builder = DatabaseMapBuilder(db)
+    assert builder.get("story1") == {"s": ["tired"], "C": {"c1": 0}}
+    db.entry_count += 1
+    db.notify("commit", "story1", [{"type": "Location", "id": "l1", "new_state": "burning"}])
+    assert builder.get("story1") == {"s": ["tired", "burning"], "C": {"c1": 0}, "L": {"l1": 1}}
+    assert db.reads == 1
+
+def test_invalidation_rebuilds():
+    """Test that an invalidated story is read from the database again."""
+    db = FakeDatabase({"c1": {"type": "Character", "state": "tired", "history_id": "h1"}})
+    builder = DatabaseMapBuilder(db)
+    builder.get("story1")
+    db.state = {}
+    db.notify("invalidate", "story1")
+    assert builder.get("story1") == {}
+    assert db.reads == 2
+
+def test_entries_from_other_processes_rebuild():
+    """Test that a story whose entry count moved without a local commit is read again."""
+    db = FakeDatabase({"c1": {"type": "Character", "state": "tired", "history_id": "h1"}})
+    builder = DatabaseMapBuilder(db)
+    builder.get("story1")
+    db.state = {"c1": {"type": "Character", "state": "rested", "history_id": "h2"}}
+    db.entry_count += 1
+    assert builder.get("story1") == {"s": ["rested"], "C": {"c1": 0}}
+    assert db.reads == 2
+
+def test_old_maps_expire():
+    """Test that a map older than max_age is read again."""
+    db = FakeDatabase({})
+    builder = DatabaseMapBuilder(db, max_age=0)
+    builder.get("story1")
+    builder.get("story1")
+    assert db.reads == 2
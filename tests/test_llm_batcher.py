@@ -0,0 +1,60 @@
+import threading
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from Modules.LLMBatcher import LLMBatcher, LocalTextGenerationBackend
+
+def submit_concurrently(batcher, prompts, config):
+    results = [None] * len(prompts)
+    def worker(i):
+        results[i] = batcher.submit(prompts[i], "model", config)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(prompts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_prompts_are_batched():
+    """Test that prompts arriving within the window share one backend call."""
+    backend = LocalTextGenerationBackend(respond=lambda prompt, config: prompt.upper())
+    batcher = LLMBatcher(backend, max_batch_size=4, max_wait=0.2)
+    prompts = ["a", "b", "c", "d"]
+    assert submit_concurrently(batcher, prompts, {}) == ["A", "B", "C", "D"]
+    assert len(backend.calls) == 1
+    assert sorted(backend.calls[0]) == prompts
+
+def test_identical_deterministic_prompts_coalesced():
+    """Test that identical prompts generate once when decoding is deterministic."""
+    backend = LocalTextGenerationBackend()
+    batcher = LLMBatcher(backend, max_batch_size=3, max_wait=0.2)
+    assert submit_concurrently(batcher, ["same", "same", "same"], {"temperature": 0}) == ["same"] * 3
+    assert backend.calls == [["same"]]
+    assert batcher.stats()["coalesced"] == 2
+
+def test_failed_batch_falls_back_to_single_calls():
+    """Test that a failing batch is retried prompt by prompt."""
+    class FlakyBackend(LocalTextGenerationBackend):
+        def generate_batch(self, prompts, model, config):
+            if len(prompts) > 1:
+                raise RuntimeError("batch rejected")
+            return super().generate_batch(prompts, model, config)
+    backend = FlakyBackend()
+    batcher = LLMBatcher(backend, max_batch_size=2, max_wait=0.2)
+    assert submit_concurrently(batcher, ["x", "y"], {"temperature": 0.7}) == ["x", "y"]
+    assert sorted(map(tuple, backend.calls)) == [("x",), ("y",)]
+
+def test_unbatched_backend_called_directly():
+    """Test that backends without batching are called once per prompt."""
+    class SingleBackend:
+        supports_batching = False
+        def generate(self, prompt, model, config):
+            return prompt + "!"
+    assert LLMBatcher(SingleBackend()).submit("hi", "model", {}) == "hi!"
+
+def test_submit_times_out():
+    """Test that submit gives up after its timeout instead of waiting on a slow batch."""
+    batcher = LLMBatcher(LocalTextGenerationBackend(latency=0.5), max_wait=0.01, timeout=0.05)
+    with pytest.raises(TimeoutError):
+        batcher.submit("slow", "model", {})
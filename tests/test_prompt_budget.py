@@ -0,0 +1,67 @@
+import json
+import pytest
+from Modules.PromptBudget import PromptBudget, PromptBudgetError, TokenCounter
+
+class CharCounter(TokenCounter):
+    """Counts one token per character so budgets are easy to reason about."""
+    def __init__(self):
+        self.encoding = None
+    def count(self, text):
+        return len(text)
+
+def make_prompt(history, errors=()):
+    return {"directives": {}, "errors": list(errors), "OOC": "", "context": {}, "content": "Go on.", "history": list(history), "database_map": {}}
+
+def test_recent_history_kept_verbatim():
+    """Test that short histories are sent unchanged."""
+    budget = PromptBudget(max_tokens=10000, recent=4, fanout=2, counter=CharCounter())
+    history = [f"Event {i}." for i in range(5)]
+    assert budget.compact_history(history) == history
+
+def test_older_history_rolled_up():
+    """Test that older summaries are rolled up hierarchically and the newest kept verbatim."""
+    budget = PromptBudget(max_tokens=10000, recent=2, fanout=2, counter=CharCounter())
+    history = [f"Event {i}. More detail." for i in range(1, 11)]
+    compacted = budget.compact_history(history)
+    assert compacted[-2:] == history[-2:]
+    # Entries 1-4 went through two levels of rollup, 5-8 through one.
+    assert compacted[0] == "[Entries 1-4] Event 1. Event 3."
+    assert compacted[1] == "[Entries 5-8] Event 5. Event 7."
+    assert len(compacted) == 4
+
+def test_rollups_memoized():
+    """Test that no group of summaries is rolled up twice as history grows."""
+    calls = []
+    def summarizer(texts):
+        calls.append(tuple(texts))
+        return " ".join(texts)
+    budget = PromptBudget(recent=1, fanout=2, summarizer=summarizer, counter=CharCounter())
+    history = ["a", "b", "c", "d", "e", "f"]
+    budget.compact_history(history)
+    budget.compact_history(history + ["g"])
+    budget.compact_history(history + ["g"])
+    assert len(calls) == len(set(calls))
+
+def test_fit_stays_under_budget():
+    """Test that the oldest history and errors are dropped to fit the budget."""
+    budget = PromptBudget(max_tokens=200, recent=50, fanout=2, counter=CharCounter())
+    history = [f"Summary number {i}." for i in range(20)]
+    prompt = budget.fit(make_prompt(history, errors=["old error", "new error"]))
+    assert len(prompt) <= 200
+    sent = json.loads(prompt)
+    assert sent["history"][-1] == history[-1]
+    assert sent["history"] == history[-len(sent["history"]):]
+    assert budget.last_report["total"] == len(prompt)
+
+def test_fit_raises_when_base_prompt_too_large():
+    """Test that a prompt that cannot fit without history raises."""
+    budget = PromptBudget(max_tokens=50, counter=CharCounter())
+    with pytest.raises(PromptBudgetError):
+        budget.fit(make_prompt(["a"]) | {"content": "x" * 100})
+
+def test_fit_matches_json_dumps():
+    """Test that the fitted prompt serializes exactly like json.dumps of the fitted dict."""
+    budget = PromptBudget(max_tokens=10000, recent=2, fanout=2, counter=CharCounter())
+    prompt_obj = make_prompt([f"Summary {i}." for i in range(7)], errors=["An error."])
+    prompt = budget.fit(prompt_obj)
+    assert prompt == json.dumps(prompt_obj)
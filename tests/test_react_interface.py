@@ -1,15 +1,23 @@
+import json
 import pytest
 from flask import Flask
-from Modules.ReactInterface import react_interface
+from Modules.ReactInterface import create_react_interface
 
 @pytest.fixture
-def client(mocker):
-    """Fixture to set up the Flask test client with mocked database."""
-    app = Flask(__name__)
-    app.register_blueprint(react_interface)
+def mock_db(mocker):
+    """Fixture providing a mocked Database instance."""
+    return mocker.MagicMock()
+
+@pytest.fixture
+def mock_llm(mocker):
+    """Fixture providing a mocked LLM instance."""
+    return mocker.Mock()
 
-    # Mock the Database class
-    mock_db = mocker.patch('Modules.ReactInterface.db')
+@pytest.fixture
+def client(mock_db, mock_llm):
+    """Fixture to set up the Flask test client with mocked database and LLM."""
+    app = Flask(__name__)
+    app.register_blueprint(create_react_interface(mock_db, mock_llm))
 
     # Mock methods for the Database instance
     mock_db.retrieve_state.return_value = {
@@ -17,8 +25,19 @@ def client(mocker):
         "state": [{"trait_id": "trait1", "trait_title": "Bravery", "trait_description": "The hero is brave."}]
     }
     mock_db.commit_entry.return_value = "new_entry_id"
-    mock_db.create_branch.return_value = "new_branch_entry_id"
-    mock_db.prune_story.return_value = "Story successfully rolled back to Entry entry1."
+    mock_db.create_branch.return_value = "branch1"
+    mock_db.prune_story.return_value = {
+        "message": "Story successfully rolled back to Entry entry1.",
+        "story_id": "story1",
+        "entries": ["entry3", "entry2"],
+        "history": ["history2"]
+    }
+    mock_db.get_entries_page.return_value = {
+        "entries": [{"entry_id": "entry2", "ordinal": 2, "entry_text": "The hero sets out."}],
+        "page": {"entry_count": 3, "before": "entry2", "after": "entry2", "has_more_before": True, "has_more_after": True}
+    }
+    mock_db.get_entries_window.return_value = mock_db.get_entries_page.return_value
+    mock_db.execute_cypher.return_value = ([{"s": {"id": "story1"}}], None)
 
     with app.test_client() as client:
         yield client
@@ -32,6 +51,36 @@ def test_load_story(client):
         "state": [{"trait_id": "trait1", "trait_title": "Bravery", "trait_description": "The hero is brave."}]
     }
 
+def test_load_story_page(client, mock_db):
+    """Test that load_story passes the page limit through to the database."""
+    response = client.get('/api/story/load/story1?limit=20')
+    assert response.status_code == 200
+    mock_db.retrieve_state.assert_called_with(story_id="story1", last_n=20)
+
+def test_load_story_invalid_limit(client):
+    """Test that a non-positive page limit is rejected."""
+    response = client.get('/api/story/load/story1?limit=0')
+    assert response.status_code == 400
+
+def test_load_entries_before_cursor(client, mock_db):
+    """Test paging backwards from an entry cursor."""
+    response = client.get('/api/story/entries/story1?before=entry3&limit=1')
+    assert response.status_code == 200
+    assert response.json == mock_db.get_entries_page.return_value
+    mock_db.get_entries_page.assert_called_with(story_id="story1", after=None, before="entry3", limit=1)
+
+def test_load_entries_window(client, mock_db):
+    """Test loading a window around an entry."""
+    response = client.get('/api/story/entries/story1?around=entry2&radius=1')
+    assert response.status_code == 200
+    mock_db.get_entries_window.assert_called_with(story_id="story1", entry_id="entry2", radius=1)
+
+def test_load_entries_unknown_cursor(client, mock_db):
+    """Test that an unknown cursor is reported as a bad request."""
+    mock_db.get_entries_page.side_effect = ValueError("Entry missing is not part of story story1")
+    response = client.get('/api/story/entries/story1?after=missing')
+    assert response.status_code == 400
+
 def test_add_entry(client):
     """Test the add_entry endpoint."""
     response = client.post('/api/story/entry', json={
@@ -49,10 +98,38 @@ def test_create_branch(client):
         "branch_id": "branch1"
     })
     assert response.status_code == 201
-    assert response.json == {"new_branch_entry_id": "new_branch_entry_id"}
+    assert response.json == {"branch_story_id": "branch1"}
 
 def test_prune_story(client):
     """Test the prune_story endpoint."""
     response = client.delete('/api/story/prune/entry1')
     assert response.status_code == 200
-    assert response.json == {"message": "Story successfully rolled back to Entry entry1."}
\ No newline at end of file
+    assert response.json == {
+        "message": "Story successfully rolled back to Entry entry1.",
+        "story_id": "story1",
+        "entries": ["entry3", "entry2"],
+        "history": ["history2"]
+    }
+
+def test_stream_turn(client, mock_db, mock_llm):
+    """Test that prose and updates are relayed as Server-Sent Events while the entry is written."""
+    response_text = json.dumps({
+        "OOC": "",
+        "response": {
+            "content": "Once upon",
+            "updates": [{"type": "Trait", "id": "trait1", "new_state": "Curious"}],
+            "summary": "A tale begins.",
+            "core": ""
+        }
+    })
+    mock_llm.stream_prompt_sync.return_value = iter([response_text[:40], response_text[40:]])
+    response = client.post('/api/story/stream', json={"story_id": "story1", "user_text": "Begin."})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert 'data: {"content": "O"}' in body
+    assert 'event: update\ndata: {"type": "Trait", "id": "trait1", "new_state": "Curious"}' in body
+    assert "event: done" in body
+    writer = mock_db.begin_entry.return_value.__enter__.return_value
+    writer.apply.assert_called_once_with({"type": "Trait", "id": "trait1", "new_state": "Curious"})
+    writer.commit.assert_called_once_with("Once upon", "A tale begins.")
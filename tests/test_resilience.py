@@ -0,0 +1,55 @@
+import pytest
+from Modules.Resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, call_with_retry, is_retryable
+
+class HTTPStatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = type("Response", (), {"status_code": status_code})()
+
+def test_is_retryable():
+    """Test that timeouts, connection errors and overload statuses are retryable."""
+    assert is_retryable(TimeoutError())
+    assert is_retryable(ConnectionResetError())
+    assert is_retryable(HTTPStatusError(503))
+    assert is_retryable(HTTPStatusError(429))
+    assert not is_retryable(HTTPStatusError(400))
+    assert not is_retryable(ValueError("bad prompt"))
+
+def test_retries_transient_errors():
+    """Test that transient failures are retried up to the attempt limit."""
+    calls = []
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TimeoutError()
+        return "ok"
+    assert call_with_retry(flaky, RetryPolicy(max_attempts=3), sleep=lambda _: None) == "ok"
+    calls.clear()
+    with pytest.raises(TimeoutError):
+        call_with_retry(flaky, RetryPolicy(max_attempts=2), sleep=lambda _: None)
+    assert len(calls) == 2
+
+def test_does_not_retry_permanent_errors():
+    """Test that non-retryable errors are raised at once."""
+    calls = []
+    def bad():
+        calls.append(1)
+        raise HTTPStatusError(400)
+    with pytest.raises(HTTPStatusError):
+        call_with_retry(bad, RetryPolicy(max_attempts=5), sleep=lambda _: None)
+    assert len(calls) == 1
+
+def test_circuit_breaker_opens_and_recovers():
+    """Test that the breaker fails fast after repeated failures and closes after a good trial call."""
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.0)
+    def down():
+        raise TimeoutError()
+    with pytest.raises(TimeoutError):
+        call_with_retry(down, RetryPolicy(max_attempts=2), breaker, sleep=lambda _: None)
+    assert breaker.opened_at is not None
+    breaker.reset_timeout = 60.0
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(lambda: "ok", RetryPolicy(), breaker)
+    breaker.reset_timeout = 0.0
+    assert call_with_retry(lambda: "ok", RetryPolicy(), breaker) == "ok"
+    assert breaker.state == "closed"
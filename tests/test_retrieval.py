@@ -0,0 +1,81 @@
+from Modules.PromptBudget import TokenCounter
+from Modules.Retrieval import BM25Index, ContextRetriever, tokenize
+
+WORLD = [
+    {"kind": "traits", "id": "t1", "title": "Brave", "description": "Faces danger without fear."},
+    {"kind": "characters", "id": "c1", "name": "Mara Vell", "description": "A smuggler captain with a scarred face.", "traits": ["t1"]},
+    {"kind": "characters", "id": "c2", "name": "Old Tobin", "description": "Keeper of the lighthouse on the cliff.", "traits": []},
+    {"kind": "locations", "id": "l1", "name": "The Lighthouse", "description": "A tall tower above the harbour.", "traits": []},
+    {"kind": "locations", "id": "l2", "name": "Harbour Market", "description": "Stalls of fish and spices.", "traits": []},
+]
+
+def make_retriever(**kwargs):
+    retriever = ContextRetriever(db=None, counter=TokenCounter(), **kwargs)
+    retriever.build(WORLD)
+    return retriever
+
+def test_bm25_ranks_matching_documents():
+    """Test that documents sharing rarer query terms rank higher."""
+    index = BM25Index()
+    index.add("a", tokenize("fish stalls and spices"))
+    index.add("b", tokenize("a tall tower"))
+    index.add("c", tokenize("fish fish fish"))
+    ranked = [doc_id for doc_id, _ in index.search(tokenize("spices and fish"))]
+    assert ranked[0] == "a"
+    assert "b" not in ranked
+    index.remove("a")
+    assert [doc_id for doc_id, _ in index.search(tokenize("spices"))] == []
+
+def test_named_entities_ranked_first():
+    """Test that entries named in the text come before lexical matches."""
+    retriever = make_retriever()
+    ranked = retriever.rank("I ask Mara Vell about the lighthouse keeper.")
+    assert ranked[0] == "c1"
+    assert set(ranked[1:3]) == {"c2", "l1"}
+
+def test_context_lists_relevant_entries_with_trait_titles():
+    """Test that context holds only relevant entries, grouped by kind."""
+    retriever = make_retriever()
+    context = retriever.get_context("Mara Vell walks to the market.")
+    assert [c["id"] for c in context["characters"]] == ["c1"]
+    assert context["characters"][0]["traits"] == ["Brave"]
+    assert [l["id"] for l in context["locations"]] == ["l2"]
+
+def test_context_respects_limits():
+    """Test that the item limit and token budget cap the context."""
+    assert sum(len(v) for v in make_retriever(max_items=1).get_context("lighthouse harbour").values()) == 1
+    assert make_retriever(max_tokens=5).get_context("lighthouse harbour") == {}
+
+class FakeDatabase:
+    def __init__(self, world):
+        self.world = world
+        self.listeners = []
+        self.exports = 0
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+    def export_world(self):
+        self.exports += 1
+        return list(self.world)
+    def export_command_world(self):
+        return [{"kind": "characters", "id": "b1", "name": "Base Rook", "description": "A command layer character.", "traits": []}]
+
+def test_names_found_by_whole_words():
+    """Test that names are matched word by word, in order of first mention."""
+    retriever = make_retriever()
+    assert retriever.mentioned("Old Tobin's lamp and Mara Vell's ship") == ["c2", "c1"]
+    assert retriever.mentioned("Mara Vellum and old  tobin") == ["c2"]
+
+def test_world_writes_invalidate_index():
+    """Test that a world event makes the next rank rebuild from both worlds."""
+    db = FakeDatabase(WORLD)
+    retriever = ContextRetriever(db=db, counter=TokenCounter())
+    assert retriever.rank("Base Rook")[0] == "b1"
+    retriever.rank("Mara Vell")
+    assert db.exports == 1
+    db.world = WORLD + [{"kind": "characters", "id": "c3", "name": "Ines", "description": "", "traits": []}]
+    for listener in db.listeners:
+        listener("world", None, None)
+    assert retriever.built_at is None
+    retriever._rebuild()
+    assert db.exports == 2
+    assert retriever.rank("Ines waves")[0] == "c3"
@@ -0,0 +1,64 @@
+import json
+import pytest
+from Modules.StreamParser import StreamingResponseParser
+
+TEMPLATE = {
+    "OOC": "",
+    "response": {
+        "content": "",
+        "updates": [],
+        "summary": "",
+        "core": ""
+    }
+}
+
+RESPONSE = {
+    "OOC": "Noted.",
+    "response": {
+        "content": "The door creaks open.\nA \"draft\" chills the hall — \U0001F56F flickers.",
+        "updates": [
+            {"type": "Trait", "id": "trait1", "new_state": "Uneasy"},
+            {"type": "Location", "id": "loc1", "new_state": "Door open", "extra": [1, 2.5, True, None]}
+        ],
+        "summary": "The hero opens the door.",
+        "core": "door"
+    }
+}
+
+def parse_in_chunks(text, size):
+    """Feeds text to a parser in fixed-size chunks and returns the parser and its events."""
+    parser = StreamingResponseParser(TEMPLATE)
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i:i + size]))
+    return parser, events
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_events_match_full_parse(size):
+    """Test that streamed events reconstruct the response regardless of chunking."""
+    text = json.dumps(RESPONSE)
+    parser, events = parse_in_chunks(text, size)
+    content = "".join(e.value for e in events if e.kind == "text")
+    assert content == RESPONSE["response"]["content"]
+    assert [e.value for e in events if e.kind == "item"] == RESPONSE["response"]["updates"]
+    fields = {e.path: e.value for e in events if e.kind == "field"}
+    assert fields[("OOC",)] == "Noted."
+    assert fields[("response", "summary")] == "The hero opens the door."
+    assert events[-1].kind == "done"
+    assert parser.close() == RESPONSE
+
+def test_updates_emitted_before_stream_ends():
+    """Test that each update is emitted as soon as it closes."""
+    text = json.dumps(RESPONSE)
+    cut = text.index('"summary"')
+    parser = StreamingResponseParser(TEMPLATE)
+    events = parser.feed(text[:cut])
+    assert len([e for e in events if e.kind == "item"]) == 2
+    with pytest.raises(ValueError):
+        parser.close()
+
+def test_ignores_code_fence():
+    """Test that text around the JSON object is ignored."""
+    text = "```json\n" + json.dumps(RESPONSE, indent=2) + "\n```"
+    parser, events = parse_in_chunks(text, 5)
+    assert parser.close() == RESPONSE
@@ -0,0 +1,104 @@
+import threading
+import time
+from Modules.TurnScheduler import SchedulerFullError, TurnScheduler
+
+def test_turns_within_a_story_are_serialized():
+    """Test that turns sharing a key never overlap and run in submission order."""
+    scheduler = TurnScheduler(max_concurrency=4)
+    order, active, overlaps = [], [0], []
+    lock = threading.Lock()
+    def turn(i):
+        with lock:
+            active[0] += 1
+            overlaps.append(active[0])
+        time.sleep(0.005)
+        with lock:
+            active[0] -= 1
+            order.append(i)
+    futures = [scheduler.submit("story1", turn, i) for i in range(10)]
+    for future in futures:
+        future.result()
+    assert order == list(range(10))
+    assert max(overlaps) == 1
+    scheduler.shutdown()
+
+def test_stories_run_concurrently_within_limit():
+    """Test that different stories run in parallel up to the concurrency limit."""
+    scheduler = TurnScheduler(max_concurrency=2)
+    running, peak = [0], [0]
+    lock = threading.Lock()
+    def turn():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+    futures = [scheduler.submit(f"story{i}", turn) for i in range(6)]
+    for future in futures:
+        future.result()
+    assert peak[0] == 2
+    stats = scheduler.stats()
+    assert stats["completed"] == 6
+    assert stats["queued"] == 0
+    assert stats["max_wait"] > 0
+    scheduler.shutdown()
+
+def test_stream_relays_items_and_errors():
+    """Test that streamed turns hand over items and re-raise failures."""
+    scheduler = TurnScheduler()
+    assert list(scheduler.stream("story1", lambda: iter([1, 2, 3]))) == [1, 2, 3]
+    def failing():
+        yield 1
+        raise ValueError("boom")
+    stream = scheduler.stream("story1", failing)
+    assert next(stream) == 1
+    try:
+        next(stream)
+        assert False, "expected the turn's error"
+    except ValueError as e:
+        assert str(e) == "boom"
+    scheduler.shutdown()
+    assert scheduler.stats()["failed"] == 1
+
+def test_full_queues_refuse_turns():
+    """Test that turns beyond the waiting limits are rejected instead of queued."""
+    scheduler = TurnScheduler(max_concurrency=1, max_pending=3, max_pending_per_key=2)
+    release = threading.Event()
+    futures = [scheduler.submit("chat1", release.wait)]
+    while scheduler.stats()["running"] == 0:
+        time.sleep(0.001)
+    futures += [scheduler.submit("chat1", lambda: None) for _ in range(2)]
+    try:
+        scheduler.submit("chat1", lambda: None)
+        assert False, "per-key limit not enforced"
+    except SchedulerFullError:
+        pass
+    futures.append(scheduler.submit("chat2", lambda: None))
+    try:
+        scheduler.submit("chat3", lambda: None)
+        assert False, "total limit not enforced"
+    except SchedulerFullError:
+        pass
+    release.set()
+    for future in futures:
+        future.result()
+    assert scheduler.stats()["rejected"] == 2
+    scheduler.shutdown()
+
+def test_shutdown_drains_and_cancels_after_timeout():
+    """Test that shutdown lets running turns finish and cancels turns still waiting at the timeout."""
+    scheduler = TurnScheduler(max_concurrency=1)
+    running = scheduler.submit("chat1", time.sleep, 0.05)
+    waiting = scheduler.submit("chat1", lambda: "late")
+    while not running.running():
+        time.sleep(0.001)
+    scheduler.shutdown(wait=True, timeout=0.01)
+    assert running.done() and not running.cancelled()
+    assert waiting.cancelled()
+    assert scheduler.stats()["cancelled"] == 1
+    try:
+        scheduler.submit("chat1", lambda: None)
+        assert False, "submit accepted after shutdown"
+    except RuntimeError:
+        pass